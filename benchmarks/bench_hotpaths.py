@@ -0,0 +1,116 @@
+# Microbenchmarks of the local CPU stages of a batch, with time and peak
+# allocation checked against saved baselines (see conftest.py). The stages
+# main() runs per image are measured at every size the UI allows, the
+# heavier post-processing at a few representative ones.
+#
+#   pip install pytest-benchmark
+#   python -m pytest benchmarks/bench_hotpaths.py --update-baselines   # record
+#   python -m pytest benchmarks/bench_hotpaths.py                      # compare
+#
+# Baselines are machine specific and checked in per machine class
+# (baselines/<class>.json); --strict-baselines fails a stage that has none.
+# --time-threshold / --small-time-threshold / --alloc-threshold set the
+# allowed slack.
+import io
+
+import pytest
+from PIL import Image
+from streamlit.elements.lib.image_utils import image_to_url
+from streamlit.elements.lib.layout_utils import LayoutConfig
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+from flux_analysis import analyze, rank_variants
+from flux_blurhash import placeholder
+from flux_export import CHANNEL_FORMATS, export_image
+from flux_images import build_zip
+from flux_palette import check_palette
+from flux_pngmeta import read_params, stamp
+from flux_upscale import upscale_image
+
+# Every width/height the number inputs accept (128..1024, step 128)
+UI_SIZES = [(w, h) for w in range(128, 1025, 128) for h in range(128, 1025, 128)]
+SIZE_IDS = [f"{w}x{h}" for w, h in UI_SIZES]
+REPRESENTATIVE = [(512, 512), (1024, 768), (1024, 1024)]
+REPRESENTATIVE_IDS = [f"{w}x{h}" for w, h in REPRESENTATIVE]
+PAYLOAD = {"prompt": "Produktfoto auf hellem Grund", "seed": 12345, "guidance_scale": 7.5,
+           "num_inference_steps": 50, "scheduler": "Standard-Produktion"}
+
+
+def decode(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+MEDIA = MediaFileManager(MemoryMediaFileStorage("/media"))
+
+
+def st_image(data):
+    # What st.image does with the PNG bytes of every slot on every rerun.
+    # They are not inlined as base64: image_to_url checks format and width
+    # (re-encoding only above the content width), then the media file
+    # manager hashes and keeps the bytes and the page gets their URL.
+    # Without a running app image_to_url stops before that last step.
+    image_to_url(data, LayoutConfig(width="stretch"), False, "RGB", "auto", "bench")
+    return MEDIA.add(data, "image/png", "bench")
+
+
+@pytest.mark.parametrize("size", UI_SIZES, ids=SIZE_IDS)
+def test_decode(stage, pngs, size):
+    stage(decode, pngs(*size))
+
+
+@pytest.mark.parametrize("size", UI_SIZES, ids=SIZE_IDS)
+def test_placeholder(stage, pngs, size):
+    # Our own preview path: draft decode, resize and BlurHash of every image
+    stage(placeholder, pngs(*size))
+
+
+@pytest.mark.parametrize("size", UI_SIZES, ids=SIZE_IDS)
+def test_st_image(stage, pngs, size):
+    stage(st_image, pngs(*size))
+
+
+# Memory-bound, swings by more than the default threshold on shared machines
+@pytest.mark.time_threshold(1.0)
+@pytest.mark.parametrize("size", UI_SIZES, ids=SIZE_IDS)
+def test_zip(stage, pngs, size):
+    stage(build_zip, [pngs(*size)] * 4)
+
+
+@pytest.mark.parametrize("size", REPRESENTATIVE, ids=REPRESENTATIVE_IDS)
+def test_analyze(stage, pngs, size):
+    stage(analyze, pngs(*size))
+
+
+def test_rank(stage, pngs):
+    analyses = [analyze(pngs(512, 512))] * 4
+
+    def rank():
+        return rank_variants([dict(a) for a in analyses])
+    stage(rank)
+
+
+@pytest.mark.parametrize("size", REPRESENTATIVE, ids=REPRESENTATIVE_IDS)
+def test_stamp(stage, pngs, size):
+    stage(stamp, pngs(*size), dict(PAYLOAD, width=size[0], height=size[1]))
+
+
+def test_read_params(stage, pngs):
+    stage(read_params, stamp(pngs(1024, 1024), PAYLOAD))
+
+
+@pytest.mark.parametrize("size", REPRESENTATIVE, ids=REPRESENTATIVE_IDS)
+def test_palette(stage, pngs, size):
+    stage(check_palette, pngs(*size), ["#0A2540", "#635BFF", "#FFFFFF"])
+
+
+@pytest.mark.parametrize("size", REPRESENTATIVE, ids=REPRESENTATIVE_IDS)
+def test_export(stage, pngs, size):
+    stage(export_image, pngs(*size), CHANNEL_FORMATS[:2])
+
+
+@pytest.mark.parametrize("size", REPRESENTATIVE, ids=REPRESENTATIVE_IDS)
+def test_upscale(stage, pngs, size):
+    stage(upscale_image, pngs(size[0] // 2, size[1] // 2), size[0], size[1], True)
@@ -0,0 +1,99 @@
+# Peak memory of the result path (download -> preview -> ZIP), measured with
+# tracemalloc for 1, 4 and 16 images. "before" replays the old code path in
+# main(), "after" uses flux_images.
+#
+#   python benchmarks/bench_memory.py [--width 1024] [--height 768]
+import argparse
+import io
+import os
+import sys
+import tracemalloc
+import zipfile
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from flux_images import build_zip  # noqa: E402
+
+CHUNK = 64 * 1024
+
+
+def make_png(width, height):
+    # Noise does not compress, so the PNG is as large as a worst-case photo
+    image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def download(chunks):
+    # What requests does for response.content
+    return b"".join(chunks)
+
+
+# Both pipelines return what the session keeps alive afterwards: the bytes
+# registered with Streamlit's media file manager for the previews, and the
+# ZIP handed to st.download_button.
+
+
+def before(responses):
+    all_images_data = []
+    displayed = []
+    for chunks in responses:
+        content = download(chunks)
+        all_images_data.append(content)
+        image = Image.open(io.BytesIO(content))
+        # st.image re-encodes PIL images to PNG before sending them
+        encoded = io.BytesIO()
+        image.save(encoded, "PNG")
+        displayed.append(encoded.getvalue())
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for idx, img_data in enumerate(all_images_data):
+            zip_file.writestr(f"generated_image_{idx + 1}.png", img_data)
+    return displayed, zip_buffer.getvalue()
+
+
+def after(responses):
+    images = []
+    for chunks in responses:
+        # st.image gets the bytes as they are
+        images.append(download(chunks))
+    return images, build_zip(images)
+
+
+def measure(pipeline, responses):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    result = pipeline(responses)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=768)
+    parser.add_argument("--counts", default="1,4,16")
+    args = parser.parse_args()
+
+    png = make_png(args.width, args.height)
+    print(f"image: {args.width}x{args.height}, {len(png) / 1024:.0f} KiB")
+    print(f"{'images':>6} {'before KiB':>12} {'after KiB':>12} {'saved':>7}")
+    for count in [int(c) for c in args.counts.split(",")]:
+        # Chunks as they arrive from the socket; copies so no image is shared
+        responses = [
+            [bytes(png[i:i + CHUNK]) for i in range(0, len(png), CHUNK)]
+            for _ in range(count)
+        ]
+        peak_before = measure(before, responses)
+        peak_after = measure(after, responses)
+        saved = 1 - peak_after / peak_before
+        print(f"{count:>6} {peak_before / 1024:>12.0f} {peak_after / 1024:>12.0f} {saved:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
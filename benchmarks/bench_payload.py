@@ -0,0 +1,41 @@
+# Bytes sent to the browser per rerun of the app, measured with Streamlit's
+# AppTest: the serialized size of every element delta in the page.
+#
+#   python benchmarks/bench_payload.py [path/to/app.py]
+import os
+import sys
+from collections import Counter
+
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+
+def walk(node):
+    yield node
+    for child in getattr(node, "children", {}).values():
+        yield from walk(child)
+
+
+def measure(script):
+    at = AppTest.from_file(script, default_timeout=30)
+    at.secrets["FLUX_API_KEY"] = "benchmark"
+    at.run()
+    sizes = Counter()
+    for node in walk(at._tree):
+        proto = getattr(node, "proto", None)
+        if proto is not None and not getattr(node, "children", None):
+            sizes[node.type] += len(proto.SerializeToString())
+    return sizes
+
+
+def main():
+    script = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, "flux_four_pics.py")
+    sizes = measure(script)
+    for element, size in sizes.most_common():
+        print(f"{element:>16} {size:>8} B")
+    print(f"{'total':>16} {sum(sizes.values()):>8} B per rerun")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# Estimated end-to-end time saved by "render small, upscale locally" per
+# resolution. Only the local upscale time is measured here. API time is a
+# prediction from the app's ETA model (.flux_state/eta_model.json) if it has
+# enough samples, otherwise from --seconds-per-megapixel, so the API and
+# saved columns are estimates and are marked "est." in the output.
+#
+#   python benchmarks/bench_upscale.py [--factor 0.5] [--steps 50]
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import flux_eta  # noqa: E402
+from flux_upscale import render_size, upscale_image  # noqa: E402
+
+RESOLUTIONS = [(512, 512), (768, 768), (1024, 768), (1024, 1024)]
+
+
+def api_seconds(model, width, height, steps, fallback):
+    x = flux_eta.features(width, height, steps, "Standard-Produktion", 0)
+    predicted = model.predict(x) if model else None
+    return predicted if predicted is not None else 2.0 + fallback * width * height / 1e6 * steps / 50
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--factor", type=float, default=0.5)
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--seconds-per-megapixel", type=float, default=8.0)
+    parser.add_argument("--model", default=os.path.join(".flux_state", "eta_model.json"))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    model = flux_eta.EtaModel(args.model) if os.path.exists(args.model) else None
+    source = "ETA model prediction" if model and model.samples >= model.min_samples else "linear prior"
+    print(f"API time estimated from {source} (not measured), factor {args.factor}, {args.steps} steps")
+    print(f"{'target':>10} {'render':>10} {'full s est.':>12} {'small s est.':>13} {'upscale s':>10} "
+          f"{'saved s est.':>13}")
+    rng = np.random.default_rng(0)
+    for width, height in RESOLUTIONS:
+        render_width, render_height = render_size(width, height, args.factor)
+        pixels = (rng.random((render_height, render_width, 3)) * 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, "PNG")
+        data = buffer.getvalue()
+
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            upscale_image(data, width, height)
+        upscale = (time.perf_counter() - started) / args.repeat
+
+        full = api_seconds(model, width, height, args.steps, args.seconds_per_megapixel)
+        small = api_seconds(model, render_width, render_height, args.steps, args.seconds_per_megapixel)
+        saved = full - (small + upscale)
+        print(f"{width}x{height:<5} {render_width}x{render_height:<5} {full:>12.2f} {small:>13.2f} "
+              f"{upscale:>10.2f} {saved:>13.2f}")
+    print("upscale s is measured; the other times are estimates of the API latency")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# Shared setup for the pytest-benchmark suite (bench_hotpaths.py): fixture
+# PNGs, allocation measurement and the baseline file that turns a slower or
+# hungrier stage into a failing test. Baselines are checked in, one file per
+# machine class under baselines/.
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+# Timing noise is relatively larger on short stages
+SMALL_STAGE_MS = 20.0
+MIN_ROUNDS = 10
+
+
+def machine_class():
+    # e.g. linux-x86_64-1cpu-py311; runs are only comparable within a class
+    return (f"{platform.system().lower()}-{platform.machine()}-{os.cpu_count()}cpu-"
+            f"py{sys.version_info[0]}{sys.version_info[1]}")
+
+
+DEFAULT_BASELINES = os.path.join(BASELINE_DIR, f"{machine_class()}.json")
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("flux baselines")
+    group.addoption("--baseline-file", default=DEFAULT_BASELINES,
+                    help="JSON file with the median time and peak allocation per stage "
+                         "(default: baselines/<machine class>.json)")
+    group.addoption("--update-baselines", action="store_true",
+                    help="write the current results as the new baselines")
+    group.addoption("--strict-baselines", action="store_true",
+                    help="fail stages without a baseline instead of recording one (for CI)")
+    group.addoption("--time-threshold", type=float, default=0.4,
+                    help="allowed relative slowdown of the median round (default 0.4)")
+    group.addoption("--small-time-threshold", type=float, default=0.6,
+                    help=f"the same for stages under {SMALL_STAGE_MS:.0f} ms (default 0.6)")
+    group.addoption("--time-slack-ms", type=float, default=1.0,
+                    help="absolute slack on top, so sub-millisecond stages do not flap")
+    group.addoption("--alloc-threshold", type=float, default=0.10,
+                    help="allowed relative growth of the peak allocation (default 0.10)")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "time_threshold(value): allowed relative slowdown for this stage")
+
+
+def make_png(width, height, seed=0):
+    # Smooth gradients with mild noise compress like a rendered image, not
+    # like pure noise (worst case) or a flat colour (best case)
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    pixels = np.stack((xx / width * 255, yy / height * 255, (xx + yy) / (width + height) * 255), axis=-1)
+    pixels += rng.normal(0, 6, pixels.shape)
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="session")
+def pngs():
+    # Lazily built and shared: {(width, height): bytes}
+    cache = {}
+
+    def get(width, height):
+        if (width, height) not in cache:
+            cache[(width, height)] = make_png(width, height)
+        return cache[(width, height)]
+    return get
+
+
+class Baselines:
+    def __init__(self, path, update, strict, time_threshold, small_time_threshold, time_slack_ms,
+                 alloc_threshold):
+        self.path = path
+        self.update = update
+        self.strict = strict
+        self.time_threshold = time_threshold
+        self.small_time_threshold = small_time_threshold
+        self.time_slack_ms = time_slack_ms
+        self.alloc_threshold = alloc_threshold
+        self.data = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+        self.dirty = False
+
+    def records(self, name):
+        return self.update or (name not in self.data and not self.strict)
+
+    def check(self, name, median, peak, time_threshold=None):
+        # Compare with the stored baseline; a stage without one (or with
+        # --update-baselines) records the current numbers instead, unless
+        # --strict-baselines. The median over at least MIN_ROUNDS rounds
+        # shrugs off the odd slow or lucky round.
+        baseline = self.data.get(name)
+        if baseline is None and self.strict and not self.update:
+            return [f"no baseline in {os.path.basename(self.path)}"]
+        if self.update or baseline is None:
+            self.data[name] = {"median_ms": round(median * 1000, 3), "peak_kib": round(peak / 1024, 1)}
+            self.dirty = True
+            return []
+        failures = []
+        threshold = time_threshold or (
+            self.small_time_threshold if baseline["median_ms"] < SMALL_STAGE_MS else self.time_threshold)
+        if median * 1000 > baseline["median_ms"] * (1 + threshold) + self.time_slack_ms:
+            failures.append(f"median round {median * 1000:.2f} ms > baseline {baseline['median_ms']:.2f} ms "
+                            f"+ {threshold:.0%}")
+        if peak / 1024 > baseline["peak_kib"] * (1 + self.alloc_threshold) + 4:
+            failures.append(f"peak {peak / 1024:.0f} KiB > baseline {baseline['peak_kib']:.0f} KiB "
+                            f"+ {self.alloc_threshold:.0%}")
+        return failures
+
+    def save(self):
+        if self.dirty:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "w") as f:
+                json.dump(self.data, f, indent=1, sort_keys=True)
+
+
+@pytest.fixture(scope="session")
+def baselines(request):
+    config = request.config
+    store = Baselines(
+        config.getoption("--baseline-file"),
+        config.getoption("--update-baselines"),
+        config.getoption("--strict-baselines"),
+        config.getoption("--time-threshold"),
+        config.getoption("--small-time-threshold"),
+        config.getoption("--time-slack-ms"),
+        config.getoption("--alloc-threshold"),
+    )
+    yield store
+    store.save()
+
+
+def timed_median(fn, args, rounds):
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+@pytest.fixture
+def stage(benchmark, baselines, request):
+    # run(fn, *args): time fn with pytest-benchmark, measure its peak
+    # allocation with tracemalloc in a separate call, then compare both
+    # with the baseline of this test
+    def run(fn, *args, rounds=None):
+        started = time.perf_counter()
+        fn(*args)
+        # Cheap stages get more rounds (about a quarter second in total),
+        # which keeps their median stable
+        rounds = max(MIN_ROUNDS, rounds or min(100, int(0.25 / max(time.perf_counter() - started, 1e-6))))
+        tracemalloc.start()
+        fn(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        result = benchmark.pedantic(fn, args=args, rounds=rounds)
+        if benchmark.disabled:
+            return result
+        benchmark.extra_info["peak_kib"] = round(peak / 1024, 1)
+        name = request.node.name
+        marker = request.node.get_closest_marker("time_threshold")
+        threshold = marker.args[0] if marker else None
+        median = benchmark.stats.stats.median
+        if baselines.records(name):
+            # The slower of two measurements, so a lucky phase of a shared
+            # machine does not become the baseline
+            median = max(median, timed_median(fn, args, rounds))
+        failures = baselines.check(name, median, peak, threshold)
+        if failures:
+            # Measure once more: a slow phase passes on the second look, a
+            # real regression does not
+            failures = baselines.check(name, min(median, timed_median(fn, args, rounds)), peak, threshold)
+        if failures:
+            pytest.fail(f"{name} regressed: " + "; ".join(failures))
+        return result
+    return run
@@ -0,0 +1,82 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+# Post-generation review helpers: perceptual hash for near-duplicates and a
+# sharpness/contrast score for ranking. Everything works on small grayscale
+# copies, so an image takes a few milliseconds.
+
+HASH_SIZE = 32
+ANALYSIS_SIZE = 256
+# Hamming distance (out of 64 bits) below which two variants count as the same
+DUPLICATE_DISTANCE = 10
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT = _dct_matrix(HASH_SIZE)
+
+
+def _gray(image, size):
+    # draft() lets the decoder skip work for JPEGs, PNGs decode fully
+    image.draft("L", (size, size))
+    return np.asarray(image.convert("L").resize((size, size), Image.BILINEAR), dtype=np.float32)
+
+
+def phash(gray):
+    # 2D DCT of a 32x32 copy; the 8x8 low-frequency block (without DC)
+    # compared to its median gives 64 bits
+    coefficients = _DCT @ gray @ _DCT.T
+    low = coefficients[:8, :8].flatten()[1:]
+    bits = np.concatenate(([False], low > np.median(low)))
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def analyze(image_data):
+    image = Image.open(io.BytesIO(image_data))
+    small = _gray(image, ANALYSIS_SIZE)
+    # Variance of the 4-neighbour Laplacian: low for blurry images
+    laplacian = (small[1:-1, :-2] + small[1:-1, 2:] + small[:-2, 1:-1] + small[2:, 1:-1]
+                 - 4 * small[1:-1, 1:-1])
+    sharpness = float(laplacian.var())
+    contrast = float(small.std() / 255.0)
+    hash_gray = np.asarray(Image.fromarray(small).resize((HASH_SIZE, HASH_SIZE), Image.BILINEAR),
+                           dtype=np.float32)
+    return {
+        "phash": phash(hash_gray),
+        "sharpness": round(sharpness, 1),
+        "contrast": round(contrast, 3),
+        "score": round(float(np.log1p(sharpness) * (0.5 + contrast)), 3),
+    }
+
+
+def hamming_matrix(hashes):
+    # Pairwise Hamming distances of 64-bit hashes in one go
+    values = np.array(hashes, dtype=np.uint64)
+    xor = values[:, None] ^ values[None, :]
+    return np.unpackbits(xor.view(np.uint8), axis=-1).reshape(len(values), len(values), -1).sum(axis=-1)
+
+
+def rank_variants(analyses, max_distance=DUPLICATE_DISTANCE):
+    # Returns the image order (best first) and sets "duplicate_of" on every
+    # analysis that is a near-copy of a better-scoring variant
+    order = sorted(range(len(analyses)), key=lambda i: analyses[i]["score"], reverse=True)
+    if not analyses:
+        return order
+    distances = hamming_matrix([a["phash"] for a in analyses])
+    kept = []
+    for i in order:
+        twin = next((k for k in kept if distances[i, k] <= max_distance), None)
+        analyses[i]["duplicate_of"] = twin
+        if twin is None:
+            kept.append(i)
+    # Distinct variants first, duplicates after them
+    return [i for i in order if analyses[i]["duplicate_of"] is None] + \
+        [i for i in order if analyses[i]["duplicate_of"] is not None]
@@ -0,0 +1,224 @@
+import asyncio
+import json
+import time
+
+import aiohttp
+
+import flux_metrics
+from flux_resilience import (
+    CircuitOpenError,
+    FatalError,
+    FluxError,
+    RateLimitedError,
+    RetryableError,
+    RetryPolicy,
+    get_breaker,
+)
+from flux_routing import DEFAULT_ENDPOINTS
+
+# Asyncio client for the BFL API. It has no Streamlit dependency: one event
+# loop can keep dozens of jobs in flight. Errors use the same classes,
+# retry policy and per-endpoint circuit breakers as the sync engine.
+#
+#   async with AsyncFluxClient(api_key) as client:
+#       job = await client.submit(payload)
+#       url = await client.wait(job)
+#       data = await client.fetch(url)
+
+DOWNLOAD_CHUNK = 64 * 1024
+FAILED_STATUSES = ("Failed", "Error", "Task not found", "Request Moderated", "Content Moderated")
+
+
+class AsyncFluxClient:
+    def __init__(self, api_key, endpoint=None, session=None, policy=None,
+                 poll_interval=0.5, timeout=300.0):
+        self.api_key = api_key
+        self.endpoint = endpoint or DEFAULT_ENDPOINTS[0]
+        self.policy = policy or RetryPolicy()
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self._session = session
+        self._own_session = session is None
+
+    async def __aenter__(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_read=60))
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._own_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method, url, kind, **kwargs):
+        # Async counterpart of flux_resilience.call
+        breaker = get_breaker(self.endpoint["name"])
+        for attempt in range(self.policy.max_attempts):
+            if not breaker.allow():
+                flux_metrics.incr(f"{kind}.rejected_open_circuit")
+                raise CircuitOpenError(f"circuit for {breaker.name} is open")
+            try:
+                async with self._session.request(method, url, **kwargs) as response:
+                    body = await response.read()
+                    data = _classify(response, body)
+            except FatalError:
+                flux_metrics.incr(f"{kind}.errors.fatal")
+                breaker.record_success()
+                raise
+            except (RetryableError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                retry_after = getattr(e, "retry_after", None)
+                flux_metrics.incr(f"{kind}.errors.{type(e).__name__}")
+                if getattr(e, "trips_breaker", True):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if isinstance(e, RateLimitedError) and not self.policy.retry_rate_limited:
+                    raise
+                if attempt + 1 >= self.policy.max_attempts:
+                    if isinstance(e, RetryableError):
+                        raise
+                    raise RetryableError(str(e))
+                flux_metrics.incr(f"{kind}.retries")
+                await asyncio.sleep(self.policy.delay(attempt, retry_after))
+                continue
+            except BaseException:
+                # Cancellation or an unexpected error: free the half-open
+                # trial, see flux_resilience.call
+                breaker.release_trial()
+                raise
+            breaker.record_success()
+            return data
+
+    async def submit(self, payload):
+        response = await self._request(
+            "POST",
+            self.endpoint["url"],
+            "submit",
+            headers={
+                'accept': 'application/json',
+                'x-key': self.api_key,
+                'Content-Type': 'application/json',
+            },
+            json=payload,
+        )
+        request_id = response.get("id")
+        if not request_id:
+            raise FluxError(f"no request id in response: {str(response)[:200]}")
+        return {
+            "id": request_id,
+            "polling_url": response.get("polling_url") or self.endpoint["result_url"],
+            "submitted_at": time.time(),
+        }
+
+    async def wait(self, job):
+        # Poll until the job is Ready and return the result URL
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            result = await self._request(
+                "GET",
+                job["polling_url"],
+                "poll",
+                headers={
+                    'accept': 'application/json',
+                    'x-key': self.api_key,
+                },
+                params={'id': job["id"]},
+            )
+            flux_metrics.incr("polling.requests")
+            status = result.get("status")
+            if status == "Ready":
+                sample = (result.get("result") or {}).get("sample")
+                if not sample:
+                    raise RetryableError(f"job {job['id']}: Ready without a result")
+                return sample
+            if status in FAILED_STATUSES:
+                raise FluxError(f"job {job['id']}: {status}")
+        raise FluxError(f"job {job['id']}: timed out after {self.timeout:.0f} s")
+
+    async def fetch(self, url, dest=None, chunk_size=DOWNLOAD_CHUNK):
+        # Stream the image in chunks. dest may be a path or a writable
+        # file-like object (returns the byte count); without dest the bytes
+        # are returned.
+        async with self._session.get(url, headers={'x-key': self.api_key}) as response:
+            if response.status != 200:
+                raise FluxError(f"download failed ({response.status})")
+            if dest is None:
+                chunks = [chunk async for chunk in response.content.iter_chunked(chunk_size)]
+                return b"".join(chunks)
+            if isinstance(dest, str):
+                with open(dest, "wb") as f:
+                    return await _copy(response, f, chunk_size)
+            return await _copy(response, dest, chunk_size)
+
+    async def generate(self, payload, dest=None):
+        job = await self.submit(payload)
+        url = await self.wait(job)
+        return await self.fetch(url, dest)
+
+    async def generate_many(self, payloads, concurrency=8, dests=None):
+        # Run all payloads with at most `concurrency` jobs in flight. Results
+        # keep the payload order; failures come back as the exception.
+        semaphore = asyncio.Semaphore(concurrency)
+        dests = dests or [None] * len(payloads)
+
+        async def one(payload, dest):
+            async with semaphore:
+                return await self.generate(payload, dest)
+
+        return await asyncio.gather(*(one(p, d) for p, d in zip(payloads, dests)),
+                                    return_exceptions=True)
+
+    async def fetch_many(self, urls, concurrency=8):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(url):
+            async with semaphore:
+                return await self.fetch(url)
+
+        return await asyncio.gather(*(one(url) for url in urls), return_exceptions=True)
+
+
+async def _copy(response, f, chunk_size):
+    written = 0
+    async for chunk in response.content.iter_chunked(chunk_size):
+        f.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def _classify(response, body):
+    # Same rules as flux_resilience.classify, for aiohttp responses
+    retry_after = response.headers.get("Retry-After")
+    try:
+        retry_after = max(0.0, float(retry_after)) if retry_after else None
+    except ValueError:
+        retry_after = None
+    if response.status == 429:
+        raise RateLimitedError(retry_after)
+    if response.status >= 500:
+        raise RetryableError(f"server error ({response.status})", retry_after)
+    if response.status >= 400:
+        raise FatalError(f"request rejected ({response.status}): {body[:200]!r}")
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise RetryableError(f"invalid JSON response ({response.headers.get('Content-Type', 'unknown')})")
+
+
+# Thin sync wrappers, e.g. for the Streamlit script thread which has no
+# running event loop
+
+
+def generate_many_sync(api_key, payloads, endpoint=None, concurrency=8, dests=None):
+    async def run():
+        async with AsyncFluxClient(api_key, endpoint) as client:
+            return await client.generate_many(payloads, concurrency, dests)
+    return asyncio.run(run())
+
+
+def fetch_many_sync(api_key, urls, concurrency=8):
+    async def run():
+        async with AsyncFluxClient(api_key) as client:
+            return await client.fetch_many(urls, concurrency)
+    return asyncio.run(run())
@@ -0,0 +1,127 @@
+import functools
+import io
+
+import numpy as np
+from PIL import Image
+
+# BlurHash placeholders (https://blurha.sh): a few cosine components of a
+# small decode, packed into a ~30 character string. Shown while the full
+# image is still on its way and stored with the batch, so galleries and
+# permalinks can draw something before the blobs are read.
+
+BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+# Longest side of the decode the components are computed from
+SAMPLE_SIZE = 32
+# Horizontal and vertical components
+COMPONENTS = (4, 3)
+# Width of the decoded placeholder; the browser scales it up smoothly
+PLACEHOLDER_WIDTH = 32
+# Light grey, DC component only (see pending_placeholder)
+PENDING_COLOR = (224, 224, 224)
+
+
+def _encode83(value, length):
+    return "".join(BASE83[(value // 83 ** (length - 1 - i)) % 83] for i in range(length))
+
+
+def _decode83(text):
+    value = 0
+    for char in text:
+        value = value * 83 + BASE83.index(char)
+    return value
+
+
+def _to_linear(srgb):
+    c = srgb.astype(np.float32) / 255.0
+    return np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+
+
+def _to_srgb(linear):
+    c = np.clip(linear, 0.0, 1.0)
+    c = np.where(c > 0.0031308, 1.055 * c ** (1 / 2.4) - 0.055, c * 12.92)
+    return np.rint(c * 255).astype(np.uint8)
+
+
+def _basis(count, length):
+    # (count, length) cosines, the same for encode and decode
+    return np.cos(np.pi * np.arange(count)[:, None] * np.arange(length)[None] / length)
+
+
+def encode(pixels, components=COMPONENTS):
+    # pixels: (h, w, 3) uint8 sRGB
+    cx, cy = components
+    height, width = pixels.shape[:2]
+    linear = _to_linear(pixels)
+    factors = np.einsum("jy,ix,yxc->jic", _basis(cy, height), _basis(cx, width), linear) / (width * height)
+    factors[1:] *= 2
+    factors[0, 1:] *= 2
+    factors = factors.reshape(-1, 3)
+    dc, ac = factors[0], factors[1:]
+
+    text = _encode83((cx - 1) + (cy - 1) * 9, 1)
+    if len(ac):
+        quantised_max = int(np.clip(np.floor(np.abs(ac).max() * 166 - 0.5), 0, 82))
+        max_value = (quantised_max + 1) / 166.0
+        text += _encode83(quantised_max, 1)
+    else:
+        max_value = 1.0
+        text += _encode83(0, 1)
+    r, g, b = (int(v) for v in _to_srgb(dc))
+    text += _encode83((r << 16) + (g << 8) + b, 4)
+    scaled = np.sign(ac) * np.abs(ac / max_value) ** 0.5
+    quantised = np.clip(np.floor(scaled * 9 + 9.5), 0, 18).astype(int)
+    for qr, qg, qb in quantised:
+        text += _encode83(qr * 19 * 19 + qg * 19 + qb, 2)
+    return text
+
+
+PENDING_BLURHASH = encode(np.full((1, 1, 3), PENDING_COLOR, dtype=np.uint8), (1, 1))
+
+
+def decode(text, width, height, punch=1.0):
+    # (height, width, 3) uint8
+    size = _decode83(text[0])
+    cx, cy = size % 9 + 1, size // 9 + 1
+    max_value = (_decode83(text[1]) + 1) / 166.0 * punch
+    dc = _decode83(text[2:6])
+    colors = [_to_linear(np.array([dc >> 16, (dc >> 8) & 255, dc & 255]))]
+    for i in range(1, cx * cy):
+        value = _decode83(text[4 + i * 2:6 + i * 2])
+        quantised = np.array([value // (19 * 19), (value // 19) % 19, value % 19], dtype=np.float32)
+        normalised = (quantised - 9) / 9
+        colors.append(np.sign(normalised) * normalised ** 2 * max_value)
+    colors = np.array(colors, dtype=np.float32).reshape(cy, cx, 3)
+    linear = np.einsum("jy,ix,jic->yxc", _basis(cy, height), _basis(cx, width), colors)
+    return _to_srgb(linear)
+
+
+def placeholder(image_data):
+    # {"blurhash", "width", "height"} of an encoded image
+    image = Image.open(io.BytesIO(image_data))
+    width, height = image.size
+    image.draft("RGB", (SAMPLE_SIZE, SAMPLE_SIZE))
+    scale = SAMPLE_SIZE / max(width, height)
+    small = image.convert("RGB").resize(
+        (max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR, reducing_gap=2.0)
+    return {"blurhash": encode(np.asarray(small)), "width": width, "height": height}
+
+
+def pending_placeholder(width, height):
+    # {"blurhash", "width", "height"} for an image whose bytes are not here
+    # yet: one flat colour in its aspect ratio, so the slot has its final
+    # size from the moment the result URL is known
+    return {"blurhash": PENDING_BLURHASH, "width": width, "height": height}
+
+
+def placeholder_png(info):
+    # Tiny PNG of a placeholder with the image's aspect ratio
+    return _placeholder_png(info["blurhash"], info["width"], info["height"])
+
+
+@functools.lru_cache(maxsize=256)
+def _placeholder_png(blurhash, width, height):
+    # Cached, so sessions watching the same batch share one decode
+    buffer = io.BytesIO()
+    Image.fromarray(decode(blurhash, PLACEHOLDER_WIDTH, max(1, round(PLACEHOLDER_WIDTH * height / width)))).save(
+        buffer, "PNG")
+    return buffer.getvalue()
@@ -0,0 +1,115 @@
+import threading
+import time
+
+import flux_metrics
+
+# In-process pub/sub for watching a batch from several sessions. The
+# session that runs the batch publishes progress, placeholders and finally
+# the finished image bytes to the batch's channel; viewer sessions in the
+# same process wait on the channel and render what it holds. Viewers share
+# the owner's bytes objects, so they cost no API calls, downloads or
+# decodes. Viewers on other processes fall back to the shared store.
+
+# How long a finished channel stays around for viewers that arrive late
+LINGER = 60.0
+
+
+class Channel:
+    # Latest state of one batch; every change bumps version and wakes the
+    # viewers, like flux_service.Job
+    def __init__(self, batch_id, slots):
+        self.batch_id = batch_id
+        self.slots = slots
+        self.progress = (0.0, None)
+        self.placeholders = []
+        self.result = None
+        self.error = None
+        self.closed = False
+        self.closed_at = None
+        self.viewers = 0
+        self.version = 0
+        self._changed = threading.Condition()
+
+    def update(self, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self._changed.notify_all()
+
+    def close(self, result=None, error=None):
+        # result: {"images", "exports", "analyses", "zip", "elapsed"}
+        self.update(result=result, error=error, closed=True, closed_at=time.time())
+
+    def wait(self, version, timeout):
+        # Current version once it differs from version (or on timeout)
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version or self.closed, timeout)
+            return self.version
+
+    def state(self):
+        with self._changed:
+            return {
+                "progress": self.progress,
+                "placeholders": list(self.placeholders),
+                "result": self.result,
+                "error": self.error,
+                "closed": self.closed,
+                "version": self.version,
+            }
+
+    def join(self):
+        with self._changed:
+            self.viewers += 1
+
+    def leave(self):
+        with self._changed:
+            self.viewers -= 1
+
+
+class Hub:
+    def __init__(self, linger=LINGER):
+        self.linger = linger
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def open(self, batch_id, slots=0):
+        with self._lock:
+            self._prune()
+            channel = Channel(batch_id, slots)
+            self._channels[batch_id] = channel
+            return channel
+
+    def get(self, batch_id):
+        with self._lock:
+            self._prune()
+            return self._channels.get(batch_id)
+
+    def _prune(self):
+        now = time.time()
+        for batch_id, channel in list(self._channels.items()):
+            if channel.closed and now - channel.closed_at > self.linger and channel.viewers <= 0:
+                del self._channels[batch_id]
+
+    def snapshot(self):
+        with self._lock:
+            channels = list(self._channels.values())
+        return {
+            "channels": len(channels),
+            "live": sum(1 for c in channels if not c.closed),
+            "viewers": sum(c.viewers for c in channels),
+        }
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    # Process-wide hub shared by all sessions
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = Hub()
+            flux_metrics.register("broadcast", _hub.snapshot)
+        return _hub
@@ -0,0 +1,381 @@
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+
+import flux_metrics
+from flux_generation import (
+    HEARTBEAT_TIMEOUT, BatchRecorder, build_payloads, eta_model_from, key_pool_from, load_settings,
+    router_from, run_batch, store_from, store_results,
+)
+from flux_hedging import LatencyHistory
+from flux_presets import PRESETS, find_preset, model_params
+from flux_routing import Router, quality_for_scheduler
+
+# Off-peak runner for large batch jobs. A run is a list of prompts with one
+# preset and size, queued in the shared store (from the app or the CLI).
+# Every prompt becomes an ordinary batch, so its results open in the app
+# via ?batch=<id>. The daemon only works inside its time windows, with few
+# batches and requests at a time, and backs off while interactive batches
+# are running: outstanding requests are abandoned but their IDs stay in
+# the store, so the next start polls them again instead of paying twice.
+#
+#   python flux_daemon.py enqueue --preset 02 prompts.txt   (one per line)
+#   python flux_daemon.py run --windows 22:00-06:00 --concurrency 2
+#   python flux_daemon.py status
+#
+# Settings come from .streamlit/secrets.toml like in the app, see
+# flux_generation.load_settings.
+
+QUEUE = "daemon"
+DONE_QUEUE = "daemon_done"
+# Batches the app is generating right now, see flux_four_pics.run_generation
+INTERACTIVE_QUEUE = "interactive"
+STATUS_KEY = "daemon:status"
+# Finished runs kept for the status view
+KEEP_DONE = 20
+FINAL_STATUSES = ("complete", "failed")
+# One --windows entry, HH:MM-HH:MM
+WINDOW_PATTERN = re.compile(r"\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*")
+
+
+def enqueue_run(store, prompts, preset, width=1024, height=768, num_images=None):
+    name = find_preset(preset)
+    if name is None:
+        raise ValueError(f"unknown preset: {preset}")
+    prompts = [p.strip() for p in prompts if p.strip()]
+    if not prompts:
+        raise ValueError("no prompts")
+    run_id = uuid.uuid4().hex
+    store.put_batch(
+        run_id,
+        kind="run",
+        status="queued",
+        created=time.time(),
+        preset=name,
+        width=int(width),
+        height=int(height),
+        num_images=int(num_images or PRESETS[name]["num_outputs"]),
+        # Batch IDs are fixed up front, so permalinks exist before the run
+        items=[{"prompt": prompt, "batch_id": uuid.uuid4().hex} for prompt in prompts],
+    )
+    store.queue_push(QUEUE, run_id)
+    return run_id
+
+
+def item_status(store, item):
+    batch = store.get_batch(item["batch_id"])
+    return batch.get("status", "queued") if batch else "queued"
+
+
+def run_progress(store, run_id):
+    # (run record, [(item, status), ...])
+    run = store.get_batch(run_id) or {}
+    return run, [(item, item_status(store, item)) for item in run.get("items", [])]
+
+
+def interactive_load(store):
+    # Interactive batches with a fresh heartbeat; entries of sessions that
+    # went away are dropped here
+    load = 0
+    for batch_id in store.queue_items(INTERACTIVE_QUEUE):
+        batch = store.get_batch(batch_id)
+        if batch and batch.get("status") == "running" and \
+                time.time() - batch.get("heartbeat", 0) < HEARTBEAT_TIMEOUT:
+            load += 1
+        else:
+            store.queue_remove(INTERACTIVE_QUEUE, batch_id)
+    return load
+
+
+def parse_windows(text):
+    # "22:00-06:00,12:00-13:30" -> [(start minute, end minute), ...];
+    # a window may wrap around midnight. ValueError names the first entry
+    # that is not HH:MM-HH:MM with a valid time on both sides.
+    windows = []
+    for part in (text or "").split(","):
+        if not part.strip():
+            continue
+        match = WINDOW_PATTERN.fullmatch(part)
+        if match is None:
+            raise ValueError(f"invalid window {part.strip()!r}, expected HH:MM-HH:MM")
+        hours = int(match[1]), int(match[3])
+        minutes = int(match[2]), int(match[4])
+        if max(hours) > 23 or max(minutes) > 59:
+            raise ValueError(f"invalid window {part.strip()!r}, times run from 00:00 to 23:59")
+        start, end = hours[0] * 60 + minutes[0], hours[1] * 60 + minutes[1]
+        if start == end:
+            raise ValueError(f"invalid window {part.strip()!r}, start and end are the same")
+        windows.append((start, end))
+    return windows
+
+
+def in_window(windows, now=None):
+    if not windows:
+        return True
+    now = now or time.localtime()
+    minute = now.tm_hour * 60 + now.tm_min
+    return any(start <= minute < end if start <= end else minute >= start or minute < end
+               for start, end in windows)
+
+
+class Daemon:
+    def __init__(self, store, keys, router=None, eta_model=None, windows=(), concurrency=2,
+                 max_interactive=0, max_cpu_load=None, resume_after=60.0, poll=5.0):
+        self.store = store
+        self.keys = keys
+        self.router = router or Router()
+        self.eta_model = eta_model
+        self.latency_history = LatencyHistory()
+        self.windows = list(windows)
+        self.concurrency = concurrency
+        self.max_interactive = max_interactive
+        self.max_cpu_load = max_cpu_load
+        self.resume_after = resume_after
+        self.poll = poll
+        # Set while pausing; run_batch abandons its requests when it sees it
+        self.cancel = threading.Event()
+        self.stop = threading.Event()
+        self.active = {}
+        self.paused = False
+        self.clear_since = None
+        flux_metrics.register("routing", self.router.snapshot)
+        flux_metrics.register("api_keys", self.keys.snapshot)
+
+    def blocked(self):
+        # Why no work may run right now, or None
+        if not in_window(self.windows):
+            return "outside window"
+        load = interactive_load(self.store)
+        if load > self.max_interactive:
+            return f"{load} interactive batches"
+        if self.max_cpu_load is not None and hasattr(os, "getloadavg"):
+            cpu = os.getloadavg()[0] / (os.cpu_count() or 1)
+            if cpu > self.max_cpu_load:
+                return f"cpu load {cpu:.2f}"
+        return None
+
+    def pending(self):
+        # Unfinished items of queued runs in queue order; finished runs move
+        # to the done queue
+        for run_id in self.store.queue_items(QUEUE):
+            run, items = run_progress(self.store, run_id)
+            if not run:
+                self.store.queue_remove(QUEUE, run_id)
+                continue
+            if all(status in FINAL_STATUSES for _, status in items):
+                failed = sum(1 for _, status in items if status == "failed")
+                self.store.put_batch(run_id, status="complete" if failed < len(items) else "failed",
+                                     finished=time.time())
+                self.store.queue_remove(QUEUE, run_id)
+                self.store.queue_push(DONE_QUEUE, run_id)
+                for old in self.store.queue_items(DONE_QUEUE)[:-KEEP_DONE]:
+                    self.store.queue_remove(DONE_QUEUE, old)
+                flux_metrics.incr("daemon.runs_completed")
+                continue
+            if run.get("status") == "queued":
+                self.store.put_batch(run_id, status="running")
+            for item, status in items:
+                if status in FINAL_STATUSES or item["batch_id"] in self.active:
+                    continue
+                if status == "running":
+                    # Polled elsewhere (an app session took it over)?
+                    batch = self.store.get_batch(item["batch_id"]) or {}
+                    if time.time() - batch.get("heartbeat", 0) < HEARTBEAT_TIMEOUT:
+                        continue
+                yield run, item
+
+    def _pause(self, reason):
+        if not self.paused:
+            print(f"pausing: {reason}", flush=True)
+            flux_metrics.incr("daemon.pauses")
+        self.paused = True
+        if self.active:
+            self.cancel.set()
+            for thread in list(self.active.values()):
+                thread.join()
+            self.cancel.clear()
+
+    def _publish(self, state, reason=None):
+        # Shown in the app's queue panel; expires if the daemon dies
+        flux_metrics.set_gauge("daemon.active", len(self.active))
+        self.store.cache_set(STATUS_KEY, {"state": state, "reason": reason, "active": len(self.active),
+                                          "at": time.time()}, ttl=max(30, self.poll * 3))
+
+    def run(self, once=False):
+        # once: return when the queue is empty or work is blocked (cron)
+        while not self.stop.is_set():
+            for batch_id, thread in list(self.active.items()):
+                if not thread.is_alive():
+                    del self.active[batch_id]
+
+            reason = self.blocked()
+            if reason:
+                self._pause(reason)
+                self.clear_since = None
+                self._publish("paused", reason)
+                if once:
+                    return
+                self.stop.wait(self.poll)
+                continue
+            if self.paused:
+                # Resume only once the load has stayed low for a while
+                self.clear_since = self.clear_since or time.time()
+                if time.time() - self.clear_since < self.resume_after:
+                    self._publish("paused", "waiting for load to stay low")
+                    self.stop.wait(self.poll)
+                    continue
+                print("resuming", flush=True)
+                self.paused = False
+
+            started = False
+            for run, item in self.pending():
+                if len(self.active) >= self.concurrency:
+                    break
+                thread = threading.Thread(target=self._run_item, args=(run, item),
+                                          name=f"flux-daemon-{item['batch_id'][:8]}", daemon=True)
+                self.active[item["batch_id"]] = thread
+                thread.start()
+                started = True
+            self._publish("running" if self.active else "idle")
+            if once and not self.active and not started:
+                return
+            self.stop.wait(self.poll)
+
+        self._pause("stopping")
+
+    def _run_item(self, run, item):
+        batch_id = item["batch_id"]
+        try:
+            self._generate(run, item)
+        except Exception as e:
+            print(f"{batch_id}: {e}", file=sys.stderr, flush=True)
+            self.store.put_batch(batch_id, status="failed", error=str(e))
+            flux_metrics.incr("daemon.failed")
+
+    def _generate(self, run, item):
+        # Start a batch or continue it from its checkpoint: finished images
+        # are kept, submitted requests are polled again, the rest submitted
+        batch_id = item["batch_id"]
+        store = self.store
+        batch = store.get_batch(batch_id)
+        if batch and batch.get("payloads"):
+            payloads, quality, jobs = batch["payloads"], batch["quality"], batch["jobs"]
+            store.put_batch(batch_id, status="running", heartbeat=time.time())
+        else:
+            payloads = build_payloads(item["prompt"], run["width"], run["height"], run["num_images"],
+                                      model_params(run["preset"]))
+            quality = quality_for_scheduler(payloads[0].get("scheduler", ""))
+            jobs = {}
+            store.put_batch(batch_id, status="running", payloads=payloads, quality=quality,
+                            heartbeat=time.time(), source="daemon", run=run["batch_id"],
+                            settings={"prompt": item["prompt"], "preset": run["preset"], "width": run["width"],
+                                      "height": run["height"], "num_outputs": run["num_images"]})
+
+        results = {idx: job["result_url"] for idx, job in jobs.items()
+                   if job.get("status") == "Ready" and job.get("result_url")}
+        resume = {idx: job for idx, job in jobs.items() if job.get("status") == "Pending" and job.get("id")}
+        indexes = [idx for idx in range(len(payloads)) if idx not in results]
+        recorder = BatchRecorder(store, batch_id, indexes, results)
+        if indexes:
+            run_batch(
+                [payloads[idx] for idx in indexes],
+                self.keys,
+                self.router,
+                quality,
+                latency_history=self.latency_history,
+                eta_model=self.eta_model,
+                on_done=recorder.on_done,
+                on_progress=recorder.heartbeat,
+                on_submit=recorder.on_submit,
+                resume={n: resume[idx] for n, idx in enumerate(indexes) if idx in resume},
+                cancel=self.cancel,
+            )
+        if recorder.finished < len(indexes):
+            # Paused half-way; the jobs in the store are the checkpoint
+            store.put_batch(batch_id, status="paused")
+            flux_metrics.incr("daemon.paused_batches")
+            return
+        store_results(store, batch_id, payloads, results, self.keys.default)
+        flux_metrics.incr("daemon.batches_completed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Off-peak batch runner")
+    parser.add_argument("--secrets", default=os.path.join(".streamlit", "secrets.toml"))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = commands.add_parser("enqueue", help="queue one batch per prompt")
+    enqueue.add_argument("prompts", help="file with one prompt per line, - for stdin")
+    enqueue.add_argument("--preset", default="02")
+    enqueue.add_argument("--width", type=int, default=1024)
+    enqueue.add_argument("--height", type=int, default=768)
+    enqueue.add_argument("--num-images", type=int, default=None)
+
+    run = commands.add_parser("run", help="work through the queue")
+    run.add_argument("--windows", default="", help="e.g. 22:00-06:00,12:00-13:00 (local time); empty = always")
+    run.add_argument("--concurrency", type=int, default=2, help="batches at the same time")
+    run.add_argument("--max-in-flight", type=int, default=8, help="API requests at the same time")
+    run.add_argument("--max-interactive", type=int, default=0,
+                     help="pause while more interactive batches than this are running")
+    run.add_argument("--max-cpu-load", type=float, default=None, help="pause above this load per CPU")
+    run.add_argument("--resume-after", type=float, default=60.0, help="seconds of low load before resuming")
+    run.add_argument("--poll", type=float, default=5.0)
+    run.add_argument("--once", action="store_true", help="exit when the queue is empty or work is blocked")
+
+    commands.add_parser("status", help="show queued runs")
+
+    prune = commands.add_parser("prune", help="drop old batches and their images from the store")
+    prune.add_argument("--days", type=float, default=30.0, help="keep batches touched within this many days")
+    args = parser.parse_args()
+    if args.command == "run":
+        # Before any store or API setup, so a typo fails with a usage message
+        try:
+            windows = parse_windows(args.windows)
+        except ValueError as e:
+            parser.error(f"--windows: {e}")
+
+    settings = load_settings(args.secrets)
+    store = store_from(settings)
+    if args.command == "enqueue":
+        source = sys.stdin if args.prompts == "-" else open(args.prompts, encoding="utf-8")
+        with source:
+            run_id = enqueue_run(store, source.read().splitlines(), args.preset, args.width, args.height,
+                                 args.num_images)
+        print(run_id)
+    elif args.command == "status":
+        print(store.cache_get(STATUS_KEY) or {"state": "not running"})
+        for run_id in store.queue_items(QUEUE) + store.queue_items(DONE_QUEUE)[::-1]:
+            run, items = run_progress(store, run_id)
+            counts = {}
+            for _, status in items:
+                counts[status] = counts.get(status, 0) + 1
+            print(run_id, run.get("status"), run.get("preset", "").split(" | ")[0], counts)
+    elif args.command == "prune":
+        print(f"pruned {store.prune(args.days * 86400)} batches")
+    else:
+        daemon = Daemon(
+            store,
+            key_pool_from(settings, max_in_flight=args.max_in_flight),
+            router_from(settings),
+            eta_model_from(settings),
+            windows=windows,
+            concurrency=args.concurrency,
+            max_interactive=args.max_interactive,
+            max_cpu_load=args.max_cpu_load,
+            resume_after=args.resume_after,
+            poll=args.poll,
+        )
+        print(f"Flux daemon: {len(daemon.windows) or 'no'} windows, concurrency {args.concurrency}", flush=True)
+        try:
+            daemon.run(once=args.once)
+        except KeyboardInterrupt:
+            daemon.stop.set()
+            daemon._pause("stopping")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: merging still works, it is just not locked
+    fcntl = None
+
+SCHEDULERS = [
+    "Premium-Qualität",
+    "Standard-Produktion",
+    "Schnellvorschau",
+    "Kreativ-Exploration",
+]
+
+FEATURES = ["bias", "megapixels", "steps", "megapixel_steps", "queue_depth"] + \
+    [f"scheduler:{name}" for name in SCHEDULERS]
+
+# Seconds between writes of the model file; it is also written at exit
+SAVE_INTERVAL = 30.0
+
+
+def features(width, height, num_inference_steps, scheduler, queue_depth):
+    megapixels = width * height / 1e6
+    steps = num_inference_steps / 50.0
+    scheduler = scheduler.split(" (")[0]
+    return [1.0, megapixels, steps, megapixels * steps, float(queue_depth)] + \
+        [1.0 if scheduler == name else 0.0 for name in SCHEDULERS]
+
+
+def _solve(a, b):
+    # Gaussian elimination with partial pivoting, the system is tiny
+    n = len(b)
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        m[col], m[pivot] = m[pivot], m[col]
+        if abs(m[col][col]) < 1e-12:
+            continue
+        for r in range(n):
+            if r != col:
+                factor = m[r][col] / m[col][col]
+                for c in range(col, n + 1):
+                    m[r][c] -= factor * m[col][c]
+    return [m[i][n] / m[i][i] if abs(m[i][i]) > 1e-12 else 0.0 for i in range(n)]
+
+
+class EtaModel:
+    # Online ridge regression of submit-to-ready time. Only the sufficient
+    # statistics X'X and X'y are kept, so every observation is O(features²)
+    # and the whole model is a few hundred numbers in a JSON file.
+    # The statistics add up, so several processes can share the file (app
+    # workers, flux_service, flux_daemon): each one adds only the
+    # observations made since its last write, see flush().
+    def __init__(self, path=None, ridge=1.0, min_samples=5, save_interval=SAVE_INTERVAL):
+        self.path = path
+        self.ridge = ridge
+        self.min_samples = min_samples
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        n = len(FEATURES)
+        self.xtx = [[0.0] * n for _ in range(n)]
+        self.xty = [0.0] * n
+        self.samples = 0
+        self.abs_error = 0.0
+        self.weights = [0.0] * n
+        # Observations not written to the file yet
+        self._pending = _empty()
+        self._saved_at = time.time()
+        if path:
+            data = self._read()
+            if data is not None:
+                self.xtx, self.xty, self.samples = data["xtx"], data["xty"], data["samples"]
+                self.abs_error = data.get("abs_error", 0.0)
+                self.weights = data["weights"]
+            atexit.register(self.flush)
+
+    def predict(self, x):
+        with self._lock:
+            if self.samples < self.min_samples:
+                return None
+            value = sum(w * v for w, v in zip(self.weights, x))
+        return max(1.0, value)
+
+    def observe(self, x, seconds):
+        predicted = self.predict(x)
+        with self._lock:
+            _accumulate(self.xtx, self.xty, x, seconds)
+            _accumulate(self._pending["xtx"], self._pending["xty"], x, seconds)
+            self.samples += 1
+            self._pending["samples"] += 1
+            if predicted is not None:
+                self.abs_error += 0.1 * (abs(predicted - seconds) - self.abs_error)
+            self.weights = self._solve(self.xtx, self.xty)
+            due = time.time() - self._saved_at >= self.save_interval
+        if due:
+            self.flush()
+
+    def _solve(self, xtx, xty):
+        n = len(FEATURES)
+        a = [[xtx[i][j] + (self.ridge if i == j else 0.0) for j in range(n)] for i in range(n)]
+        return _solve(a, xty)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "samples": self.samples,
+                "mean_abs_error_s": round(self.abs_error, 2),
+                "weights": {name: round(w, 3) for name, w in zip(FEATURES, self.weights)},
+            }
+
+    def flush(self):
+        # Add the pending observations to the file. It is re-read under an
+        # exclusive lock first, so concurrent writers add up instead of
+        # overwriting each other, and written via an atomic rename. The
+        # merged totals, with the other processes' observations, become
+        # this model's state.
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                pending, self._pending = self._pending, _empty()
+                abs_error = self.abs_error
+                self._saved_at = time.time()
+            if not pending["samples"]:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path + ".lock", "a") as lock:
+                    if fcntl is not None:
+                        fcntl.flock(lock, fcntl.LOCK_EX)
+                    data = self._read() or dict(_empty(), abs_error=abs_error)
+                    _add(data, pending)
+                    data["abs_error"] = abs_error
+                    data["weights"] = self._solve(data["xtx"], data["xty"])
+                    self._write(data)
+            except OSError:
+                # Keep the observations for the next attempt
+                with self._lock:
+                    _add(self._pending, pending)
+                return
+            with self._lock:
+                # Observations made while writing are still pending
+                _add(data, self._pending)
+                self.xtx, self.xty, self.samples = data["xtx"], data["xty"], data["samples"]
+                self.weights = self._solve(self.xtx, self.xty)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Ignore files written for a different feature set
+        if data.get("features") != FEATURES:
+            return None
+        return data
+
+    def _write(self, data):
+        # Unique temp name: other processes may be writing at the same time
+        # where there is no file locking
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(dict(data, features=FEATURES), f)
+        os.replace(tmp, self.path)
+
+
+def _accumulate(xtx, xty, x, seconds):
+    for i, xi in enumerate(x):
+        xty[i] += xi * seconds
+        for j, xj in enumerate(x):
+            xtx[i][j] += xi * xj
+
+
+def _empty():
+    n = len(FEATURES)
+    return {"xtx": [[0.0] * n for _ in range(n)], "xty": [0.0] * n, "samples": 0}
+
+
+def _add(stats, other):
+    # stats += other for the sufficient statistics
+    n = len(FEATURES)
+    for i in range(n):
+        stats["xty"][i] += other["xty"][i]
+        for j in range(n):
+            stats["xtx"][i][j] += other["xtx"][i][j]
+    stats["samples"] += other["samples"]
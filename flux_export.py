@@ -0,0 +1,91 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from flux_workers import get_pool
+
+# Channel formats for the social export. Can be replaced with
+# [[CHANNEL_FORMATS]] tables (name, slug, width, height) in the secrets.
+CHANNEL_FORMATS = [
+    {"name": "Instagram Feed (1:1)", "slug": "instagram_feed", "width": 1080, "height": 1080},
+    {"name": "Instagram Portrait (4:5)", "slug": "instagram_portrait", "width": 1080, "height": 1350},
+    {"name": "Story / Reel (9:16)", "slug": "story", "width": 1080, "height": 1920},
+    {"name": "Facebook / LinkedIn Link (1.91:1)", "slug": "link_preview", "width": 1200, "height": 628},
+    {"name": "X / YouTube (16:9)", "slug": "landscape", "width": 1600, "height": 900},
+    {"name": "Pinterest (2:3)", "slug": "pinterest", "width": 1000, "height": 1500},
+]
+
+# Saliency is computed on a downscaled copy, the crop is mapped back
+SALIENCY_SIZE = 256
+
+
+def _saliency(image):
+    # Gradient energy of the luminance, plus a mild centre prior so flat
+    # images still crop to the middle
+    small = image.convert("L")
+    small.thumbnail((SALIENCY_SIZE, SALIENCY_SIZE))
+    gray = np.asarray(small, dtype=np.float32)
+    gy, gx = np.gradient(gray)
+    energy = np.hypot(gx, gy)
+    h, w = energy.shape
+    yy = np.linspace(-1, 1, h)[:, None]
+    xx = np.linspace(-1, 1, w)[None, :]
+    energy += energy.mean() * 0.5 * (1 - 0.5 * (xx ** 2 + yy ** 2))
+    return energy
+
+
+def smart_crop_box(image, target_width, target_height):
+    # Largest window with the target aspect ratio. It spans the full image in
+    # one direction; along the other one we slide it to the position with the
+    # most energy, using a cumulative sum over the projected profile.
+    width, height = image.size
+    target_ratio = target_width / target_height
+    if width / height > target_ratio:
+        crop_w, crop_h = int(round(height * target_ratio)), height
+        axis = 0  # slide horizontally, sum over rows
+    else:
+        crop_w, crop_h = width, int(round(width / target_ratio))
+        axis = 1  # slide vertically, sum over columns
+
+    energy = _saliency(image)
+    profile = energy.sum(axis=axis)
+    scale = len(profile) / (width if axis == 0 else height)
+    window = max(1, int(round((crop_w if axis == 0 else crop_h) * scale)))
+    cumulative = np.concatenate(([0.0], np.cumsum(profile)))
+    sums = cumulative[window:] - cumulative[:-window]
+    offset = int(round(int(np.argmax(sums)) / scale)) if len(sums) else 0
+
+    if axis == 0:
+        left = min(offset, width - crop_w)
+        return left, 0, left + crop_w, crop_h
+    top = min(offset, height - crop_h)
+    return 0, top, crop_w, top + crop_h
+
+
+def export_image(image_data, formats):
+    # Runs in a worker process: decode once, crop and resize per format
+    image = Image.open(io.BytesIO(image_data))
+    image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+    outputs = []
+    for fmt in formats:
+        box = smart_crop_box(image, fmt["width"], fmt["height"])
+        resized = image.resize((fmt["width"], fmt["height"]), Image.LANCZOS, box=box)
+        buffer = io.BytesIO()
+        resized.save(buffer, "PNG")
+        outputs.append((fmt["slug"], buffer.getvalue()))
+    return outputs
+
+
+def export_all(images, formats):
+    # One task per image; returns [(zip name, png bytes), ...] in order
+    if not formats or not images:
+        return []
+    futures = [get_pool().submit(export_image, data, formats) for data in images]
+    exports = []
+    for idx, future in enumerate(futures):
+        for slug, data in future.result():
+            exports.append((f"kanaele/{slug}/generated_image_{idx + 1}.png", data))
+    return exports
@@ -1,87 +1,908 @@
 import streamlit as st
-import requests
 import time
-from io import BytesIO
-from PIL import Image
-import base64
-
-# Get API key from Streamlit secrets
-API_KEY = st.secrets["FLUX_API_KEY"]
-
-def generate_images(prompt, width, height, num_images, model_params):
-    image_urls = []  # List to store image URLs
+import hashlib
+import os
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import flux_metrics
+from flux_analysis import analyze, rank_variants
+from flux_async import fetch_many_sync
+from flux_daemon import DONE_QUEUE, INTERACTIVE_QUEUE, QUEUE as DAEMON_QUEUE, STATUS_KEY as DAEMON_STATUS_KEY, enqueue_run, run_progress
+from flux_export import CHANNEL_FORMATS, export_all
+from flux_generation import (
+    HEARTBEAT_TIMEOUT, BatchRecorder, api_keys, build_payloads, eta_model_from, key_pool_from, router_from, run_batch,
+    store_from,
+)
+from flux_hedging import HedgePolicy, LatencyHistory
+from flux_blurhash import pending_placeholder, placeholder, placeholder_png
+from flux_broadcast import get_hub
+from flux_images import Prefetcher, build_zip, fetch_image
+from flux_palette import MAX_DISTANCE, submit_checks
+from flux_pngmeta import read_params, stamp
+from flux_presets import PRESETS, model_params as preset_model_params
+from flux_routing import quality_for_scheduler
+from flux_sequence import FORMATS as SEQUENCE_FORMATS, MAX_FRAMES, RAMPS, SequenceWriter, ramp_payloads
+from flux_speculation import Speculator
+from flux_store import fingerprint
+from flux_target import plan_for_target
+from flux_tiles import PosterCanvas, plan_tiles, tile_payloads
+from flux_upscale import RENDER_FACTORS, render_size, upscale_all
+from flux_workers import get_pool
+
+# Get API key from Streamlit secrets, see flux_generation.api_keys
+API_KEYS = api_keys(st.secrets)
+API_KEY = API_KEYS[0]
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+# Longest side of the speculative draft
+DRAFT_SIZE = 512
+
+# Options from "Details einstellen" that a permalink brings back
+PERMALINK_OPTIONS = (
+    "upscale_enabled", "upscale_factor", "upscale_sharpen",
+    "poster_enabled", "poster_width", "poster_height",
+    "speculation_enabled", "regenerate_duplicates", "regenerate_off_brand",
+    "hedging_enabled", "hedging_percentile", "hedging_max_extra", "downgrade_enabled",
+    "target_enabled", "target_seconds",
+    "sequence_enabled", "sequence_frames", "sequence_ramp", "sequence_format", "sequence_fps",
+) + tuple(f"sequence_range_{ramp}" for ramp in RAMPS if ramp != "seed")
+
+@st.cache_resource
+def get_router():
+    # Endpoints can be configured as [[FLUX_ENDPOINTS]] tables in the secrets
+    router = router_from(st.secrets)
+    flux_metrics.register("routing", router.snapshot)
+    return router
+
+@st.cache_resource
+def get_key_pool():
+    # Shared by all sessions so the per-key rate accounting is global
+    pool = key_pool_from(st.secrets)
+    flux_metrics.register("api_keys", pool.snapshot)
+    return pool
+
+@st.cache_resource
+def get_latency_history():
+    history = LatencyHistory()
+    flux_metrics.register("latency", history.snapshot)
+    return history
+
+@st.cache_resource
+def get_eta_model():
+    # Model parameters are persisted so predictions survive restarts
+    model = eta_model_from(st.secrets)
+    flux_metrics.register("eta_model", model.snapshot)
+    return model
+
+@st.cache_resource
+def get_store():
+    # Shared by all workers when the database sits on a shared volume
+    return store_from(st.secrets)
+
+@st.cache_data
+def load_static(name):
+    with open(os.path.join(STATIC_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+@st.cache_data
+def theme_link():
+    # The content hash in the URL lets browsers cache the stylesheet until
+    # it actually changes
+    version = hashlib.sha1(load_static("theme.css").encode()).hexdigest()[:12]
+    return f'<link rel="stylesheet" href="app/static/theme.css?v={version}">'
+
+def run_generation(payloads, quality, hedging=None, batch_id=None, resume=None, indexes=None, on_image=None,
+                   on_tick=None, on_finished=None):
+    # indexes maps positions in payloads to variant numbers in the batch,
+    # they differ when only part of a batch is resumed. on_image(variant,
+    # url) is called as each variant finishes, url None if it failed;
+    # on_tick() after every polling round; on_finished(seconds) with the
+    # wall time of the API calls alone, without any UI or download work
+    # around them.
+    indexes = indexes or list(range(len(payloads)))
+    router = get_router()
+    store = get_store()
+    num_images = len(payloads)
     progress_text = st.empty()
     progress_bar = st.progress(0)
     status_container = st.empty()
+    progress_text.text(f"Generating {num_images} images...")
+
+    hedge_policy = None
+    if hedging:
+        hedge_policy = HedgePolicy(
+            get_latency_history(),
+            percentile=hedging["percentile"],
+            max_extra_per_batch=hedging["max_extra"],
+        )
 
-    for i in range(num_images):
-        progress_text.text(f"Generating image {i+1} of {num_images}...")
-        progress_bar.progress((i) / num_images)
-
-        # Create a copy of model_params for each iteration
-        current_params = model_params.copy()
+    # Request IDs and results go to the store so another worker can keep
+    # polling, see flux_generation.BatchRecorder
+    recorder = BatchRecorder(store, batch_id, indexes)
+    # Sessions watching this batch follow the progress through the hub
+    channel = get_hub().get(batch_id)
+    if channel is not None and channel.closed:
+        channel = None
+
+    def on_submit(index, attempt):
+        recorder.on_submit(index, attempt)
+        if attempt["downgraded"]:
+            st.warning(f"Bild {indexes[index]+1} wird mit {attempt['endpoint']['name']} in niedrigerer Qualität "
+                       "erstellt, weil kein Bilddienst der gewählten Qualität erreichbar ist.")
+
+    def on_status(index, status):
+        status_container.text(f"Status for image {indexes[index]+1}: {status}")
+
+    def on_done(index, image_url, done, total, error):
+        progress_text.text(f"{done} of {total} images ready...")
+        variant = recorder.on_done(index, image_url, done, total, error)
+        if image_url is None:
+            st.error(f"Failed to generate image {variant+1}: {error}")
+        if on_image:
+            on_image(variant, image_url)
+
+    def on_progress(fraction, eta):
+        # Without a prediction the bar only moves when images finish
+        progress_bar.progress(fraction)
+        if eta is not None:
+            viewers = f" · {channel.viewers} Zuschauer" if channel is not None and channel.viewers else ""
+            progress_text.text(f"Noch ca. {eta:.0f} Sekunden...{viewers}")
+        if channel is not None:
+            channel.update(progress=(fraction, eta))
+        # Tell other workers this batch is still being polled here
+        recorder.heartbeat()
+        if on_tick:
+            on_tick()
+
+    # Interactive batches make the off-peak daemon back off, see flux_daemon
+    store.queue_push(INTERACTIVE_QUEUE, batch_id)
+    started = time.time()
+    try:
+        run_batch(
+            payloads,
+            get_key_pool(),
+            router,
+            quality,
+            hedge_policy=hedge_policy,
+            latency_history=get_latency_history(),
+            eta_model=get_eta_model(),
+            on_status=on_status,
+            on_done=on_done,
+            on_progress=on_progress,
+            on_submit=on_submit,
+            resume=resume,
+            allow_downgrade=st.session_state.get("downgrade_enabled", False),
+        )
+    finally:
+        store.queue_remove(INTERACTIVE_QUEUE, batch_id)
+    elapsed = time.time() - started
 
-        # If seed is -1 or not set, generate a unique seed for each image
-        if 'seed' not in current_params or current_params['seed'] == -1:
-            current_params['seed'] = int(time.time() * 1000) + i
+    progress_text.empty()
+    progress_bar.empty()
+    status_container.empty()
+    if on_finished:
+        on_finished(elapsed)
+    if len(recorder.results) < num_images:
+        st.warning(f"{len(recorder.results)} von {num_images} Bildern konnten erstellt werden.")
+    return sorted(recorder.results.items())
+
+def generate_images(prompt, width, height, num_images, model_params, hedging=None, batch_id=None,
+                    prefetch=None, slots=None, on_finished=None):
+    # With prefetch, every variant gets the next free slot as soon as its
+    # URL is known: a placeholder of its size while it downloads, the image
+    # itself as soon as the download is done. on_finished: see
+    # run_generation.
+    quality = quality_for_scheduler(model_params.get("scheduler", ""))
+    payloads = build_payloads(prompt, width, height, num_images, model_params)
+    get_store().put_batch(batch_id, status="running", payloads=payloads,
+                          quality=quality, heartbeat=time.time())
+    if prefetch is None:
+        return payloads, run_generation(payloads, quality, hedging, batch_id, on_finished=on_finished)
+    # Variant index -> slot, and the placeholders in slot order for the
+    # sessions watching this batch
+    taken = {}
+    drawn = []
+
+    def on_image(index, url):
+        if not url or index in taken:
+            return
+        prefetch.add(index, url)
+        taken[index] = len(drawn)
+        drawn.append(pending_placeholder(payloads[index]["width"], payloads[index]["height"]))
+        draw_placeholders(slots, drawn[-1:], start=taken[index])
+        publish(batch_id, placeholders=list(drawn))
+
+    def on_tick():
+        # The unstamped bytes are only shown here; finish_batch stamps them
+        # and show_results puts the ranked images in place
+        ready = [(index, data, info) for index, data, info in prefetch.ready() if data is not None]
+        for index, data, info in ready:
+            if slots:
+                slots[taken[index]].image(data, use_column_width="always")
+            if info is not None:
+                drawn[taken[index]] = info
+        if ready:
+            publish(batch_id, placeholders=list(drawn))
+
+    return payloads, run_generation(payloads, quality, hedging, batch_id, on_image=on_image,
+                                    on_tick=on_tick, on_finished=on_finished)
+
+def publish(batch_id, **fields):
+    # Hand state to the sessions watching this batch, if it is live here
+    channel = get_hub().get(batch_id)
+    if channel is not None and not channel.closed:
+        channel.update(**fields)
+
+def placeholder_slots(count):
+    # One empty slot per image: a placeholder first, then the image itself
+    # (see generate_images), ranked once show_results runs
+    return [st.empty() for _ in range(count)]
+
+def draw_placeholders(slots, placeholders, start=0):
+    for slot, info in zip((slots or [])[start:], placeholders):
+        if info:
+            slot.image(placeholder_png(info), use_column_width="always")
+
+def resume_batch(batch_id, batch):
+    # Pick up a batch whose worker went away: keep polling the request IDs
+    # it submitted and only submit the variants that never got one
+    resume = {
+        idx: job for idx, job in batch["jobs"].items()
+        if job.get("status") == "Pending" and job.get("id")
+    }
+    done = {
+        idx: job["result_url"] for idx, job in batch["jobs"].items()
+        if job.get("status") == "Ready" and job.get("result_url")
+    }
+    indexes = [idx for idx in range(len(batch["payloads"])) if idx not in done]
+    get_store().put_batch(batch_id, heartbeat=time.time())
+    resumed = run_generation(
+        [batch["payloads"][idx] for idx in indexes], batch["quality"], batch_id=batch_id,
+        resume={n: resume[idx] for n, idx in enumerate(indexes) if idx in resume},
+        indexes=indexes,
+    )
+    return sorted(list(done.items()) + resumed)
+
+@st.cache_resource
+def get_channel_formats():
+    formats = [dict(fmt) for fmt in st.secrets.get("CHANNEL_FORMATS", [])]
+    return formats or CHANNEL_FORMATS
+
+@st.cache_resource
+def get_brand_palettes():
+    # [BRAND_PALETTES] in the secrets: preset number -> list of hex colours
+    return {str(k): list(v) for k, v in st.secrets.get("BRAND_PALETTES", {}).items()}
+
+def brand_palette(seed_preset):
+    colors = get_brand_palettes().get((seed_preset or "").split(" | ")[0])
+    if not colors:
+        return None
+    return {"colors": colors, "max_distance": float(st.secrets.get("BRAND_PALETTE_MAX_DISTANCE", MAX_DISTANCE))}
+
+def download_images(results, payloads=None, prefetch=None):
+    # Fetch every result once, concurrently on one event loop:
+    # [(variant index, bytes), ...]. Results a Prefetcher already has are
+    # taken from it. With payloads, every PNG is stamped with its generation
+    # parameters right here (see flux_pngmeta), so display, ZIP and store
+    # share that one buffer.
+    def stamped(index, image_data):
+        return stamp(image_data, payloads[index]) if payloads else image_data
+
+    downloaded = []
+    missing = []
+    for index, url in results:
+        image_data = prefetch.take(index, url)[0] if prefetch else None
+        if image_data is None:
+            missing.append((index, url))
         else:
-            # If seed is set, increment it for each image to ensure variation
-            current_params['seed'] = current_params['seed'] + i
-
-        # Initial request to generate image
-        response = requests.post(
-            'https://api.bfl.ml/v1/flux-pro-1.1',
-            headers={
-                'accept': 'application/json',
-                'x-key': API_KEY,
-                'Content-Type': 'application/json',
-            },
-            json={
-                'prompt': prompt,
-                'width': width,
-                'height': height,
-                'num_outputs': 1,
-                **current_params
-            },
-        ).json()
-
-        # Get request ID
-        request_id = response.get("id")
-        if not request_id:
+            downloaded.append((index, stamped(index, image_data)))
+    fetched = fetch_many_sync(API_KEY, [url for _, url in missing]) if missing else []
+    for (index, _), image_data in zip(missing, fetched):
+        if isinstance(image_data, Exception):
+            st.error(f"Download of image {index+1} failed: {image_data}")
             continue
+        downloaded.append((index, stamped(index, image_data)))
+    return sorted(downloaded, key=lambda item: item[0])
+
+def review_variants(batch_id, payloads, downloaded, regenerate_duplicates=False, palette=None,
+                    regenerate_off_brand=False):
+    # Score and hash every variant, collapse near-duplicates, check the
+    # brand palette and, if asked, replace duplicates and off-brand variants
+    # once with fresh seeds. Returns the variants ranked best first together
+    # with their analysis.
+    analyses = analyze_variants(downloaded, palette)
+    order = rank_variants(analyses)
+
+    duplicates = [i for i in order if analyses[i]["duplicate_of"] is not None]
+    off_brand = [i for i in order if analyses[i].get("off_brand")]
+    flux_metrics.incr("analysis.duplicates", len(duplicates))
+    flux_metrics.incr("palette.off_brand", len(off_brand))
+    replace = sorted(set(duplicates if regenerate_duplicates else [])
+                     | set(off_brand if regenerate_off_brand else []))
+    if replace:
+        new_payloads = []
+        for k, i in enumerate(replace):
+            payload = dict(payloads[downloaded[i][0]])
+            payload["seed"] = (int(time.time() * 1000) + 7919 * (k + 1)) % 2147483647
+            new_payloads.append(payload)
+        indexes = list(range(len(payloads), len(payloads) + len(new_payloads)))
+        payloads.extend(new_payloads)
+        get_store().put_batch(batch_id, payloads=payloads)
+        flux_metrics.incr("analysis.regenerated", len(new_payloads))
+        st.info(f"{len(replace)} sehr ähnliche oder markenfremde Varianten werden mit neuem Seed ersetzt...")
+        results = run_generation(new_payloads, quality_for_scheduler(new_payloads[0].get("scheduler", "")),
+                                 batch_id=batch_id, indexes=indexes)
+        replacements = download_images(results, payloads)
+        downloaded = [item for i, item in enumerate(downloaded) if i not in replace] + replacements
+        analyses = analyze_variants(downloaded, palette)
+        order = rank_variants(analyses)
+
+    ranked = [downloaded[i] for i in order]
+    ranked_analyses = []
+    for i in order:
+        analysis = dict(analyses[i])
+        # Refer to duplicates by their position in the ranked list
+        if analysis["duplicate_of"] is not None:
+            analysis["duplicate_of"] = order.index(analysis["duplicate_of"])
+        ranked_analyses.append(analysis)
+    return ranked, ranked_analyses
+
+def analyze_variants(downloaded, palette=None):
+    # Hashing, scoring and the palette checks all run in the worker pool,
+    # the script thread only waits for them
+    started = time.time()
+    checks = submit_checks([data for _, data in downloaded], palette["colors"],
+                           palette["max_distance"]) if palette else []
+    analyses = get_pool().map(analyze, [data for _, data in downloaded])
+    for analysis, check in zip(analyses, checks):
+        analysis.update(check.result())
+    flux_metrics.set_gauge("analysis.ms_per_image", round((time.time() - started) * 1000 / max(1, len(downloaded)), 1))
+    return analyses
+
+def store_images(batch_id, payloads, ranked, analyses, originals=None):
+    # Keep the reviewed variants in the shared store. originals holds the
+    # API renders when the shown images were upscaled locally; the cache
+    # then points at the render that matches the request. The PNGs were
+    # stamped on download and upscaling keeps the stamp.
+    store = get_store()
+    images = []
+    keys = []
+    export_keys = []
+    for n, (index, image_data) in enumerate(ranked):
+        key = f"{batch_id}/{index}"
+        store.put_blob(key, image_data)
+        if originals is None:
+            store.cache_set(fingerprint(payloads[index]), key)
+        else:
+            original_key = f"{batch_id}/{index}/original"
+            store.put_blob(original_key, originals[n])
+            store.cache_set(fingerprint(payloads[index]), original_key)
+            export_keys.append([f"original/generated_image_{n + 1}.png", original_key])
+        images.append(image_data)
+        keys.append(key)
+
+    # Channel formats are not made here: they are cut on download, see
+    # channel_zip
+    exports = [(f"original/generated_image_{n + 1}.png", data) for n, data in enumerate(originals or [])]
+    store.put_batch(batch_id, status="complete", images=keys, exports=export_keys, analysis=analyses)
+    return images, exports
+
+def finish_batch(batch_id, payloads, results, upscale=None,
+                 regenerate_duplicates=False, palette=None, regenerate_off_brand=False,
+                 prefetch=None):
+    # Download, review, optionally upscale and store a generated batch
+    downloaded = download_images(results, payloads, prefetch)
+    urls = dict(results)
+    placeholders = {index: (prefetch.take(index, urls[index])[1] if prefetch else None) or placeholder(data)
+                    for index, data in downloaded}
+    # The slots already show the prefetched images, see generate_images
+    publish(batch_id, placeholders=[placeholders[index] for index, _ in downloaded])
+    ranked, analyses = review_variants(batch_id, payloads, downloaded,
+                                       regenerate_duplicates, palette, regenerate_off_brand)
+    for (index, data), analysis in zip(ranked, analyses):
+        # Kept with the batch for galleries and permalinks
+        analysis["placeholder"] = placeholders.get(index) or placeholder(data)
+    originals = None
+    if upscale:
+        originals = [data for _, data in ranked]
+        upscaled = upscale_all(originals, upscale["width"], upscale["height"], upscale["sharpen"])
+        ranked = [(index, data) for (index, _), data in zip(ranked, upscaled)]
+        for analysis in analyses:
+            analysis["upscaled_from"] = f"{upscale['render_width']}×{upscale['render_height']}"
+    return store_images(batch_id, payloads, ranked, analyses, originals) + (analyses,)
+
+def offpeak_panel(prompt, seed_preset, width, height, num_outputs):
+    # Queue a list of prompts for flux_daemon and follow its runs
+    store = get_store()
+    prompts = st.text_area(
+        "Bildkonzepte, eines pro Zeile",
+        value=prompt,
+        height=150,
+        help="Jede Zeile wird mit Modus, Größe und Variantenzahl von oben ein eigener Durchlauf. Der Hintergrunddienst (flux_daemon.py) arbeitet die Warteschlange in seinen Zeitfenstern ab und pausiert, solange hier Bilder erstellt werden.",
+        key="offpeak_prompts"
+    )
+    if st.button("In die Warteschlange"):
+        try:
+            enqueue_run(store, prompts.splitlines(), seed_preset, width, height, num_outputs)
+            st.success("Zur Warteschlange hinzugefügt.")
+        except ValueError:
+            st.error("Bitte mindestens ein Bildkonzept eingeben.")
+
+    if st.toggle("Warteschlange anzeigen", value=False, key="show_offpeak"):
+        status = store.cache_get(DAEMON_STATUS_KEY)
+        if status is None:
+            st.caption("Hintergrunddienst läuft nicht.")
+        else:
+            labels = {"running": "arbeitet", "idle": "wartet auf Aufträge", "paused": "pausiert"}
+            text = f"Hintergrunddienst {labels.get(status['state'], status['state'])}"
+            st.caption(text + (f" ({status['reason']})" if status.get("reason") else ""))
+        for run_id in store.queue_items(DAEMON_QUEUE) + store.queue_items(DONE_QUEUE)[::-1][:5]:
+            run, items = run_progress(store, run_id)
+            done = [item for item, item_status in items if item_status == "complete"]
+            st.markdown(f"**{time.strftime('%d.%m. %H:%M', time.localtime(run.get('created', 0)))}** · "
+                        f"{run.get('preset', '').split(' | ')[0]} · {len(done)} von {len(items)} fertig")
+            for item in done:
+                st.markdown(f'- <a href="?batch={item["batch_id"]}" target="_blank">{item["prompt"][:80]}</a>',
+                            unsafe_allow_html=True)
+
+def upscale_settings(width, height, render_width, render_height):
+    # Local upscale from the render size to the requested size, None when
+    # the API already renders at full size
+    if render_width >= width and render_height >= height:
+        return None
+    return {
+        "width": width,
+        "height": height,
+        "render_width": render_width,
+        "render_height": render_height,
+        "sharpen": st.session_state.get("upscale_sharpen", True),
+    }
 
-        # Poll for results
-        while True:
-            time.sleep(0.5)
-            result = requests.get(
-                'https://api.bfl.ml/v1/get_result',
-                headers={
-                    'accept': 'application/json',
-                    'x-key': API_KEY,
-                },
-                params={
-                    'id': request_id,
-                },
-            ).json()
-
-            status = result.get("status")
-            status_container.text(f"Status for image {i+1}: {status}")
-
-            if status == "Ready":
-                image_url = result['result']['sample']
-                if image_url:
-                    image_urls.append(image_url)
-                break
-            elif status == "Failed":
-                st.error(f"Failed to generate image {i+1}")
-                break
+def show_target_plan(target):
+    text = (f"Zielzeit {target['target']} s: {target['scheduler']}, {target['num_inference_steps']} Schritte, "
+            f"{target['render_width']}×{target['render_height']}")
+    text += f" – vorhergesagt {target['predicted']:.1f} s"
+    if not target["from_model"]:
+        text += " (grobe Schätzung, noch zu wenige Messungen)"
+    if target["fits"]:
+        st.info(text)
+    else:
+        st.warning(text + ". Selbst die schnellste Einstellung schafft die Zielzeit voraussichtlich nicht.")
+
+def record_target(batch_id, target, actual):
+    # Predicted vs. actual API time, kept with the batch and in the metrics
+    # so the prediction error can be watched over time. actual is the
+    # run_batch span only, like the prediction (see run_generation).
+    target["actual"] = round(actual, 1)
+    get_store().put_batch(batch_id, target=target)
+    flux_metrics.incr("target.batches")
+    if actual <= target["target"]:
+        flux_metrics.incr("target.met")
+    flux_metrics.set_gauge("target.last_error_s", round(actual - target["predicted"], 1))
+    st.caption(f"Zielzeit {target['target']} s · vorhergesagt {target['predicted']:.1f} s · "
+               f"tatsächlich {actual:.1f} s")
+
+def generate_poster(prompt, width, height, model_params, hedging=None, batch_id=None):
+    # Tiles share seed and prompt and are submitted together like variants.
+    # Each tile is downloaded and blended into the memory-mapped canvas as
+    # soon as it is ready and dropped after that, so only the tiles being
+    # downloaded are ever held in memory.
+    plan = plan_tiles(width, height)
+    quality = quality_for_scheduler(model_params.get("scheduler", ""))
+    payloads = tile_payloads(prompt, plan, model_params)
+    get_store().put_batch(batch_id, status="running", payloads=payloads, poster=plan,
+                          quality=quality, heartbeat=time.time())
+    canvas = PosterCanvas(plan)
+
+    def blend(index, url):
+        try:
+            canvas.add(index, fetch_image(url, API_KEY))
+        except Exception:
+            # finish_poster tries this tile again
+            pass
+
+    try:
+        with ThreadPoolExecutor(max_workers=2) as downloads:
+            results = run_generation(payloads, quality, hedging, batch_id, on_image=lambda index, url: (
+                url and downloads.submit(blend, index, url)))
+    except BaseException:
+        canvas.close()
+        raise
+    return plan, results, canvas
+
+def finish_poster(batch_id, plan, results, canvas=None):
+    # Blend the tiles that are not on the canvas yet (all of them for a
+    # resumed batch) one at a time, then store the poster as a single PNG
+    if len(results) < len(plan["xs"]) * len(plan["ys"]):
+        if canvas is not None:
+            canvas.close()
+        st.error("Nicht alle Kacheln konnten erstellt werden, das Poster wird nicht zusammengesetzt.")
+        return [], []
+    canvas = canvas or PosterCanvas(plan)
+    try:
+        for index, url in results:
+            if index not in canvas.added:
+                canvas.add(index, fetch_image(url, API_KEY))
+        poster = canvas.to_png()
+    finally:
+        canvas.close()
+    key = f"{batch_id}/poster"
+    get_store().put_blob(key, poster)
+    get_store().put_batch(batch_id, status="complete", images=[key], exports=[],
+                          analysis=[{"poster": plan}])
+    return [poster], []
+
+def open_sequence(spec, width, height):
+    # SequenceWriter opens the file itself
+    fd, path = tempfile.mkstemp(suffix="." + SEQUENCE_FORMATS[spec["format"]][0])
+    os.close(fd)
+    return SequenceWriter(path, spec["format"], spec["frames"], width, height, 1000 // spec["fps"])
+
+def generate_sequence(prompt, width, height, model_params, spec, hedging=None, batch_id=None):
+    # Frames are submitted together like variants; each one is downloaded
+    # as soon as it is ready and appended to the animation in order
+    payloads = ramp_payloads(prompt, width, height, model_params, spec["frames"], spec["ramp"], *spec["range"])
+    quality = quality_for_scheduler(model_params.get("scheduler", ""))
+    get_store().put_batch(batch_id, status="running", payloads=payloads, sequence=spec,
+                          quality=quality, heartbeat=time.time())
+    writer = open_sequence(spec, width, height)
+
+    def download(index, url):
+        try:
+            writer.add(index, fetch_image(url, API_KEY))
+        except Exception:
+            writer.add(index, None)
+
+    with ThreadPoolExecutor(max_workers=4) as downloads:
+        run_generation(payloads, quality, hedging, batch_id, on_image=lambda index, url: (
+            downloads.submit(download, index, url) if url else writer.add(index, None)))
+    return finish_sequence(batch_id, spec, writer)
+
+def finish_sequence(batch_id, spec, writer, results=None):
+    # results is only passed when a resumed batch is finished here
+    if results is not None:
+        downloaded = dict(download_images(results))
+        for index in range(spec["frames"]):
+            writer.add(index, downloaded.pop(index, None))
+    frames = writer.close()
+    try:
+        if frames == 0:
+            st.error("Keine Frames konnten erstellt werden.")
+            return [], [], None
+        with open(writer.path, "rb") as f:
+            animation = f.read()
+    finally:
+        os.remove(writer.path)
+    key = f"{batch_id}/sequence"
+    get_store().put_blob(key, animation)
+    analyses = [{"sequence": dict(spec, encoded=frames)}]
+    get_store().put_batch(batch_id, status="complete", images=[key], exports=[], analysis=analyses)
+    return [animation], [], analyses
+
+def load_images(batch):
+    store = get_store()
+    images = [data for data in (store.get_blob(key) for key in batch.get("images", [])) if data]
+    exports = [(name, store.get_blob(key)) for name, key in batch.get("exports", [])]
+    return images, [(name, data) for name, data in exports if data]
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def load_complete_batch(batch_id):
+    # Complete batches never change, so their bytes are read from the store
+    # once and shared by every session that opens the permalink
+    batch = get_store().get_batch(batch_id)
+    images, exports = load_images(batch)
+    return images, exports, batch.get("analysis")
+
+def current_settings(prompt, seed_preset, width, height, num_outputs):
+    # Everything a permalink needs to bring the form back
+    settings = {
+        "prompt": prompt,
+        "preset": seed_preset,
+        "width": width,
+        "height": height,
+        "num_outputs": num_outputs,
+        "channel_formats": st.session_state.get(f"channel_formats_{seed_preset}", default_channel_formats(seed_preset)),
+    }
+    settings.update({key: st.session_state[key] for key in PERMALINK_OPTIONS if key in st.session_state})
+    return settings
+
+def permalink_settings():
+    # Settings of the batch the session was opened with (?batch=), read once
+    # per session and used as widget defaults so the form looks the same
+    if "permalink_settings" not in st.session_state:
+        settings = {}
+        if "batch" in st.query_params:
+            batch = get_store().get_batch(st.query_params["batch"])
+            settings = (batch or {}).get("settings") or {}
+        st.session_state["permalink_settings"] = settings
+    return st.session_state["permalink_settings"]
+
+def sequence_zip_name(analyses):
+    # Animations keep their own file extension inside the ZIP
+    if analyses and "sequence" in analyses[0]:
+        return {"name_pattern": "animation_{}." + SEQUENCE_FORMATS[analyses[0]["sequence"]["format"]][0]}
+    return {}
+
+def channel_zip(images, channel_formats):
+    # Smart crop + resize per format in the worker pool, only once someone
+    # actually downloads them; nothing is kept
+    return build_zip([], extra=export_all(images, channel_formats))
+
+def show_results(images, exports=(), elapsed=None, analyses=None, batch_id=None, slots=None, zip_data=None,
+                 channel=None, channel_formats=None):
+    # slots from placeholder_slots are filled in order, replacing the
+    # placeholders. With channel, the finished batch (the same bytes objects
+    # and ZIP) is handed to the sessions watching it. channel_formats get a
+    # second download that cuts them on click.
+    analyses = analyses or [{} for _ in images]
+    duplicates = [idx for idx, a in enumerate(analyses) if a.get("duplicate_of") is not None]
+    slots = list(slots or [])
+
+    # Process and display images, best ranked first
+    for idx, image_data in enumerate(images):
+        if idx in duplicates:
+            continue
+        caption = f"Generiertes Bild {idx + 1}"
+        if "score" in analyses[idx]:
+            caption += f" · Schärfe {analyses[idx]['sharpness']:.0f} · Kontrast {analyses[idx]['contrast']:.2f}"
+        if "poster" in analyses[idx]:
+            plan = analyses[idx]["poster"]
+            caption = f"Poster {plan['width']}×{plan['height']} aus {len(plan['xs']) * len(plan['ys'])} Kacheln"
+        if "sequence" in analyses[idx]:
+            spec = analyses[idx]["sequence"]
+            caption = f"Animation ({spec['format']}) · {spec['encoded']} von {spec['frames']} Frames · {spec['fps']} fps"
+        if "palette_distance" in analyses[idx]:
+            if analyses[idx]["off_brand"]:
+                caption += f" · ⚠ abseits der Markenpalette (ΔE {analyses[idx]['palette_distance']:.0f})"
+            else:
+                caption += f" · Markenfarben ✓ (ΔE {analyses[idx]['palette_distance']:.0f})"
+        if "upscaled_from" in analyses[idx]:
+            caption += f" · lokal hochskaliert von {analyses[idx]['upscaled_from']} (Original im ZIP)"
+        # st.image takes the encoded PNG as-is, no PIL decode
+        # and re-encode needed
+        (slots.pop(0) if slots else st).image(
+            image_data,
+            caption=caption,
+            use_column_width="always"
+        )
+    for slot in slots:
+        slot.empty()
+
+    if duplicates:
+        # Near-copies of a better variant, collapsed so nobody reviews them twice
+        with st.expander(f"Sehr ähnliche Varianten ({len(duplicates)})", expanded=False):
+            for idx in duplicates:
+                st.image(
+                    images[idx],
+                    caption=f"Generiertes Bild {idx + 1} · ähnlich zu Bild {analyses[idx]['duplicate_of'] + 1}",
+                    use_column_width="always"
+                )
+
+    # Create centered container for single download button
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col2:
+        # Add single download button for ZIP file
+        if zip_data is None:
+            zip_data = build_zip(images, extra=exports, **sequence_zip_name(analyses))
+        st.download_button(
+            label="Bilder herunterladen",
+            data=zip_data,
+            file_name="generated_images.zip",
+            mime="application/zip",
+            key=f"download_all_{time.time()}",  # Unique key using timestamp
+            use_container_width=True
+        )
 
-        progress_bar.progress((i + 1) / num_images)
+        if channel_formats:
+            st.download_button(
+                label=f"Kanal-Formate herunterladen ({len(channel_formats)})",
+                data=lambda: channel_zip(images, channel_formats),
+                file_name="kanal_formate.zip",
+                mime="application/zip",
+                key=f"download_channels_{time.time()}",
+                use_container_width=True
+            )
+
+        if batch_id:
+            # Relative link, so it works behind any host or proxy path
+            st.markdown(
+                f'<p style="text-align: center;"><a href="?batch={batch_id}" target="_blank">🔗 Permalink zu diesem Ergebnis</a></p>',
+                unsafe_allow_html=True
+            )
+
+        if elapsed is not None:
+            # Add generation time
+            st.markdown(
+                f'<p style="color: #757575; text-align: center;">Generierungszeit: {elapsed:.2f} Sekunden</p>',
+                unsafe_allow_html=True
+            )
+
+    if channel is not None:
+        channel.close(result={"images": images, "exports": exports, "analyses": analyses,
+                              "zip": zip_data, "elapsed": elapsed, "channel_formats": channel_formats})
+
+def default_channel_formats(seed_preset):
+    # Preset "02" is meant for campaign rollouts and social media; one
+    # format preselected, the rest on request
+    if seed_preset and seed_preset.startswith("02"):
+        return [fmt["name"] for fmt in get_channel_formats()[:1]]
+    return []
+
+def start_draft(key, cancel, router, keys):
+    # Low-res single image for the speculative preview, runs in a thread
+    prompt, preset, width, height, params = key
+    scale = min(1.0, DRAFT_SIZE / max(width, height))
+    draft_width = max(256, int(width * scale) // 32 * 32)
+    draft_height = max(256, int(height * scale) // 32 * 32)
+    draft_params = dict(params, num_inference_steps=min(params["num_inference_steps"], 20),
+                        scheduler="Schnellvorschau")
+    payloads = build_payloads(prompt, draft_width, draft_height, 1, draft_params)
+    image_urls = run_batch(payloads, keys, router, "draft", cancel=cancel)
+    if not image_urls or cancel.is_set():
+        return None
+    return fetch_image(image_urls[0], API_KEY)
+
+def get_speculator():
+    if "speculator" not in st.session_state:
+        router = get_router()
+        keys = get_key_pool()
+        st.session_state["speculator"] = Speculator(
+            lambda key, cancel: start_draft(key, cancel, router, keys),
+            debounce=st.secrets.get("SPECULATION_DEBOUNCE", 1.5),
+            budget=st.secrets.get("SPECULATION_BUDGET", 5),
+        )
+    return st.session_state["speculator"]
+
+@st.fragment(run_every=1.0)
+def speculation_status():
+    # Re-runs on its own, so a draft starts once the committed prompt has
+    # been left alone for the debounce interval
+    speculator = get_speculator()
+    speculator.tick()
+    status = speculator.status()
+    if status == "running":
+        st.caption("Entwurf wird vorbereitet...")
+    elif status == "ready":
+        st.caption("Entwurf bereit")
+
+def reproduce_image(params):
+    # Same parameters, same image: serve it from the result cache if any
+    # worker made it before, otherwise generate exactly this payload once
+    store = get_store()
+    key = store.cache_get(fingerprint(params))
+    cached = store.get_blob(key) if key else None
+    if cached is not None:
+        flux_metrics.incr("reproduce.cache_hits")
+        st.success("Aus dem Ergebnis-Cache, kein API-Aufruf nötig.")
+        show_results([cached])
+        return
+    flux_metrics.incr("reproduce.generated")
+    payloads = [dict(params, num_outputs=1)]
+    batch_id = uuid.uuid4().hex
+    st.query_params["batch"] = batch_id
+    quality = quality_for_scheduler(params.get("scheduler") or "")
+    store.put_batch(batch_id, status="running", payloads=payloads, quality=quality, heartbeat=time.time())
+    with st.spinner('Bild wird reproduziert...'):
+        results = run_generation(payloads, quality, batch_id=batch_id)
+        if results:
+            images, exports, analyses = finish_batch(batch_id, payloads, results)
+            show_results(images, exports, analyses=analyses)
+
+def reproduce_panel():
+    uploaded = st.file_uploader(
+        "Bild öffnen",
+        type=["png"],
+        help="Ein hier erstelltes PNG enthält Konzept, Seed und Einstellungen. Liegt das Ergebnis noch im Cache, wird es ohne API-Aufruf angezeigt.",
+        key="reproduce_upload"
+    )
+    if uploaded is None:
+        return
+    params = read_params(uploaded.getvalue())
+    if params is None:
+        st.warning("In diesem Bild sind keine Generierungsparameter gespeichert.")
+        return
+    st.caption(
+        f"Seed {params.get('seed')} · Beachtung {params.get('guidance_scale')} · "
+        f"Detailgenauigkeit {params.get('num_inference_steps')} · {params.get('scheduler')} · "
+        f"{params.get('width')}×{params.get('height')}"
+    )
+    st.text(params.get("prompt") or "")
+    if st.button("Bild reproduzieren", key="reproduce_button"):
+        try:
+            reproduce_image(params)
+        except Exception as e:
+            st.error(f"An error occurred: {str(e)}")
 
-    progress_text.empty()
-    progress_bar.empty()
-    status_container.empty()
-    return image_urls
+def watch_batch(channel):
+    # Follow a batch another session in this process is running: progress,
+    # placeholders and finally the owner's image bytes, with no API calls,
+    # downloads or decodes of our own. The owner closes the channel however
+    # its run ends; False if it ended without results, the caller then
+    # falls back to the shared store (and may resume the batch).
+    channel.join()
+    flux_metrics.incr("broadcast.watched")
+    try:
+        if not channel.closed:
+            st.info("👀 Diese Bilder werden gerade in einer anderen Sitzung erstellt.")
+        slots = placeholder_slots(channel.slots)
+        progress_text = st.empty()
+        progress_bar = st.progress(0)
+        drawn = []
+        while True:
+            state = channel.state()
+            fraction, eta = state["progress"]
+            progress_bar.progress(fraction)
+            if eta is not None:
+                progress_text.text(f"Noch ca. {eta:.0f} Sekunden...")
+            if state["placeholders"] != drawn:
+                draw_placeholders(slots, state["placeholders"])
+                drawn = state["placeholders"]
+            if state["closed"]:
+                break
+            channel.wait(state["version"], HEARTBEAT_TIMEOUT)
+        progress_text.empty()
+        progress_bar.empty()
+        result = state["result"]
+        if result is None:
+            for slot in slots:
+                slot.empty()
+            st.warning(state["error"])
+            return False
+        show_results(result["images"], result["exports"], result["elapsed"], result["analyses"],
+                     channel.batch_id, slots, zip_data=result["zip"], channel_formats=result.get("channel_formats"))
+        return True
+    finally:
+        channel.leave()
+
+def restore_batch(batch_id):
+    # Render or continue a batch from the shared store, whichever worker
+    # this session landed on
+    channel = get_hub().get(batch_id)
+    if channel is not None and (not channel.closed or channel.result is not None) and watch_batch(channel):
+        return
+    store = get_store()
+    batch = store.get_batch(batch_id)
+    if batch is None:
+        return
+    slots = None
+    if batch.get("status") == "running":
+        if time.time() - batch.get("heartbeat", 0) < HEARTBEAT_TIMEOUT:
+            # Still being polled by another worker, wait for it
+            with st.spinner('Bilder werden erstellt...'):
+                while batch.get("status") == "running" and \
+                        time.time() - batch.get("heartbeat", 0) < HEARTBEAT_TIMEOUT:
+                    time.sleep(1.0)
+                    batch = store.get_batch(batch_id)
+            st.rerun()
+        with st.spinner('Creating your masterpieces...'):
+            results = resume_batch(batch_id, batch)
+            if batch.get("poster"):
+                images, exports = finish_poster(batch_id, batch["poster"], results)
+                analyses = None
+            elif batch.get("sequence"):
+                payload = batch["payloads"][0]
+                images, exports, analyses = finish_sequence(
+                    batch_id, batch["sequence"],
+                    open_sequence(batch["sequence"], payload["width"], payload["height"]), results)
+            else:
+                images, exports, analyses = finish_batch(
+                    batch_id, batch["payloads"], results, batch.get("upscale"),
+                    palette=batch.get("palette"))
+    elif batch.get("status") == "complete":
+        # Placeholders from the batch record are up before the blobs are read
+        shown = [a.get("placeholder") for a in batch.get("analysis") or [] if a.get("duplicate_of") is None]
+        slots = placeholder_slots(len(shown))
+        draw_placeholders(slots, shown)
+        images, exports, analyses = load_complete_batch(batch_id)
+    else:
+        images, exports = load_images(batch)
+        analyses = batch.get("analysis")
+    if images:
+        show_results(images, exports, analyses=analyses, batch_id=batch_id, slots=slots,
+                     channel_formats=batch.get("channel_formats"))
 
 def main():
 
@@ -92,190 +913,37 @@ def main():
     num_inference_steps = 50  # Default value
     seed = -1  # Default value
 
-    # Update the preset dictionary with optimized parameters
-# Update the preset dictionary with optimized parameters
-    preset_params = {
-        "01 | Folge strickt meinem Konzept in höchster Qualität": {
-            "seed": 67890,
-            "guidance_scale": 12.0,
-            "num_inference_steps": 100,
-            "scheduler": "Premium-Qualität (DPM++ 2M Karras)",
-            "description": "Maximale Kontrolle über visuelle Identität",
-            "num_outputs": 1
-        },
-        "02 | Folge meinem Konzept mit kontrollierten Variationen": {
-            "seed": 12345,
-            "guidance_scale": 7.5,
-            "num_inference_steps": 50,
-            "scheduler": "Standard-Produktion (DPM++ 2M)",
-            "description": "Konsistente Basis mit kontrollierten Variationen",
-            "num_outputs": 4
-        },
-        "03 | Findet kreative Ideen für mein Konzept": {
-            "seed": -1,
-            "guidance_scale": 3.0,
-            "num_inference_steps": 30,
-            "scheduler": "Kreativ-Exploration (Euler A)",
-            "description": "Maximale kreative Freiheit für neue Ideen",
-            "num_outputs": 4
-        }
-    }
+    # Presets are shared with the HTTP service, see flux_presets
+    preset_params = PRESETS
 
     st.markdown("<h1 class='title'>AI Image Generator | Flux 1.1 Pro </h1>", unsafe_allow_html=True)
 
-   # Custom CSS with Material Design grey and black theme
-    st.markdown("""
-        <style>
-
-        .title {
-        text-align: left;
-        color: #757575;  /* Material Grey 900 - darkest grey */
-        font-weight: 500;  /* Medium weight for better visibility */
-        font-size: 24px
-        }
-
-        /* Main background */
-        .stApp {
-            background-color: #212121;
-            color: #ffffff;
-        }
-
-        /* Expander */
-        .streamlit-expanderHeader {
-            background-color: transparent;
-            color: #ffffff;
-            border-radius: 4px;
-            padding: 8px;
-        }
-
-        .streamlit-expanderHeader:hover {
-            color: #ffffff;  /* Bright white text on hover */
-            border-color: #9e9e9e;  /* Lighter border on hover */
-            background-color: rgba(158, 158, 158, 0.1);  /* Very subtle grey background */
-
-        }
-
-        .streamlit-expanderContent {
-            color: #ffffff;  /* Bright white text on hover */
-            border-color: #9e9e9e;  /* Lighter border on hover */
-            background-color: rgba(158, 158, 158, 0.1);  /* Very subtle grey background */
-
-        }
-
-        /* Input fields and controls */
-        .stTextInput>div>div>input {
-            background-color: #424242;
-            color: #ffffff;
-            border: 1px solid #616161;
-        }
-
-        .stSlider>div>div>div {
-            background-color: #757575;
-        }
-
-        .stSelectbox>div>div {
-            background-color: transparent;
-            color: #ffffff;
-            border: 1px solid #616161;
-        }
-
-        /* Custom classes */
-        .parameter-title {
-            color: #ffffff;
-            font-size: 14px;
-            font-weight: 500;
-        }
-
-        .parameter-help {
-            color: #bdbdbd;
-            font-size: 12px;
-        }
-
-        /* Button styling */
-        .stButton>button {
-            background-color: #757575;
-            color: #ffffff;
-            border: none;
-            border-radius: 4px;
-            padding: 8px 16px;
-        }
-
-        .stButton>button:hover {
-            background-color: transparent;
-            border: 1px solid #757575;
-        }
-        div.stButton > button {
-            width: 100%;
-            height: 50px;
-            background-color: transparent;
-            color: white;
-            border-radius: 4px;
-            border: none;
-            padding: 8px 16px;
-            font-size: 16px;
-            font-weight: 500;
-            transition: all 0.3s ease;
-            text-transform: uppercase;  /* Optional: makes text uppercase */
-            letter-spacing: 1px;  /* Optional: spaces out the text */
-        }
-        div.stButton > button:hover {
-                color: #ffffff;  /* Bright white text on hover */
-                border-color: #9e9e9e;  /* Lighter border on hover */
-                background-color: rgba(158, 158, 158, 0.1);  /* Very subtle grey background */
-                text-shadow: 0 0 8px rgba(255, 255, 255, 0.3);  /* Subtle glow effect */
-        }
-        .button-container {
-            padding: 10px 0;
-            margin: 100px 0;
-        }
-         /* Add this to your existing CSS styles */
-        /* Add this to your existing CSS styles */
-        .download-button {
-            width: 100%;
-            height: 50px;
-            background-color: transparent;
-            color: white;
-            border-radius: 4px;
-            border: 1px solid #757575;
-            padding: 8px 16px;
-            font-size: 16px;
-            font-weight: 500;
-            transition: all 0.3s ease;
-            text-transform: uppercase;
-            letter-spacing: 1px;
-            margin: 20px auto;
-        }
-
-        .download-button:hover {
-            background-color: rgba(158, 158, 158, 0.1);
-            border-color: #9e9e9e;
-            text-shadow: 0 0 8px rgba(255, 255, 255, 0.3);
-        }
-
-        .center-content {
-            display: flex;
-            justify-content: center;
-            width: 100%;
-            margin: 20px 0;
-        }
-
-        </style>
-    """, unsafe_allow_html=True)
+    # Theme lives in static/theme.css, served once by Streamlit's static
+    # file route and cached by the browser; only a small <link> is sent
+    # per rerun
+    st.markdown(theme_link(), unsafe_allow_html=True)
 
+    # Opened through a permalink: the form starts with that batch's settings
+    restored = permalink_settings()
 
     prompt = st.text_area(
         "Bildkonzept:",
+        value=restored.get("prompt", ""),
         height=200,
-        placeholder="Beschreibe dein Bild..."
+        placeholder="Beschreibe dein Bild...",
+        key="prompt"
     )
 
     # First selectbox (Ziel des Bildes)
     seed_preset = st.selectbox(
         "Modus:",
         options=list(preset_params.keys()),
+        index=list(preset_params.keys()).index(restored["preset"]) if restored.get("preset") in preset_params else 0,
         help="Wähle eine vordefinierten Modus für deine Marketingziele",
         key="preset_selector"
     )
+    # Per-preset widgets only take the permalink values for its own preset
+    same_preset = restored.get("preset") == seed_preset
 
     # Get the selected preset parameters
     selected_preset = preset_params[seed_preset] if seed_preset else preset_params[list(preset_params.keys())[0]]
@@ -283,17 +951,17 @@ def main():
     # Input controls
     col1, col2, col3 = st.columns(3)
     with col1:
-        width = st.number_input("Breite", min_value=128, max_value=1024, value=1024, step=128)
+        width = st.number_input("Breite", min_value=128, max_value=1024, value=restored.get("width", 1024), step=128)
 
     with col2:
-        height = st.number_input("Höhe", min_value=128, max_value=1024, value=768, step=128)
+        height = st.number_input("Höhe", min_value=128, max_value=1024, value=restored.get("height", 768), step=128)
 
     with col3:
         num_outputs = st.number_input(
             "Anzahl Varianten",
             min_value=1,
             max_value=4,
-            value=selected_preset["num_outputs"],
+            value=restored.get("num_outputs", selected_preset["num_outputs"]) if same_preset else selected_preset["num_outputs"],
             key=f"num_outputs_{seed_preset}"
         )
 
@@ -306,26 +974,36 @@ def main():
         "num_outputs": selected_preset["num_outputs"]
     }
 
+    # Speculative draft for the current prompt, preset and size
+    speculation_key = None
+    if st.session_state.get("speculation_enabled", False):
+        speculation_key = (prompt, seed_preset, width, height, {
+            "seed": selected_preset["seed"],
+            "guidance_scale": selected_preset["guidance_scale"],
+            "num_inference_steps": selected_preset["num_inference_steps"],
+        })
+        get_speculator().observe(speculation_key)
+        speculation_status()
+
     if st.button("✨Bilder generieren✨"):
         if not prompt:
             st.error("Please enter a prompt first!")
             return
 
+        if speculation_key is not None:
+            draft = get_speculator().claim(speculation_key)
+            if draft is not None:
+                st.image(draft, caption="Entwurf (niedrige Auflösung)", use_column_width="always")
+
+        channel = None
         try:
             with st.spinner('Creating your masterpieces...'):
                 start_time = time.time()
 
                 # Get the selected preset parameters
                 if seed_preset:
-                    selected_preset = preset_params[seed_preset]
-
                     # Create model parameters dictionary with all settings
-                    model_params = {
-                        "seed": selected_preset["seed"] if selected_preset["seed"] == -1 else int(time.time()),  # New seed each time unless random
-                        "guidance_scale": selected_preset["guidance_scale"],
-                        "num_inference_steps": selected_preset["num_inference_steps"],
-                        "scheduler": selected_preset["scheduler"].split(" (")[0]
-                    }
+                    model_params = preset_model_params(seed_preset)
                 else:
                     # Default parameters if no preset is selected
                     model_params = {
@@ -335,96 +1013,142 @@ def main():
                         "scheduler": "Standard-Produktion (DPM++ 2M)"
                     }
 
-                # Generate images with the complete model_params
-                image_urls = generate_images(prompt, width, height, num_outputs, model_params)
-
-                if image_urls:
-                    st.success("✨ Bilder erfolgreich generiert!")
-                    # ... rest of the code remains the same ...
-
-                    # Store all images data
-                    all_images_data = []
-
-                    # Process and display images
-                    for idx, url in enumerate(image_urls):
-                        image_response = requests.get(
-                            url,
-                            headers={
-                                'accept': 'application/json',
-                                'x-key': API_KEY,
-                            }
-                        )
-
-                        if image_response.status_code == 200:
-                            # Store image data
-                            all_images_data.append(image_response.content)
-
-                            # Convert to PIL Image for display
-                            image = Image.open(BytesIO(image_response.content))
-
-                            # Display image with full column width
-                            st.image(
-                                image,
-                                caption=f"Generiertes Bild {idx + 1}",
-                                use_column_width="always"
-                            )
-
-                    # Create centered container for single download button
-                    col1, col2, col3 = st.columns([1, 2, 1])
-                    with col2:
-                        # Create a ZIP in memory
-                        import io
-                        import zipfile
-
-                        zip_buffer = io.BytesIO()
-                        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                            for idx, img_data in enumerate(all_images_data):
-                                zip_file.writestr(f"generated_image_{idx + 1}.png", img_data)
-
-                        # Add single download button for ZIP file
-                        st.download_button(
-                            label="Bilder herunterladen",
-                            data=zip_buffer.getvalue(),
-                            file_name="generated_images.zip",
-                            mime="application/zip",
-                            key=f"download_all_{time.time()}",  # Unique key using timestamp
-                            use_container_width=True
-                        )
-
-
-                        # Add generation time
-                        st.markdown(
-                            f'<p style="color: #757575; text-align: center;">Generierungszeit: {(time.time() - start_time):.2f} Sekunden</p>',
-                            unsafe_allow_html=True
-                        )
+                # Optional hedging against slow outliers, set in "Details einstellen"
+                hedging = None
+                if st.session_state.get("hedging_enabled", False):
+                    hedging = {
+                        "percentile": st.session_state.get("hedging_percentile", 90),
+                        "max_extra": st.session_state.get("hedging_max_extra", 1),
+                    }
+
+                # Generate images with the complete model_params. The batch
+                # ID in the URL lets any worker pick the batch up again.
+                batch_id = uuid.uuid4().hex
+                st.query_params["batch"] = batch_id
+                get_store().put_batch(batch_id, settings=current_settings(prompt, seed_preset, width, height, num_outputs))
+                # Others opening the same link while this runs watch it live,
+                # see flux_broadcast
+                single = st.session_state.get("poster_enabled", False) or st.session_state.get("sequence_enabled", False)
+                channel = get_hub().open(batch_id, 1 if single else num_outputs)
+                st.markdown(
+                    f'<p style="text-align: center;"><a href="?batch={batch_id}" target="_blank">👀 Link zum Zuschauen</a></p>',
+                    unsafe_allow_html=True
+                )
+
+                # Channel formats to export, chosen in "Details einstellen"
+                selected_formats = st.session_state.get(
+                    f"channel_formats_{seed_preset}", default_channel_formats(seed_preset))
+                channel_formats = [fmt for fmt in get_channel_formats() if fmt["name"] in selected_formats]
+
+                # Optionally render smaller and upscale locally
+                render_width, render_height = width, height
+                upscale = None
+                if st.session_state.get("upscale_enabled", False):
+                    render_width, render_height = render_size(
+                        width, height, st.session_state.get("upscale_factor", RENDER_FACTORS[0]))
+                    upscale = upscale_settings(width, height, render_width, render_height)
+                    if upscale is None:
+                        render_width, render_height = width, height
+
+                # Latency target: steps, algorithm and render size come from
+                # the ETA model instead of the preset
+                target = None
+                if st.session_state.get("target_enabled", False) and not st.session_state.get("poster_enabled", False) \
+                        and not st.session_state.get("sequence_enabled", False):
+                    target = plan_for_target(
+                        get_eta_model(), st.session_state.get("target_seconds", 15), width, height,
+                        num_outputs, get_router().in_flight())
+                    target["target"] = st.session_state.get("target_seconds", 15)
+                    model_params["scheduler"] = target["scheduler"]
+                    model_params["num_inference_steps"] = target["num_inference_steps"]
+                    render_width, render_height = target["render_width"], target["render_height"]
+                    upscale = upscale_settings(width, height, render_width, render_height)
+                    show_target_plan(target)
+
+                if st.session_state.get("poster_enabled", False):
+                    # Poster mode replaces the variants with one tiled image
+                    plan, results, canvas = generate_poster(
+                        prompt, st.session_state.get("poster_width", 3072),
+                        st.session_state.get("poster_height", 2048), model_params, hedging, batch_id)
+                    if results:
+                        with st.spinner('Kacheln werden zusammengesetzt...'):
+                            images, exports = finish_poster(batch_id, plan, results, canvas)
+                        if images:
+                            st.success("✨ Poster erfolgreich generiert!")
+                            show_results(images, exports, time.time() - start_time,
+                                         [{"poster": plan}], batch_id, channel=channel)
+                    else:
+                        canvas.close()
+                elif st.session_state.get("sequence_enabled", False):
+                    # Sequence mode replaces the variants with one animation
+                    ramp = st.session_state.get("sequence_ramp", "seed")
+                    spec = {
+                        "frames": st.session_state.get("sequence_frames", 8),
+                        "ramp": ramp,
+                        "range": list(st.session_state.get(f"sequence_range_{ramp}", RAMPS[ramp].get("default", ()))),
+                        "format": st.session_state.get("sequence_format", "APNG"),
+                        "fps": st.session_state.get("sequence_fps", 8),
+                    }
+                    images, exports, analyses = generate_sequence(
+                        prompt, width, height, model_params, spec, hedging, batch_id)
+                    if images:
+                        st.success("✨ Animation erfolgreich generiert!")
+                        show_results(images, exports, time.time() - start_time, analyses, batch_id,
+                                     channel=channel)
+                else:
+                    palette = brand_palette(seed_preset)
+                    get_store().put_batch(batch_id, channel_formats=channel_formats, upscale=upscale,
+                                          palette=palette)
+                    # Each variant is fetched as soon as it is ready and shown
+                    # in its slot as soon as it is downloaded
+                    slots = placeholder_slots(num_outputs)
+                    prefetch = Prefetcher(API_KEY, placeholder)
+                    try:
+                        on_finished = None
+                        if target is not None:
+                            on_finished = lambda seconds: record_target(batch_id, target, seconds)
+                        payloads, results = generate_images(prompt, render_width, render_height, num_outputs,
+                                                            model_params, hedging, batch_id, prefetch, slots,
+                                                            on_finished)
+
+                        if results:
+                            st.success("✨ Bilder erfolgreich generiert!")
+
+                            # Each image is held once as bytes and shared by the
+                            # preview and the ZIP, see flux_images
+                            images, exports, analyses = finish_batch(
+                                batch_id, payloads, results, upscale,
+                                regenerate_duplicates=st.session_state.get("regenerate_duplicates", False),
+                                palette=palette,
+                                regenerate_off_brand=st.session_state.get("regenerate_off_brand", False),
+                                prefetch=prefetch)
+                            show_results(images, exports, time.time() - start_time, analyses, batch_id, slots,
+                                         channel=channel, channel_formats=channel_formats)
+                    finally:
+                        prefetch.close()
+        except Exception as e:
+            st.error(f"An error occurred: {str(e)}")
+        finally:
+            # Viewers stop waiting even if nothing could be shown
+            if channel is not None and not channel.closed:
+                channel.close(error="Es konnten keine Bilder erstellt werden.")
+    elif "batch" in st.query_params:
+        try:
+            restore_batch(st.query_params["batch"])
         except Exception as e:
             st.error(f"An error occurred: {str(e)}")
 
     st.markdown("---")
 
+    with st.expander("Bild reproduzieren", expanded=False):
+        reproduce_panel()
+
+    with st.expander("Nachtlauf (Warteschlange)", expanded=False):
+        offpeak_panel(prompt, seed_preset, width, height, num_outputs)
+
     #st.markdown("### 🛠️ Fine-tune Model Like a Pro")
     with st.expander("Details einstellen", expanded=False):
-        # Add a container with custom styling
-        st.markdown("""
-            <style>
-            .advanced-settings {
-                color: #ffffff;  /* Bright white text on hover */
-                border-color: #9e9e9e;  /* Lighter border on hover */
-                background-color: rgba(158, 158, 158, 0.1);  /* Very subtle grey background */
-                text-shadow: 0 0 8px rgba(255, 255, 255, 0.3);  /* Subtle glow effect */
-            }
-            .parameter-title {
-                color: #424242;
-                font-size: 14px;
-                font-weight: 500;
-                margin-bottom: 8px;
-            }
-            .parameter-help {
-                color: #757575;
-                font-size: 12px;
-            }
-            </style>
-            """, unsafe_allow_html=True)
+
 
         # Update the parameters based on selected preset
         if seed_preset:
@@ -485,6 +1209,144 @@ def main():
             key="seed_input"  # Add unique key
         )
 
+        st.multiselect(
+            "Kanal-Formate exportieren",
+            options=[fmt["name"] for fmt in get_channel_formats()],
+            default=restored.get("channel_formats", default_channel_formats(seed_preset)) if same_preset else default_channel_formats(seed_preset),
+            help="Jedes Bild kann zusätzlich motivgerecht zugeschnitten und für diese Kanäle skaliert werden, ohne weitere API-Aufrufe. Die Formate werden erst beim Klick auf „Kanal-Formate herunterladen“ erstellt und liegen dort unter kanaele/.",
+            key=f"channel_formats_{seed_preset}"
+        )
+
+        st.checkbox(
+            "Klein rendern, lokal hochskalieren",
+            value=restored.get("upscale_enabled", False),
+            help="Die API rendert mit geringerer Auflösung, das Bild wird lokal (Lanczos) auf Breite × Höhe gebracht. Schneller und günstiger, das Original liegt mit im ZIP.",
+            key="upscale_enabled"
+        )
+        if st.session_state.get("upscale_enabled", False):
+            st.select_slider(
+                "Render-Auflösung",
+                options=RENDER_FACTORS,
+                value=restored.get("upscale_factor", RENDER_FACTORS[0]),
+                format_func=lambda factor: f"{int(factor * 100)} %",
+                key="upscale_factor"
+            )
+            st.checkbox("Nachschärfen", value=restored.get("upscale_sharpen", True), key="upscale_sharpen")
+
+        st.checkbox(
+            "Zielzeit statt fester Qualität",
+            value=restored.get("target_enabled", False),
+            help="Algorithmus, Detailgenauigkeit und Render-Auflösung werden anhand der bisherigen Laufzeiten so gewählt, dass die Bilder möglichst in der Zielzeit fertig sind, bei bestmöglicher Qualität. Kleinere Render-Auflösungen werden lokal hochskaliert.",
+            key="target_enabled"
+        )
+        if st.session_state.get("target_enabled", False):
+            st.slider(
+                "Ergebnisse in (Sekunden)",
+                min_value=5,
+                max_value=120,
+                value=restored.get("target_seconds", 15),
+                step=5,
+                key="target_seconds"
+            )
+
+        st.checkbox(
+            "Poster-Modus (gekachelt)",
+            value=restored.get("poster_enabled", False),
+            help="Für Druckformate über 1024 px: Das Poster wird in überlappende Kacheln mit gleichem Seed zerlegt, die parallel erstellt und an den Nähten weich überblendet werden. Ersetzt Breite, Höhe und Varianten.",
+            key="poster_enabled"
+        )
+        if st.session_state.get("poster_enabled", False):
+            poster_col1, poster_col2 = st.columns(2)
+            with poster_col1:
+                st.number_input("Poster-Breite", min_value=1024, max_value=8192, value=restored.get("poster_width", 3072),
+                                step=256, key="poster_width")
+            with poster_col2:
+                st.number_input("Poster-Höhe", min_value=1024, max_value=8192, value=restored.get("poster_height", 2048),
+                                step=256, key="poster_height")
+
+        st.checkbox(
+            "Animation (Bildfolge)",
+            value=restored.get("sequence_enabled", False),
+            help="Erstellt mehrere Frames mit wechselndem Seed oder einem Parameterverlauf und setzt sie zu einer Animation zusammen. Die Frames werden gleichzeitig angefragt und in Reihenfolge geschrieben, sobald sie fertig sind. Ersetzt die Varianten.",
+            key="sequence_enabled"
+        )
+        if st.session_state.get("sequence_enabled", False):
+            sequence_col1, sequence_col2 = st.columns(2)
+            with sequence_col1:
+                st.number_input("Frames", min_value=2, max_value=MAX_FRAMES, value=restored.get("sequence_frames", 8),
+                                key="sequence_frames")
+                st.selectbox("Format", options=list(SEQUENCE_FORMATS),
+                             index=list(SEQUENCE_FORMATS).index(restored.get("sequence_format", "APNG")),
+                             key="sequence_format")
+            with sequence_col2:
+                st.selectbox("Verlauf über", options=list(RAMPS),
+                             index=list(RAMPS).index(restored.get("sequence_ramp", "seed")),
+                             format_func=lambda ramp: RAMPS[ramp]["label"], key="sequence_ramp")
+                st.slider("Bilder pro Sekunde", min_value=2, max_value=24, value=restored.get("sequence_fps", 8),
+                          key="sequence_fps")
+            ramp = st.session_state.get("sequence_ramp", "seed")
+            if ramp != "seed":
+                st.slider(
+                    f"{RAMPS[ramp]['label']} von / bis",
+                    min_value=RAMPS[ramp]["min"],
+                    max_value=RAMPS[ramp]["max"],
+                    value=tuple(restored.get(f"sequence_range_{ramp}", RAMPS[ramp]["default"])),
+                    step=RAMPS[ramp]["step"],
+                    key=f"sequence_range_{ramp}"
+                )
+
+        st.checkbox(
+            "Spekulative Vorschau nach der Eingabe",
+            value=restored.get("speculation_enabled", False),
+            help="Sobald das Bildkonzept übernommen ist (Feld verlassen oder Strg+Enter) und kurz unverändert bleibt, wird im Hintergrund ein kleiner Entwurf erstellt und beim Klick sofort angezeigt. Wer direkt nach dem Tippen klickt, bekommt keinen Entwurf. Begrenzt pro Sitzung.",
+            key="speculation_enabled"
+        )
+
+        st.checkbox(
+            "Sehr ähnliche Varianten neu generieren",
+            value=restored.get("regenerate_duplicates", False),
+            help="Fast identische Varianten werden einmal mit neuem Seed ersetzt. Ohne diese Option werden sie nur zusammengefasst.",
+            key="regenerate_duplicates"
+        )
+
+        if brand_palette(seed_preset):
+            st.checkbox(
+                "Markenfremde Varianten neu generieren",
+                value=restored.get("regenerate_off_brand", False),
+                help="Jede Variante wird mit der Markenpalette dieses Modus verglichen. Weicht sie zu stark ab, wird sie einmal mit neuem Seed ersetzt. Ohne diese Option wird sie nur markiert.",
+                key="regenerate_off_brand"
+            )
+
+        st.checkbox(
+            "Hedging gegen langsame Varianten",
+            value=restored.get("hedging_enabled", False),
+            help="Hängt eine Variante länger als üblich, wird sie mit gleichem Seed doppelt angefragt. Das schnellere Ergebnis gewinnt.",
+            key="hedging_enabled"
+        )
+        if st.session_state.get("hedging_enabled", False):
+            st.slider(
+                "Hedging ab Perzentil",
+                min_value=50,
+                max_value=99,
+                value=restored.get("hedging_percentile", 90),
+                step=1,
+                help="Wartezeit-Schwelle aus den letzten Generierungen",
+                key="hedging_percentile"
+            )
+            st.number_input(
+                "Max. Zusatzaufträge pro Durchlauf",
+                min_value=1,
+                max_value=4,
+                value=restored.get("hedging_max_extra", 1),
+                key="hedging_max_extra"
+            )
+        st.checkbox(
+            "Bei Ausfall niedrigere Qualität zulassen",
+            value=restored.get("downgrade_enabled", False),
+            help="Ist kein Bilddienst der gewählten Qualität erreichbar, wird auf den besten verbliebenen ausgewichen, z. B. flux-dev statt flux-pro. Betroffene Bilder werden gemeldet. Ohne diese Option schlagen sie fehl.",
+            key="downgrade_enabled"
+        )
+
         # Update the model parameters when generating images
         # Update the model parameters
         model_params = {
@@ -494,100 +1356,22 @@ def main():
                 "scheduler": scheduler.split(" (")[0]
         }
 
-        # Add parameter descriptions directly without nested expander
-        # Add this markdown section after the seed_preset selectbox or in the expander section
-        st.markdown("""
-            <div style="color: #ffffff; background-color: #424242; padding: 15px; border-radius: 4px; border: 1px solid #616161;">
-            <h4 style="color: #ffffff; margin-bottom: 10px; font-weight: 500;">Modus - Voreinstellungen</h4>
-
-            <p style="color: #bdbdbd;">
-                <strong style="color: #ffffff;">01 | Folge strikt meinem Konzept in höchster Qualität</strong>
-                <ul style="margin-left: 20px; color: #bdbdbd;">
-                    <li>Maximale Kontrolle über visuelle Identität</li>
-                    <li>Präzise Einhaltung von Markenrichtlinien</li>
-                    <li>Ideal für: Kundenaufträge, Corporate Design, Markenkommunikation</li>
-                    <li>Technisch: Fester Seed (67890), hohe Markentreue</li>
-                </ul>
-            </p>
-
-            <p style="color: #bdbdbd;">
-                <strong style="color: #ffffff;">02 | Folge meinem Konzept mit kontrollierten Variationen</strong>
-                <ul style="margin-left: 20px; color: #bdbdbd;">
-                    <li>Konsistente Basis mit kontrollierten Variationen</li>
-                    <li>Reproduzierbare Ergebnisse für A/B-Tests</li>
-                    <li>Ideal für: Kampagnen-Rollout, Content-Serien, Social Media</li>
-                    <li>Technisch: Fester Seed (12345), mittlere Markentreue</li>
-                </ul>
-            </p>
-
-            <p style="color: #bdbdbd;">
-                <strong style="color: #ffffff;">03 | Findet kreative Ideen für mein Konzept</strong>
-                <ul style="margin-left: 20px; color: #bdbdbd;">
-                    <li>Maximale kreative Freiheit für neue Ideen</li>
-                    <li>Zufällige Ergebnisse für Inspiration</li>
-                    <li>Ideal für: Konzeptfindung, Moodboards, erste Entwürfe</li>
-                    <li>Technisch: Zufälliger Seed (-1), niedrige Markentreue</li>
-                </ul>
-            </p>
-
-            <p style="color: #bdbdbd; margin-top: 15px;">
-                <strong style="color: #ffffff;">Anwendung:</strong>
-                <ul style="margin-left: 20px; color: #bdbdbd;">
-                    <li>Kreativität vs. Kontrolle</li>
-                    <li>Variation vs. Konsistenz</li>
-                    <li>Experimentell vs. Markentreu</li>
-                </ul>
-                Wählen Sie die Voreinstellung entsprechend Ihres Projektziels. Die Parameter werden automatisch optimiert für die Balance zwischen diesen Faktoren.
-            </p>
-            </div>
-        """, unsafe_allow_html=True)
-
-        st.markdown("""
-            <div style="color: #ffffff; background-color: #424242; padding: 15px; border-radius: 4px; border: 1px solid #616161;">
-            <h4 style="color: #ffffff; margin-bottom: 10px; font-weight: 500;">Workflow-Optionen</h4>
-
-            <p style="color: #bdbdbd;">
-                <strong style="color: #ffffff;">Bachtung meiner Vorgaben:</strong>
-                Steuert die Balance zwischen kreativer Freiheit und Prompt-Treue. Höhere Werte erzeugen Bilder, die enger an Ihrer Beschreibung bleiben, können aber weniger kreativ wirken.
-            </p>
-
-            <p style="color: #bdbdbd;">
-                <strong style="color: #ffffff;">Algorithmus auswählen:</strong>
-                Verschiedene Algorithmen für unterschiedliche Anwendungsfälle:
-            </p>
-            <ul style="margin-left: 20px; color: #bdbdbd;">
-                <li><strong style="color: #ffffff;">Premium-Qualität:</strong> Beste Gesamtqualität für finale Präsentationen</li>
-                <li><strong style="color: #ffffff;">Standard-Produktion:</strong> Ausgewogenes Verhältnis zwischen Geschwindigkeit und Qualität</li>
-                <li><strong style="color: #ffffff;">Schnellvorschau:</strong> Schnelle Generierung für Konzeptphase</li>
-                <li><strong style="color: #ffffff;">Kreativ-Exploration:</strong> Maximale kreative Interpretation</li>
-            </ul>
-            </p>
-            <p style="color: #bdbdbd;">
-                <strong style="color: #ffffff;">Detailgenauigkeit:</strong>
-                Bestimmt die Feinheit der Ausarbeitung. Mehr Details bedeuten bessere Qualität, aber längere Generierungszeit:
-                <ul style="margin-left: 20px; color: #bdbdbd;">
-                    <li><strong style="color: #ffffff;">Entwurf (20):</strong> Schnelle Konzeptvisualisierung</li>
-                    <li><strong style="color: #ffffff;">Standard (30):</strong> Ausgewogene Produktionsqualität</li>
-                    <li><strong style="color: #ffffff;">Premium (50+):</strong> Maximale Detailtiefe</li>
-                </ul>
-            </p>
-
-            <p style="color: #bdbdbd;">
-                <strong style="color: #ffffff;">Workflow-Voreinstellungen:</strong>
-                Optimierte Einstellungskombinationen für verschiedene Anwendungsfälle:
-            </p>
-            <ul style="margin-left: 20px; color: #bdbdbd;">
-                <li><strong style="color: #ffffff;">Kreativ-Exploration:</strong> Maximale Freiheit für Ideenfindung und Brainstorming</li>
-                <li><strong style="color: #ffffff;">Kampagnen-Erstellung:</strong> Ideal für konsistente Variationen eines Konzepts</li>
-                <li><strong style="color: #ffffff;">Marken-Bilderwelt:</strong> Strikte Einhaltung von Markenrichtlinien</li>
-            </ul>
-            </p>
-            <p style="color: #bdbdbd;">
-                <strong style="color: #ffffff;">Ausschlusskriterien:</strong>
-                Definition unerwünschter Elemente zur Wahrung der Markensicherheit und CI-Konformität.
-            </p>
-            </div>
-        """, unsafe_allow_html=True)
+        # Help panels are only loaded and sent when asked for
+        if st.toggle("Hilfe anzeigen", value=False, key="show_help"):
+            st.markdown(load_static("help_presets.html"), unsafe_allow_html=True)
+            st.markdown(load_static("help_workflow.html"), unsafe_allow_html=True)
+
+    with st.expander("Metriken", expanded=False):
+        # Like the help panels: the getters start every pool and the
+        # snapshot is a kilobyte per rerun, so both wait for the toggle
+        if st.toggle("Metriken anzeigen", value=False, key="show_metrics"):
+            get_router()
+            get_key_pool()
+            get_latency_history()
+            get_eta_model()
+            get_pool()
+            get_hub()
+            st.json(flux_metrics.snapshot())
 
     st.markdown(
         """
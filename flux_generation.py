@@ -0,0 +1,489 @@
+import os
+import time
+
+import flux_eta
+import flux_metrics
+from flux_async import fetch_many_sync
+from flux_keys import KeyPool, key_id
+from flux_pngmeta import stamp
+from flux_resilience import (
+    CircuitOpenError, FatalError, FluxError, RateLimitedError, RetryPolicy, call, get_breaker,
+)
+from flux_routing import QUALITY_LEVELS, Router, quality_of
+from flux_store import fingerprint, open_store
+
+# Generation engine shared by the UI, flux_service and flux_daemon. It has
+# no Streamlit dependency, the caller passes callbacks to report progress.
+# The settings helpers and BatchRecorder below are the setup and store
+# bookkeeping all three entry points have in common.
+
+# Fraction of the predicted time to sleep before the first poll
+POLL_LEAD = 0.8
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+# With several keys a 429 is not retried on the same key, the submit moves
+# on to the next one instead
+KEY_POOL_POLICY = RetryPolicy(retry_rate_limited=False)
+
+# Final job states from the result endpoint
+MODERATED_STATUSES = ("Request Moderated", "Content Moderated")
+FAILED_STATUSES = ("Failed", "Error", "Task not found")
+
+# Whoever polls a batch refreshes its heartbeat this often; once it is
+# older than HEARTBEAT_TIMEOUT another process may take the batch over
+HEARTBEAT_INTERVAL = 2.0
+HEARTBEAT_TIMEOUT = 15.0
+
+
+def build_payloads(prompt, width, height, num_images, model_params):
+    payloads = []
+    for i in range(num_images):
+        # Create a copy of model_params for each iteration
+        current_params = model_params.copy()
+
+        # If seed is -1 or not set, generate a unique seed for each image
+        if 'seed' not in current_params or current_params['seed'] == -1:
+            current_params['seed'] = int(time.time() * 1000) + i
+        else:
+            # If seed is set, increment it for each image to ensure variation
+            current_params['seed'] = current_params['seed'] + i
+
+        payloads.append({
+            'prompt': prompt,
+            'width': width,
+            'height': height,
+            'num_outputs': 1,
+            **current_params
+        })
+    return payloads
+
+
+def submit(endpoint, api_key, payload, policy=DEFAULT_RETRY_POLICY):
+    response = call(
+        "POST",
+        endpoint["url"],
+        get_breaker(endpoint["name"]),
+        policy,
+        "submit",
+        headers={
+            'accept': 'application/json',
+            'x-key': api_key,
+            'Content-Type': 'application/json',
+        },
+        json=payload,
+    )
+
+    request_id = response.get("id")
+    if not request_id:
+        raise FluxError(f"no request id in response: {str(response)[:200]}")
+    return {
+        "id": request_id,
+        "polling_url": response.get("polling_url") or endpoint["result_url"],
+        "endpoint": endpoint,
+        "submitted_at": time.time(),
+    }
+
+
+def get_result(attempt, api_key, policy=DEFAULT_RETRY_POLICY):
+    return call(
+        "GET",
+        attempt["polling_url"],
+        get_breaker(attempt["endpoint"]["name"]),
+        policy,
+        "poll",
+        headers={
+            'accept': 'application/json',
+            'x-key': api_key,
+        },
+        params={
+            'id': attempt["id"],
+        },
+    )
+
+
+def _endpoint_available(endpoint):
+    return not get_breaker(endpoint["name"]).is_open()
+
+
+def _schedule(attempt, payload, eta_model, poll_interval, queue_depth):
+    attempt["features"] = flux_eta.features(
+        payload["width"], payload["height"],
+        payload.get("num_inference_steps", 50), payload.get("scheduler", ""),
+        queue_depth,
+    )
+    attempt["predicted"] = eta_model.predict(attempt["features"]) if eta_model else None
+    # Sleep until shortly before the predicted finish, then poll densely
+    if attempt["predicted"]:
+        attempt["next_poll"] = attempt["submitted_at"] + POLL_LEAD * attempt["predicted"]
+    else:
+        attempt["next_poll"] = attempt["submitted_at"] + poll_interval
+
+
+def _start_attempt(job, keys, router, quality, eta_model, poll_interval, on_submit=None,
+                   allow_downgrade=False, hedge=False):
+    # Route and submit one attempt for the job. Returns the attempt or None,
+    # in which case job["error"] says why. Without allow_downgrade the job
+    # fails rather than going to an endpoint below the requested quality.
+    # A hedge is counted in job["hedges"] instead of job["submits"], so it
+    # does not use up resubmits, and if it cannot be sent the job carries on
+    # with the attempt it has.
+    endpoint = router.choose(quality, available=_endpoint_available, allow_downgrade=allow_downgrade)
+    if endpoint is None:
+        if not hedge:
+            job["error"] = str(CircuitOpenError(f"Kein Bilddienst in der Qualität {quality} erreichbar"))
+            job["fatal"] = True
+        return None
+
+    # Queue depth is what was already in flight before this job was routed
+    queue_depth = max(0, router.in_flight() - 1)
+    payload = job["payload"]
+    job["hedges" if hedge else "submits"] += 1
+    policy = KEY_POOL_POLICY if len(keys) > 1 else DEFAULT_RETRY_POLICY
+    attempt = None
+    error = None
+    for _ in range(len(keys)):
+        key = keys.acquire()
+        if key is None:
+            break
+        try:
+            attempt = submit(endpoint, key, payload, policy)
+            break
+        except FluxError as e:
+            keys.release(key)
+            error = e
+            if not isinstance(e, RateLimitedError):
+                break
+            # This key sits out its cooldown, try the next one
+            keys.cooldown(key, e.retry_after)
+
+    if attempt is None:
+        if error is None:
+            router.abandon(endpoint["name"])
+            if not hedge:
+                job["error"] = "Alle API-Schlüssel sind ausgelastet"
+            return None
+        if isinstance(error, RateLimitedError):
+            # Every key is rate limited; the endpoint itself is fine, so this
+            # does not count against it in the routing stats
+            router.abandon(endpoint["name"])
+        else:
+            router.release(endpoint["name"], 0.0, ok=False)
+        if not hedge:
+            job["error"] = str(error)
+            job["fatal"] = isinstance(error, FatalError)
+        return None
+
+    # Polls for this attempt have to use the key that submitted it
+    attempt["key"] = key
+    # Set when allow_downgrade had to pick a lower tier; on_submit shows it
+    attempt["downgraded"] = quality_of(endpoint) < QUALITY_LEVELS.index(quality)
+    _schedule(attempt, payload, eta_model, poll_interval, queue_depth)
+    job["attempts"].append(attempt)
+    if on_submit:
+        on_submit(job["index"], attempt)
+    return attempt
+
+
+def _progress(jobs, now):
+    # Per-job progress is elapsed/predicted (capped below 1 until Ready),
+    # the batch ETA is the latest predicted finish of the unfinished jobs
+    fractions = []
+    eta = 0.0
+    for job in jobs:
+        if job["finished"]:
+            fractions.append(1.0)
+            continue
+        predicted = [a for a in job["attempts"] if a["predicted"]]
+        if not predicted:
+            # No prediction yet, so no batch ETA either
+            fractions.append(0.0)
+            eta = None
+            continue
+        attempt = min(predicted, key=lambda a: a["submitted_at"] + a["predicted"])
+        elapsed = now - attempt["submitted_at"]
+        fractions.append(min(0.99, elapsed / attempt["predicted"]))
+        if eta is not None:
+            eta = max(eta, attempt["submitted_at"] + attempt["predicted"] - now)
+    if not fractions:
+        return 1.0, 0.0
+    return sum(fractions) / len(fractions), (max(0.0, eta) if eta is not None else None)
+
+
+def run_batch(payloads, keys, router, quality, hedge_policy=None,
+              latency_history=None, eta_model=None, on_status=None, on_done=None,
+              on_progress=None, on_submit=None, resume=None, cancel=None,
+              poll_interval=0.5, max_submits=3, allow_downgrade=False):
+    # Submit every variant up front, then poll them together so one slow
+    # job does not hold back the others. Each job can have several attempts
+    # in flight when hedging kicks in; the first one to finish wins.
+    # Failed attempts are resubmitted with the same payload and seed (so the
+    # result is the same image) until max_submits is used up.
+    # resume maps job index to an attempt that was submitted earlier (e.g. by
+    # another worker): {"id", "polling_url", "endpoint", "submitted_at"}.
+    # cancel is an optional threading.Event; once set, outstanding attempts
+    # are abandoned and whatever finished so far is returned.
+    # allow_downgrade lets jobs go to a lower quality tier when no endpoint
+    # of the requested one is available; such attempts reach on_submit with
+    # attempt["downgraded"] set.
+    # keys is a flux_keys.KeyPool or a single API key.
+    if not isinstance(keys, KeyPool):
+        keys = KeyPool(keys)
+    resume = resume or {}
+    jobs = [{
+        "index": index,
+        "payload": payload,
+        "attempts": [],
+        "started_at": time.time(),
+        "submits": 0,
+        "hedges": 0,
+        "result": None,
+        "error": None,
+        "fatal": False,
+        "finished": False,
+    } for index, payload in enumerate(payloads)]
+
+    for job in jobs:
+        previous = resume.get(job["index"])
+        # Attempts stored before key pools existed were sent with the
+        # default key
+        key = keys.claim(previous.get("key_id") or key_id(keys.default)) if previous else None
+        endpoint = router.claim(previous["endpoint"]) if key else None
+        if key and endpoint is None:
+            keys.release(key)
+        if endpoint is not None:
+            attempt = dict(previous, endpoint=endpoint, key=key)
+            _schedule(attempt, job["payload"], eta_model, poll_interval, router.in_flight() - 1)
+            job["attempts"].append(attempt)
+            job["submits"] = 1
+            flux_metrics.incr("generation.resumed")
+        else:
+            _start_attempt(job, keys, router, quality, eta_model, poll_interval, on_submit, allow_downgrade)
+
+    hedges_fired = 0
+    pending = list(jobs)
+    done = 0
+    while pending:
+        if cancel is not None and cancel.is_set():
+            for job in pending:
+                for attempt in job["attempts"]:
+                    router.abandon(attempt["endpoint"]["name"])
+                    keys.release(attempt["key"])
+            flux_metrics.incr("generation.cancelled")
+            break
+
+        # Wake up for the next due poll, or at least every poll_interval to
+        # move the ETA progress bar
+        next_poll = min((a["next_poll"] for job in pending for a in job["attempts"]),
+                        default=time.time())
+        time.sleep(max(0.0, min(next_poll - time.time(), poll_interval)))
+        now = time.time()
+
+        for job in list(pending):
+            for attempt in list(job["attempts"]):
+                if attempt["next_poll"] > now:
+                    continue
+                attempt["next_poll"] = now + poll_interval
+                name = attempt["endpoint"]["name"]
+                try:
+                    result = get_result(attempt, attempt["key"])
+                except FluxError as e:
+                    # Retries are exhausted, give up on this attempt
+                    router.release(name, time.time() - attempt["submitted_at"], ok=False)
+                    keys.release(attempt["key"])
+                    job["attempts"].remove(attempt)
+                    job["error"] = str(e)
+                    continue
+                flux_metrics.incr("polling.requests")
+                status = result.get("status")
+                if on_status:
+                    on_status(job["index"], status)
+
+                latency = time.time() - attempt["submitted_at"]
+                sample = (result.get("result") or {}).get("sample") if status == "Ready" else None
+                if sample:
+                    router.release(name, latency, ok=True)
+                    keys.release(attempt["key"])
+                    if latency_history is not None:
+                        # What the job waited in total, from its first submit:
+                        # the hedge threshold is compared against the same
+                        # time, and the winner's own latency would leave out
+                        # the wait that made the hedge fire
+                        latency_history.add(time.time() - job["started_at"])
+                    if eta_model is not None:
+                        eta_model.observe(attempt["features"], latency)
+                    job["result"] = sample
+                    job["error"] = None
+                    # Abandon whichever attempt lost the race
+                    for other in job["attempts"]:
+                        if other is not attempt:
+                            router.abandon(other["endpoint"]["name"])
+                            keys.release(other["key"])
+                    if hedge_policy is not None and len(job["attempts"]) > 1:
+                        hedge_policy.finished(hedge_won=attempt.get("hedge", False))
+                    job["attempts"] = []
+                    break
+                elif status in MODERATED_STATUSES:
+                    # Resubmitting the same payload would be moderated again
+                    router.release(name, latency, ok=True)
+                    keys.release(attempt["key"])
+                    job["attempts"].remove(attempt)
+                    job["error"] = status
+                    job["fatal"] = True
+                elif status in FAILED_STATUSES or status == "Ready":
+                    # Ready without a result URL is treated like a failed
+                    # attempt and resubmitted
+                    router.release(name, latency, ok=False)
+                    keys.release(attempt["key"])
+                    job["attempts"].remove(attempt)
+                    job["error"] = status if status != "Ready" else "Ready ohne Ergebnis"
+
+            # Resubmit so the requested number of variants is still delivered
+            if (job["result"] is None and not job["attempts"] and not job["fatal"]
+                    and job["submits"] < max_submits):
+                flux_metrics.incr("generation.resubmits")
+                _start_attempt(job, keys, router, quality, eta_model, poll_interval, on_submit, allow_downgrade)
+
+            if job["result"] is not None or not job["attempts"]:
+                job["finished"] = True
+                pending.remove(job)
+                done += 1
+                if job["result"] is None:
+                    flux_metrics.incr("generation.failed")
+                if on_done:
+                    on_done(job["index"], job["result"], done, len(jobs), job["error"])
+                continue
+
+            # Hedge: duplicate the job with the same payload and seed once it
+            # has waited longer than recent history says it should
+            waited = time.time() - job["started_at"]
+            if (hedge_policy is not None and len(job["attempts"]) == 1
+                    and hedge_policy.should_hedge(waited, hedges_fired)):
+                hedge = _start_attempt(job, keys, router, quality, eta_model, poll_interval, hedge=True)
+                if hedge is None:
+                    continue
+                hedge["hedge"] = True
+                hedges_fired += 1
+                hedge_policy.fired()
+
+        if on_progress:
+            on_progress(*_progress(jobs, time.time()))
+
+    return [job["result"] for job in jobs if job["result"]]
+
+
+def load_settings(path=os.path.join(".streamlit", "secrets.toml")):
+    # The app's secrets for the processes outside Streamlit; environment
+    # variables of the same name override them
+    settings = {}
+    if os.path.exists(path):
+        import tomllib
+        with open(path, "rb") as f:
+            settings = tomllib.load(f)
+    for name in ("FLUX_API_KEY", "FLUX_STATE_DIR", "FLUX_STORE_URL"):
+        if os.environ.get(name):
+            settings[name] = os.environ[name]
+    if os.environ.get("FLUX_API_KEYS"):
+        settings["FLUX_API_KEYS"] = [k.strip() for k in os.environ["FLUX_API_KEYS"].split(",") if k.strip()]
+    return settings
+
+
+# The helpers below take the app's st.secrets or the dict from load_settings
+
+
+def state_dir(settings):
+    return settings.get("FLUX_STATE_DIR", ".flux_state")
+
+
+def api_keys(settings):
+    # FLUX_API_KEYS = ["...", "..."] spreads the jobs over a pool of keys;
+    # the first one is used for downloads
+    return list(settings.get("FLUX_API_KEYS", [])) or [settings["FLUX_API_KEY"]]
+
+
+def store_from(settings):
+    return open_store(settings.get("FLUX_STORE_URL", f"sqlite:///{state_dir(settings)}/flux.db"))
+
+
+def key_pool_from(settings, max_in_flight=None):
+    return KeyPool(
+        api_keys(settings),
+        rate=settings.get("FLUX_KEY_RATE", 2.0),
+        burst=settings.get("FLUX_KEY_BURST", 4),
+        max_in_flight=max_in_flight or settings.get("FLUX_KEY_MAX_IN_FLIGHT", 24),
+    )
+
+
+def router_from(settings):
+    # Endpoints can be configured as [[FLUX_ENDPOINTS]] tables
+    return Router([dict(ep) for ep in settings.get("FLUX_ENDPOINTS", [])])
+
+
+def eta_model_from(settings):
+    # Model parameters are persisted so predictions survive restarts
+    return flux_eta.EtaModel(os.path.join(state_dir(settings), "eta_model.json"))
+
+
+class BatchRecorder:
+    # run_batch callbacks that keep a batch's progress in the shared store:
+    # request IDs as soon as they are submitted, so another process can
+    # keep polling them, every finished job and a heartbeat while polling.
+    # indexes maps positions in the submitted payloads to variant numbers,
+    # they differ when only part of a batch is resumed. results collects
+    # {variant: url}.
+    def __init__(self, store, batch_id, indexes=None, results=None):
+        self.store = store
+        self.batch_id = batch_id
+        self.indexes = indexes
+        self.results = {} if results is None else results
+        self.finished = 0
+        self.last_heartbeat = 0.0
+
+    def variant(self, index):
+        return self.indexes[index] if self.indexes is not None else index
+
+    def on_submit(self, index, attempt):
+        self.store.put_job(
+            self.batch_id, self.variant(index),
+            id=attempt["id"],
+            polling_url=attempt["polling_url"],
+            endpoint=attempt["endpoint"]["name"],
+            key_id=key_id(attempt["key"]),
+            submitted_at=attempt["submitted_at"],
+            downgraded=attempt.get("downgraded", False),
+            status="Pending",
+        )
+
+    def on_done(self, index, image_url, done, total, error):
+        variant = self.variant(index)
+        self.store.put_job(self.batch_id, variant, status="Ready" if image_url else "Failed",
+                           result_url=image_url, error=error)
+        if image_url:
+            self.results[variant] = image_url
+        self.finished += 1
+        return variant
+
+    def heartbeat(self, *args):
+        # Usable as on_progress; tells other processes the batch is polled
+        if time.time() - self.last_heartbeat > HEARTBEAT_INTERVAL:
+            self.last_heartbeat = time.time()
+            self.store.put_batch(self.batch_id, heartbeat=self.last_heartbeat)
+
+
+def store_results(store, batch_id, payloads, results, api_key):
+    # Download {index: url}, stamp and store the images and finish the
+    # batch record; returns (blob keys, errors). Used by flux_service and
+    # flux_daemon, the app reviews its images first (see store_images).
+    indexes = sorted(results)
+    fetched = fetch_many_sync(api_key, [results[i] for i in indexes])
+    keys = []
+    errors = []
+    for index, image_data in zip(indexes, fetched):
+        if isinstance(image_data, Exception):
+            errors.append(f"download of image {index + 1} failed: {image_data}")
+            continue
+        key = f"{batch_id}/{index}"
+        store.put_blob(key, stamp(image_data, payloads[index]))
+        store.cache_set(fingerprint(payloads[index]), key)
+        keys.append(key)
+    store.put_batch(batch_id, status="complete" if keys else "failed", images=keys, exports=[])
+    return keys, errors
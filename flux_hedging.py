@@ -0,0 +1,67 @@
+import threading
+from collections import deque
+
+import flux_metrics
+
+
+class LatencyHistory:
+    # Rolling window of how long recent jobs took from their first submit
+    # to a result, hedges and resubmits included; shared by all sessions
+    def __init__(self, size=200):
+        self._lock = threading.Lock()
+        self._values = deque(maxlen=size)
+
+    def add(self, latency):
+        with self._lock:
+            self._values.append(latency)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._values)
+
+    def percentile(self, p):
+        with self._lock:
+            values = sorted(self._values)
+        if not values:
+            return None
+        # Nearest-rank percentile, good enough for a few hundred samples
+        rank = max(0, min(len(values) - 1, int(round(p / 100.0 * len(values))) - 1))
+        return values[rank]
+
+    def snapshot(self):
+        return {
+            "samples": len(self),
+            "p50_s": self.percentile(50),
+            "p90_s": self.percentile(90),
+            "p99_s": self.percentile(99),
+        }
+
+
+class HedgePolicy:
+    # Fire a duplicate request once a job has waited longer than the given
+    # percentile of recent latencies. max_extra_per_batch caps the extra spend.
+    def __init__(self, history, percentile=90, max_extra_per_batch=1,
+                 min_samples=10, min_delay=2.0):
+        self.history = history
+        self.percentile = percentile
+        self.max_extra_per_batch = max_extra_per_batch
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+
+    def threshold(self):
+        # No hedging until we have enough history to trust the percentile
+        if len(self.history) < self.min_samples:
+            return None
+        return max(self.min_delay, self.history.percentile(self.percentile))
+
+    def should_hedge(self, waited, hedges_in_batch):
+        if hedges_in_batch >= self.max_extra_per_batch:
+            return False
+        threshold = self.threshold()
+        return threshold is not None and waited > threshold
+
+    def fired(self):
+        flux_metrics.incr("hedging.fired")
+
+    def finished(self, hedge_won):
+        flux_metrics.incr("hedging.won" if hedge_won else "hedging.lost")
@@ -0,0 +1,91 @@
+import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Result path from HTTP response to ZIP. Every image is held exactly once as
+# an immutable bytes object: the same object is shown by st.image, written
+# into the ZIP and never wrapped in extra BytesIO/PIL copies.
+
+# Chunk size for writing into the ZIP, large enough to keep call overhead low
+ZIP_CHUNK = 1 << 20
+
+
+def fetch_image(url, api_key, timeout=60):
+    response = requests.get(
+        url,
+        headers={
+            'accept': 'application/json',
+            'x-key': api_key,
+        },
+        timeout=timeout,
+    )
+    if response.status_code != 200:
+        return None
+    # response.content is the single owned copy of the image
+    return response.content
+
+
+class Prefetcher:
+    # Downloads each result as soon as its URL is known, while the rest of
+    # the batch is still generating. transform(data) runs in the download
+    # thread as well (e.g. the placeholder hash).
+    def __init__(self, api_key, transform=None, workers=4):
+        self.api_key = api_key
+        self.transform = transform
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._futures = {}
+        self._reported = set()
+
+    def _fetch(self, url):
+        data = fetch_image(url, self.api_key)
+        extra = self.transform(data) if data is not None and self.transform else None
+        return data, extra
+
+    def add(self, index, url):
+        self._futures[index] = (url, self._executor.submit(self._fetch, url))
+
+    def ready(self):
+        # [(index, data, extra), ...] finished since the last call
+        finished = []
+        for index, (_, future) in list(self._futures.items()):
+            if index not in self._reported and future.done():
+                self._reported.add(index)
+                try:
+                    finished.append((index,) + future.result())
+                except Exception:
+                    finished.append((index, None, None))
+        return finished
+
+    def take(self, index, url):
+        # (data, extra) of a prefetched URL, waiting if it is still loading;
+        # (None, None) if it was not prefetched or failed
+        prefetched_url, future = self._futures.get(index, (None, None))
+        if future is None or prefetched_url != url:
+            return None, None
+        try:
+            return future.result()
+        except Exception:
+            return None, None
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def build_zip(images, name_pattern="generated_image_{}.png", extra=()):
+    # PNGs are already compressed, so ZIP_STORED saves the CPU time of
+    # deflate and the compressor's output copy. Data is written through
+    # memoryview slices, which never copy the source bytes.
+    # extra holds further (name, data) entries, e.g. the channel exports.
+    entries = [(name_pattern.format(idx + 1), data) for idx, data in enumerate(images)]
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_STORED) as zip_file:
+        for name, data in entries + list(extra):
+            view = memoryview(data)
+            with zip_file.open(name, 'w') as dest:
+                for start in range(0, len(view), ZIP_CHUNK):
+                    dest.write(view[start:start + ZIP_CHUNK])
+    # getvalue() hands over the internal buffer without copying as long as
+    # nothing else holds a view on it
+    return zip_buffer.getvalue()
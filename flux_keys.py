@@ -0,0 +1,145 @@
+import hashlib
+import threading
+import time
+
+import flux_metrics
+
+# Pool of API keys. Every submit takes a token from its key's bucket and
+# goes to the least-loaded key that is not cooling down after a 429. The
+# job's polls stay on the key that submitted it. With one key this is just
+# a rate limiter in front of it.
+
+# Submits per second and burst size per key, and the number of jobs BFL
+# lets one key have running at a time
+DEFAULT_RATE = 2.0
+DEFAULT_BURST = 4
+DEFAULT_MAX_IN_FLIGHT = 24
+# Cooldown after a 429 without Retry-After
+DEFAULT_COOLDOWN = 10.0
+
+
+def key_id(key):
+    # Stable, non-secret name for a key (store, metrics)
+    return hashlib.sha256(key.encode()).hexdigest()[:12]
+
+
+class KeyState:
+    def __init__(self, key, rate, burst, max_in_flight):
+        self.key = key
+        self.id = key_id(key)
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.tokens = float(burst)
+        self.refilled_at = time.time()
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+        self.submitted = 0
+        self.rate_limited = 0
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def usable(self, now):
+        return (now >= self.cooldown_until and self.tokens >= 1.0
+                and self.in_flight < self.max_in_flight)
+
+    def as_dict(self, now):
+        return {
+            "key": "…" + self.key[-4:],
+            "in_flight": self.in_flight,
+            "tokens": round(self.tokens, 2),
+            "cooldown_s": round(max(0.0, self.cooldown_until - now), 1),
+            "submitted": self.submitted,
+            "rate_limited": self.rate_limited,
+        }
+
+
+class KeyPool:
+    def __init__(self, keys, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        if isinstance(keys, str):
+            keys = [keys]
+        if not keys:
+            raise ValueError("KeyPool needs at least one API key")
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._keys = [KeyState(key, rate, burst, max_in_flight) for key in dict.fromkeys(keys)]
+        self._by_id = {state.id: state for state in self._keys}
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def default(self):
+        # For requests that are not tied to a job, e.g. downloads
+        return self._keys[0].key
+
+    def acquire(self, timeout=30.0):
+        # Least-loaded usable key, waiting for a token or the end of a
+        # cooldown if necessary. None if nothing frees up within timeout.
+        deadline = time.time() + timeout
+        with self._available:
+            while True:
+                now = time.time()
+                for state in self._keys:
+                    state.refill(now)
+                usable = [s for s in self._keys if s.usable(now)]
+                if usable:
+                    state = min(usable, key=lambda s: (s.in_flight, -s.tokens))
+                    state.tokens -= 1.0
+                    state.in_flight += 1
+                    state.submitted += 1
+                    flux_metrics.incr(f"keys.{state.id}.submitted")
+                    return state.key
+                if now >= deadline:
+                    flux_metrics.incr("keys.exhausted")
+                    return None
+                self._available.wait(min(deadline - now, self._next_change(now)))
+
+    def _next_change(self, now):
+        # Earliest moment a token refills or a cooldown ends
+        waits = []
+        for state in self._keys:
+            if state.in_flight >= state.max_in_flight:
+                continue
+            wait = max(0.0, state.cooldown_until - now)
+            if state.tokens < 1.0:
+                wait = max(wait, (1.0 - state.tokens) / state.rate)
+            waits.append(wait)
+        return max(0.01, min(waits, default=1.0))
+
+    def claim(self, identifier):
+        # Key for an attempt submitted earlier, by key id; counts it as in
+        # flight without taking a token
+        with self._lock:
+            state = self._by_id.get(identifier)
+            if state is None:
+                return None
+            state.in_flight += 1
+            return state.key
+
+    def release(self, key):
+        with self._available:
+            state = self._by_id.get(key_id(key))
+            if state is not None:
+                state.in_flight = max(0, state.in_flight - 1)
+            self._available.notify_all()
+
+    def cooldown(self, key, seconds=None):
+        # A 429 for this key: no new submits until the cooldown is over
+        with self._available:
+            state = self._by_id.get(key_id(key))
+            if state is None:
+                return
+            state.rate_limited += 1
+            state.cooldown_until = max(state.cooldown_until,
+                                       time.time() + (seconds or DEFAULT_COOLDOWN))
+            self._available.notify_all()
+        flux_metrics.incr(f"keys.{state.id}.rate_limited")
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            return {state.id: state.as_dict(now) for state in self._keys}
@@ -0,0 +1,39 @@
+import threading
+from collections import defaultdict
+
+# Process-wide metrics shared by all Streamlit sessions.
+# Counters only go up, gauges hold the latest value and providers are
+# callables that return a dict (e.g. per-endpoint stats) at snapshot time.
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_providers = {}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def register(name, provider):
+    with _lock:
+        _providers[name] = provider
+
+
+def snapshot():
+    with _lock:
+        data = {
+            "counters": dict(sorted(_counters.items())),
+            "gauges": dict(sorted(_gauges.items())),
+        }
+        providers = list(_providers.items())
+
+    # Call providers outside the lock, they may take their own locks
+    for name, provider in providers:
+        data[name] = provider()
+    return data
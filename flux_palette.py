@@ -0,0 +1,100 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from flux_workers import get_pool
+
+# Brand palette check: the dominant colours of a result (k-means in Lab on a
+# small copy) are compared with the preset's palette. The score is the
+# pixel-weighted mean ΔE from each dominant colour to its nearest palette
+# colour, so an image can use few brand colours as long as the rest is
+# close to them.
+
+SAMPLE_SIZE = 64
+CLUSTERS = 5
+ITERATIONS = 8
+# ΔE (CIE76) above which a variant counts as off-brand
+MAX_DISTANCE = 25.0
+# ΔE within which a pixel counts as a brand colour for the coverage figure
+COVERAGE_DISTANCE = 20.0
+
+
+def parse_palette(colors):
+    # ["#0A2540", "635BFF", ...] -> (n, 3) uint8
+    return np.array([[int(c.lstrip("#")[i:i + 2], 16) for i in (0, 2, 4)] for c in colors],
+                    dtype=np.uint8)
+
+
+def to_lab(rgb):
+    # sRGB (..., 3) uint8 -> CIELAB (D65), fully vectorised
+    c = rgb.astype(np.float32) / 255.0
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = c @ np.array([[0.4124, 0.2126, 0.0193],
+                        [0.3576, 0.7152, 0.1192],
+                        [0.1805, 0.0722, 0.9505]], dtype=np.float32)
+    xyz /= np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16.0 / 116.0)
+    return np.stack((116.0 * f[..., 1] - 16.0,
+                     500.0 * (f[..., 0] - f[..., 1]),
+                     200.0 * (f[..., 1] - f[..., 2])), axis=-1)
+
+
+def kmeans(points, k=CLUSTERS, iterations=ITERATIONS):
+    # Plain Lloyd iterations with a deterministic farthest-point start;
+    # returns centers and the share of points per center
+    centers = [points[0]]
+    for _ in range(1, k):
+        distances = np.min(((points[:, None, :] - np.array(centers)[None]) ** 2).sum(-1), axis=1)
+        centers.append(points[int(np.argmax(distances))])
+    centers = np.array(centers)
+    for _ in range(iterations):
+        labels = np.argmin(((points[:, None, :] - centers[None]) ** 2).sum(-1), axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, points)
+        filled = counts > 0
+        centers[filled] = sums[filled] / counts[filled, None]
+    return centers, counts / len(points)
+
+
+def check_palette(image_data, palette, max_distance=MAX_DISTANCE):
+    # Runs in a worker process. palette is a list of hex colours.
+    image = Image.open(io.BytesIO(image_data))
+    image.draft("RGB", (SAMPLE_SIZE, SAMPLE_SIZE))
+    small = image.convert("RGB").resize((SAMPLE_SIZE, SAMPLE_SIZE), Image.BILINEAR)
+    pixels = to_lab(np.asarray(small).reshape(-1, 3))
+    brand = to_lab(parse_palette(palette))
+
+    centers, weights = kmeans(pixels)
+    nearest = np.sqrt(((centers[:, None, :] - brand[None]) ** 2).sum(-1)).min(axis=1)
+    distance = float((nearest * weights).sum())
+    pixel_nearest = np.sqrt(((pixels[:, None, :] - brand[None]) ** 2).sum(-1)).min(axis=1)
+    order = [i for i in np.argsort(-weights) if weights[i] > 0]
+    dominant = np.clip(_to_rgb(centers[order]), 0, 255).astype(np.uint8)
+    return {
+        "palette_distance": round(distance, 1),
+        "palette_coverage": round(float((pixel_nearest <= COVERAGE_DISTANCE).mean()), 3),
+        "dominant_colors": list(dict.fromkeys("#%02X%02X%02X" % tuple(c) for c in dominant)),
+        "off_brand": distance > max_distance,
+    }
+
+
+def _to_rgb(lab):
+    # Inverse of to_lab, only used to report the dominant colours
+    fy = (lab[:, 0] + 16.0) / 116.0
+    f = np.stack((fy + lab[:, 1] / 500.0, fy, fy - lab[:, 2] / 200.0), axis=-1)
+    xyz = np.where(f ** 3 > 0.008856, f ** 3, (f - 16.0 / 116.0) / 7.787)
+    xyz *= np.array([0.95047, 1.0, 1.08883])
+    c = xyz @ np.linalg.inv(np.array([[0.4124, 0.2126, 0.0193],
+                                      [0.3576, 0.7152, 0.1192],
+                                      [0.1805, 0.0722, 0.9505]]))
+    c = np.clip(c, 0, 1)
+    c = np.where(c > 0.0031308, 1.055 * c ** (1 / 2.4) - 0.055, 12.92 * c)
+    return np.rint(c * 255)
+
+
+def submit_checks(images, palette, max_distance=MAX_DISTANCE):
+    # Start the checks in the worker pool and return the futures, so the
+    # caller can do other work (ranking) while they run
+    return [get_pool().submit(check_palette, data, palette, max_distance) for data in images]
@@ -0,0 +1,63 @@
+import json
+import struct
+import zlib
+
+# Generation parameters inside the PNG itself. The text chunks are spliced
+# in right after IHDR, so the image data is never decoded or re-encoded,
+# and reading them back only walks the chunk headers up to the first IDAT.
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Signature plus the IHDR chunk (4 length + 4 type + 13 data + 4 CRC)
+IHDR_END = 8 + 25
+PARAMS_KEYWORD = b"flux-params"
+
+# Everything needed to get the same image back, see flux_store.fingerprint
+PARAM_FIELDS = ("prompt", "width", "height", "seed", "guidance_scale", "num_inference_steps", "scheduler")
+
+
+def _chunk(kind, data):
+    return (struct.pack(">I", len(data)) + kind + data
+            + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+
+def _itxt(keyword, text):
+    # Uncompressed iTXt: keyword, NUL, flag 0, method 0, empty language and
+    # translated keyword, then UTF-8 text (prompts are often German)
+    return _chunk(b"iTXt", keyword + b"\x00\x00\x00\x00\x00" + text.encode("utf-8"))
+
+
+def stamp(png, payload, **extra):
+    # New bytes with the parameters of payload in front of the image data.
+    # Anything that is not a PNG is returned unchanged.
+    if png[:8] != PNG_SIGNATURE or png[12:16] != b"IHDR":
+        return png
+    params = {name: payload.get(name) for name in PARAM_FIELDS}
+    params.update(extra)
+    chunks = (_itxt(PARAMS_KEYWORD, json.dumps(params, ensure_ascii=False))
+              + _itxt(b"Description", str(payload.get("prompt", ""))))
+    # One join, the image data is copied once and not touched otherwise
+    view = memoryview(png)
+    return b"".join((view[:IHDR_END], chunks, view[IHDR_END:]))
+
+
+def read_params(png):
+    # Parameters written by stamp(), or None. Stops at the first IDAT.
+    if png[:8] != PNG_SIGNATURE:
+        return None
+    view = memoryview(png)
+    offset = 8
+    while offset + 8 <= len(png):
+        length, kind = struct.unpack_from(">I4s", png, offset)
+        if kind in (b"IDAT", b"IEND"):
+            return None
+        data = view[offset + 8:offset + 8 + length]
+        if kind == b"iTXt" and bytes(data[:len(PARAMS_KEYWORD) + 1]) == PARAMS_KEYWORD + b"\x00":
+            # Skip flags and the two empty NUL-terminated fields
+            rest = bytes(data[len(PARAMS_KEYWORD) + 3:])
+            text = rest.split(b"\x00", 2)[-1]
+            try:
+                return json.loads(text.decode("utf-8"))
+            except ValueError:
+                return None
+        offset += length + 12
+    return None
@@ -0,0 +1,52 @@
+import time
+
+# Presets shared by the Streamlit UI and the HTTP service
+
+PRESETS = {
+    "01 | Folge strickt meinem Konzept in höchster Qualität": {
+        "seed": 67890,
+        "guidance_scale": 12.0,
+        "num_inference_steps": 100,
+        "scheduler": "Premium-Qualität (DPM++ 2M Karras)",
+        "description": "Maximale Kontrolle über visuelle Identität",
+        "num_outputs": 1
+    },
+    "02 | Folge meinem Konzept mit kontrollierten Variationen": {
+        "seed": 12345,
+        "guidance_scale": 7.5,
+        "num_inference_steps": 50,
+        "scheduler": "Standard-Produktion (DPM++ 2M)",
+        "description": "Konsistente Basis mit kontrollierten Variationen",
+        "num_outputs": 4
+    },
+    "03 | Findet kreative Ideen für mein Konzept": {
+        "seed": -1,
+        "guidance_scale": 3.0,
+        "num_inference_steps": 30,
+        "scheduler": "Kreativ-Exploration (Euler A)",
+        "description": "Maximale kreative Freiheit für neue Ideen",
+        "num_outputs": 4
+    }
+}
+
+
+def find_preset(name):
+    # Full name or just its number ("02")
+    if name in PRESETS:
+        return name
+    for key in PRESETS:
+        if key.split(" | ")[0] == name:
+            return key
+    return None
+
+
+def model_params(name):
+    # Parameters for a generation run: a new seed each time unless the
+    # preset asks for random seeds anyway
+    preset = PRESETS[name]
+    return {
+        "seed": preset["seed"] if preset["seed"] == -1 else int(time.time()),
+        "guidance_scale": preset["guidance_scale"],
+        "num_inference_steps": preset["num_inference_steps"],
+        "scheduler": preset["scheduler"].split(" (")[0]
+    }
@@ -0,0 +1,197 @@
+import random
+import threading
+import time
+
+import requests
+
+import flux_metrics
+
+
+class FluxError(Exception):
+    pass
+
+
+class RetryableError(FluxError):
+    # 429, 5xx, connection problems and non-JSON bodies (HTML error pages).
+    # Rate limiting is not an outage, so it does not trip the breaker.
+    def __init__(self, message, retry_after=None, trips_breaker=True):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.trips_breaker = trips_breaker
+
+
+class RateLimitedError(RetryableError):
+    # 429 from the API, always for the key that sent the request
+    def __init__(self, retry_after=None):
+        super().__init__("rate limited (429)", retry_after, trips_breaker=False)
+
+
+class FatalError(FluxError):
+    # Other 4xx, retrying will not help
+    pass
+
+
+class CircuitOpenError(FluxError):
+    pass
+
+
+def _retry_after(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        # HTTP dates are allowed too, but BFL sends seconds
+        return None
+
+
+def classify(response):
+    # Turn a response into parsed JSON or a classified error
+    if response.status_code == 429:
+        raise RateLimitedError(_retry_after(response))
+    if response.status_code >= 500:
+        raise RetryableError(f"server error ({response.status_code})", _retry_after(response))
+    if response.status_code >= 400:
+        raise FatalError(f"request rejected ({response.status_code}): {response.text[:200]}")
+    try:
+        return response.json()
+    except ValueError:
+        raise RetryableError(f"invalid JSON response ({response.headers.get('Content-Type', 'unknown')})")
+
+
+class RetryPolicy:
+    # retry_rate_limited=False hands a 429 straight back to the caller, e.g.
+    # so the key pool can move the request to another key
+    def __init__(self, max_attempts=4, base_delay=0.5, max_delay=8.0, retry_rate_limited=True):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_rate_limited = retry_rate_limited
+
+    def delay(self, attempt, retry_after=None):
+        # Full jitter exponential backoff, but never earlier than Retry-After
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            return max(retry_after, backoff)
+        return backoff
+
+
+class CircuitBreaker:
+    # closed: calls pass. open: calls fail fast until reset_timeout has
+    # passed. half_open: one trial call decides whether to close again.
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_running = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def release_trial(self):
+        # The half-open trial ended without a verdict (e.g. an unexpected
+        # exception), let the next call try again
+        with self._lock:
+            self._trial_running = False
+
+    def is_open(self):
+        with self._lock:
+            return self.state == "open" and time.time() - self.opened_at < self.reset_timeout
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    flux_metrics.incr(f"breaker.{self.name}.opened")
+                self.state = "open"
+                self.opened_at = time.time()
+                self._trial_running = False
+
+    def as_dict(self):
+        with self._lock:
+            return {"state": self.state, "failures": self.failures}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def breaker_snapshot():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.as_dict() for b in breakers}
+
+
+flux_metrics.register("breakers", breaker_snapshot)
+
+
+def call(method, url, breaker, policy, kind, sleep=time.sleep, **kwargs):
+    # Send a request with retries and the endpoint's circuit breaker.
+    # kind ("submit", "poll", ...) is only used to label the metrics.
+    kwargs.setdefault("timeout", 30)
+    for attempt in range(policy.max_attempts):
+        if not breaker.allow():
+            flux_metrics.incr(f"{kind}.rejected_open_circuit")
+            raise CircuitOpenError(f"circuit for {breaker.name} is open")
+        try:
+            response = requests.request(method, url, **kwargs)
+            data = classify(response)
+        except FatalError:
+            flux_metrics.incr(f"{kind}.errors.fatal")
+            # The endpoint answered, so it is healthy
+            breaker.record_success()
+            raise
+        except (RetryableError, requests.RequestException) as e:
+            # Any transport problem (connection, timeout, a body cut off
+            # mid-read) is worth another attempt
+            retry_after = getattr(e, "retry_after", None)
+            flux_metrics.incr(f"{kind}.errors.{type(e).__name__}")
+            if getattr(e, "trips_breaker", True):
+                breaker.record_failure()
+            else:
+                # A 429 means the upstream is up, just busy
+                breaker.record_success()
+            if isinstance(e, RateLimitedError) and not policy.retry_rate_limited:
+                raise
+            if attempt + 1 >= policy.max_attempts:
+                if isinstance(e, RetryableError):
+                    raise
+                raise RetryableError(str(e))
+            flux_metrics.incr(f"{kind}.retries")
+            sleep(policy.delay(attempt, retry_after))
+            continue
+        except BaseException:
+            # Not a verdict on the endpoint, but a half-open trial must not
+            # stay claimed forever
+            breaker.release_trial()
+            raise
+        breaker.record_success()
+        return data
@@ -0,0 +1,164 @@
+import threading
+import time
+from collections import deque
+
+import flux_metrics
+
+# Quality tiers, ordered from fastest to best
+QUALITY_LEVELS = ["draft", "standard", "premium"]
+
+# Default endpoints if nothing is configured in the secrets.
+# "latency" is only the starting estimate, the router learns the real one.
+DEFAULT_ENDPOINTS = [
+    {
+        "name": "flux-pro-1.1",
+        "url": "https://api.bfl.ml/v1/flux-pro-1.1",
+        "result_url": "https://api.bfl.ml/v1/get_result",
+        "quality": "premium",
+        "latency": 12.0,
+        "parallelism": 4,
+    },
+    {
+        "name": "flux-dev",
+        "url": "https://api.bfl.ml/v1/flux-dev",
+        "result_url": "https://api.bfl.ml/v1/get_result",
+        "quality": "draft",
+        "latency": 8.0,
+        "parallelism": 4,
+    },
+]
+
+# Scheduler names from the UI mapped to the quality they ask for
+SCHEDULER_QUALITY = {
+    "Premium-Qualität": "premium",
+    "Standard-Produktion": "standard",
+    "Schnellvorschau": "draft",
+    "Kreativ-Exploration": "standard",
+}
+
+
+def quality_for_scheduler(scheduler):
+    return SCHEDULER_QUALITY.get(scheduler.split(" (")[0], "standard")
+
+
+def quality_of(endpoint):
+    # Position of the endpoint's tier in QUALITY_LEVELS
+    return QUALITY_LEVELS.index(endpoint.get("quality", "standard"))
+
+
+class EndpointStats:
+    def __init__(self, endpoint, alpha=0.2):
+        self.endpoint = endpoint
+        self.alpha = alpha
+        self.latency = float(endpoint.get("latency", 10.0))
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+
+    def expected_time(self):
+        # Time until a new job would finish: own latency, plus the queue
+        # in front of it, inflated by the chance that it has to be retried
+        parallelism = max(1, int(self.endpoint.get("parallelism", 4)))
+        queued = self.in_flight / parallelism
+        success = max(0.05, 1.0 - self.error_rate)
+        return self.latency * (1.0 + queued) / success
+
+    def record(self, latency, ok):
+        if ok:
+            self.latency += self.alpha * (latency - self.latency)
+            self.completed += 1
+        else:
+            self.failed += 1
+        self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+
+    def as_dict(self):
+        return {
+            "quality": self.endpoint.get("quality", "standard"),
+            "latency_s": round(self.latency, 2),
+            "error_rate": round(self.error_rate, 3),
+            "expected_s": round(self.expected_time(), 2),
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+class Router:
+    def __init__(self, endpoints=None, history=50):
+        endpoints = endpoints or DEFAULT_ENDPOINTS
+        self._lock = threading.Lock()
+        self._stats = {ep["name"]: EndpointStats(dict(ep)) for ep in endpoints}
+        self._decisions = deque(maxlen=history)
+
+    def choose(self, quality="standard", available=None, allow_downgrade=False):
+        # Pick the endpoint expected to finish first among those that are
+        # at least as good as the requested quality. available() can veto
+        # endpoints (e.g. open circuit breakers); None means nothing is left.
+        # A lower tier is only used with allow_downgrade, the caller has to
+        # tell the user (see quality_of).
+        wanted = QUALITY_LEVELS.index(quality)
+        with self._lock:
+            usable = [
+                s for s in self._stats.values()
+                if available is None or available(s.endpoint)
+            ]
+            if not usable:
+                flux_metrics.incr("routing.no_endpoint_available")
+                return None
+            candidates = [s for s in usable if quality_of(s.endpoint) >= wanted]
+            if not candidates:
+                if not allow_downgrade:
+                    flux_metrics.incr("routing.no_endpoint_for_quality")
+                    return None
+                # Fall back to the best tier that is left
+                best = max(quality_of(s.endpoint) for s in usable)
+                candidates = [s for s in usable if quality_of(s.endpoint) == best]
+                flux_metrics.incr("routing.downgraded")
+            chosen = min(candidates, key=lambda s: s.expected_time())
+            chosen.in_flight += 1
+            self._decisions.append({
+                "time": time.strftime("%H:%M:%S"),
+                "quality": quality,
+                "endpoint": chosen.endpoint["name"],
+                "expected_s": round(chosen.expected_time(), 2),
+            })
+        flux_metrics.incr(f"routing.{chosen.endpoint['name']}.chosen")
+        return chosen.endpoint
+
+    def claim(self, name):
+        # Track a job that was submitted elsewhere (e.g. by another worker)
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                return None
+            stats.in_flight += 1
+            return stats.endpoint
+
+    def release(self, name, latency, ok):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                return
+            stats.in_flight = max(0, stats.in_flight - 1)
+            stats.record(latency, ok)
+        flux_metrics.incr(f"routing.{name}.{'ok' if ok else 'error'}")
+
+    def abandon(self, name):
+        # Job was dropped (e.g. a hedge lost the race), no latency sample
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is not None:
+                stats.in_flight = max(0, stats.in_flight - 1)
+        flux_metrics.incr(f"routing.{name}.abandoned")
+
+    def in_flight(self):
+        with self._lock:
+            return sum(s.in_flight for s in self._stats.values())
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "endpoints": {name: s.as_dict() for name, s in self._stats.items()},
+                "decisions": list(self._decisions),
+            }
@@ -0,0 +1,237 @@
+import io
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+from PIL import Image
+
+# Sequence mode: N frames across a seed or parameter ramp, submitted
+# together like variants. Frames finish in any order; each one is spooled to
+# disk and the longest finished prefix is appended to the animation file
+# right away, so at most one decoded frame is in memory at a time.
+
+MAX_FRAMES = 24
+
+# Parameter ramps: the seed ramp gives every frame its own seed (a
+# flip-book of variations, the API has no latent interpolation); the
+# others keep one seed and move a single parameter from start to end
+RAMPS = {
+    "seed": {"label": "Seed (Variationen)"},
+    "guidance_scale": {"label": "Beachtung meiner Vorgaben", "min": 1.0, "max": 20.0, "default": (3.0, 12.0), "step": 0.5},
+    "num_inference_steps": {"label": "Detailgenauigkeit", "min": 20, "max": 100, "default": (20, 60), "step": 5},
+}
+
+# Format -> (file extension, mime type)
+FORMATS = {
+    "APNG": ("png", "image/apng"),
+    "GIF": ("gif", "image/gif"),
+    "WebP": ("webp", "image/webp"),
+}
+
+
+def ramp_payloads(prompt, width, height, model_params, frames, ramp="seed", start=None, end=None):
+    params = dict(model_params)
+    if params.get("seed", -1) == -1:
+        params["seed"] = int(time.time() * 1000) % 2147483647
+    payloads = []
+    for frame in range(frames):
+        current = dict(params)
+        if ramp == "seed":
+            current["seed"] = params["seed"] + frame
+        else:
+            value = start + (end - start) * frame / max(1, frames - 1)
+            current[ramp] = int(round(value)) if isinstance(start, int) else round(value, 2)
+        payloads.append({
+            'prompt': prompt,
+            'width': width,
+            'height': height,
+            'num_outputs': 1,
+            **current,
+        })
+    return payloads
+
+
+def _chunk(kind, data):
+    return (struct.pack(">I", len(data)) + kind + data
+            + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+
+def _idat_data(image):
+    # PIL's PNG encoder does the filtering and deflate; its IDAT payloads
+    # together are one zlib stream that APNG can reuse as frame data
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    png = buffer.getvalue()
+    parts = []
+    offset = 8
+    while offset < len(png):
+        length, kind = struct.unpack_from(">I4s", png, offset)
+        if kind == b"IDAT":
+            parts.append(png[offset + 8:offset + 8 + length])
+        offset += length + 12
+    return b"".join(parts)
+
+
+class ApngEncoder:
+    def __init__(self, path, width, height, frames, duration_ms, loop=0):
+        self.file = open(path, "wb")
+        self.width, self.height = width, height
+        self.duration_ms = duration_ms
+        self.loop = loop
+        self.sequence = 0
+        self.frames = 0
+        self.file.write(b"\x89PNG\r\n\x1a\n")
+        self.file.write(_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        # acTL is rewritten on close with the number of frames that arrived
+        self.actl_offset = self.file.tell()
+        self.file.write(_chunk(b"acTL", struct.pack(">II", frames, loop)))
+
+    def add(self, image):
+        self.file.write(_chunk(b"fcTL", struct.pack(
+            ">IIIIIHHBB", self.sequence, self.width, self.height, 0, 0, self.duration_ms, 1000, 0, 0)))
+        self.sequence += 1
+        data = _idat_data(image)
+        if self.frames == 0:
+            # The first frame doubles as the still image for plain viewers
+            self.file.write(_chunk(b"IDAT", data))
+        else:
+            self.file.write(_chunk(b"fdAT", struct.pack(">I", self.sequence) + data))
+            self.sequence += 1
+        self.frames += 1
+
+    def close(self):
+        self.file.write(_chunk(b"IEND", b""))
+        self.file.seek(self.actl_offset)
+        self.file.write(_chunk(b"acTL", struct.pack(">II", self.frames, self.loop)))
+        self.file.close()
+
+
+class GifEncoder:
+    # Each frame is quantized and LZW-encoded by PIL as a one-frame GIF; its
+    # image block is copied into the animation with its palette as a local
+    # colour table, so frames never wait for each other
+    def __init__(self, path, width, height, frames, duration_ms, loop=0):
+        self.file = open(path, "wb")
+        self.duration_ms = duration_ms
+        self.frames = 0
+        self.file.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0, 0, 0))
+        self.file.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", loop) + b"\x00")
+
+    def add(self, image):
+        buffer = io.BytesIO()
+        image.quantize(256).save(buffer, "GIF")
+        gif = buffer.getvalue()
+        packed = gif[10]
+        offset = 13
+        table = b""
+        if packed & 0x80:
+            table = gif[offset:offset + 3 * (2 << (packed & 7))]
+            offset += len(table)
+        # Skip PIL's own extensions up to the image descriptor
+        while gif[offset] == 0x21:
+            offset += 2
+            while gif[offset]:
+                offset += gif[offset] + 1
+            offset += 1
+        descriptor = bytearray(gif[offset:offset + 10])
+        if table and not descriptor[9] & 0x80:
+            descriptor[9] |= 0x80 | (packed & 7)
+        else:
+            table = b""
+        # Graphic control extension with the frame delay (1/100 s)
+        self.file.write(b"\x21\xf9\x04\x00" + struct.pack("<H", max(1, self.duration_ms // 10)) + b"\x00\x00")
+        # Descriptor, table and image data, without the one-frame trailer
+        self.file.write(bytes(descriptor) + table + gif[offset + 10:-1])
+        self.frames += 1
+
+    def close(self):
+        self.file.write(b";")
+        self.file.close()
+
+
+class WebpEncoder:
+    # libwebp's animation encoder needs every frame in one call, so WebP is
+    # assembled from the spool at the end; the frames stay on disk until then
+    def __init__(self, path, width, height, frames, duration_ms, loop=0):
+        self.path = path
+        self.duration_ms = duration_ms
+        self.loop = loop
+        self.spooled = []
+        self.frames = 0
+
+    def add(self, image):
+        spooled = f"{self.path}.{self.frames}.png"
+        image.save(spooled, "PNG", compress_level=1)
+        self.spooled.append(spooled)
+        self.frames += 1
+
+    def close(self):
+        if not self.spooled:
+            return
+        frames = [Image.open(path) for path in self.spooled]
+        try:
+            frames[0].save(self.path, "WEBP", save_all=True, append_images=frames[1:],
+                           duration=self.duration_ms, loop=self.loop, quality=85)
+        finally:
+            for frame, path in zip(frames, self.spooled):
+                frame.close()
+                os.remove(path)
+
+
+ENCODERS = {"APNG": ApngEncoder, "GIF": GifEncoder, "WebP": WebpEncoder}
+
+
+class SequenceWriter:
+    # add() may be called from several download threads and in any order.
+    # data None marks a frame that failed; it is left out of the animation.
+    def __init__(self, path, fmt, frames, width, height, duration_ms=125, loop=0):
+        self.path = path
+        self.frames = frames
+        self.width, self.height = width, height
+        self.spool = tempfile.mkdtemp(prefix="flux-sequence-")
+        self.missing = set()
+        self.next = 0
+        self.lock = threading.Lock()
+        self.encoder = ENCODERS[fmt](path, width, height, frames, duration_ms, loop)
+
+    def _spooled(self, index):
+        return os.path.join(self.spool, f"{index}.img")
+
+    def add(self, index, data):
+        with self.lock:
+            if data is None:
+                self.missing.add(index)
+            else:
+                with open(self._spooled(index), "wb") as f:
+                    f.write(data)
+            # Append the finished prefix
+            while self.next < self.frames:
+                if self.next in self.missing:
+                    self.next += 1
+                    continue
+                spooled = self._spooled(self.next)
+                if not os.path.exists(spooled):
+                    break
+                with Image.open(spooled) as image:
+                    frame = image.convert("RGB")
+                if frame.size != (self.width, self.height):
+                    frame = frame.resize((self.width, self.height), Image.LANCZOS)
+                self.encoder.add(frame)
+                os.remove(spooled)
+                self.next += 1
+
+    @property
+    def encoded(self):
+        return self.encoder.frames
+
+    def close(self):
+        # Number of frames in the animation. Frames still spooled (their
+        # predecessors never arrived) are dropped.
+        with self.lock:
+            self.encoder.close()
+            shutil.rmtree(self.spool, ignore_errors=True)
+            return self.encoder.frames
@@ -0,0 +1,369 @@
+import argparse
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import flux_metrics
+from flux_generation import (
+    BatchRecorder, build_payloads, eta_model_from, key_pool_from, load_settings, router_from, run_batch,
+    store_from, store_results,
+)
+from flux_hedging import LatencyHistory
+from flux_presets import PRESETS, find_preset, model_params
+from flux_routing import Router, quality_for_scheduler
+
+# Headless JSON service on the same generation path, presets and store as
+# the Streamlit app, so a batch made here also opens in the UI via
+# ?batch=<id>. Only the standard library is needed on top of the app.
+#
+#   POST /generate                {"prompt", "preset", "width", "height",
+#                                  "num_images", "seed"} -> 202 {"id", ...}
+#   GET  /jobs/<id>               status; ?wait=30&version=N long-polls until
+#                                 it changes, Accept: text/event-stream
+#                                 streams every change as an SSE event
+#   GET  /jobs/<id>/images/<n>    image bytes, n starts at 1
+#   GET  /metrics                 same snapshot as the "Metriken" expander
+#
+#   python flux_service.py --port 8600 --workers 4 --queue-size 32
+#
+# Settings come from .streamlit/secrets.toml like in the app, environment
+# variables of the same name override them (FLUX_API_KEYS comma-separated),
+# see flux_generation.load_settings.
+
+IMAGE_CHUNK = 64 * 1024
+MAX_WAIT = 60.0
+FINAL_STATUSES = ("complete", "failed")
+# Finished jobs stay in memory this long; after that they are answered from
+# the store like any other batch
+JOB_TTL = 600.0
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    # In-memory view of a request; every change bumps version and wakes
+    # long-polls and event streams
+    def __init__(self, job_id, total):
+        self.id = job_id
+        self.status = "queued"
+        self.done = 0
+        self.total = total
+        self.images = []
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.version = 0
+        self._changed = threading.Condition()
+
+    def update(self, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            if self.status in FINAL_STATUSES and self.finished is None:
+                self.finished = time.time()
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait(self, version, timeout):
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self.version != version or self.status in FINAL_STATUSES, timeout)
+
+    def as_dict(self):
+        with self._changed:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "done": self.done,
+                "total": self.total,
+                "images": len(self.images),
+                "error": self.error,
+                "version": self.version,
+            }
+
+
+class Service:
+    def __init__(self, keys, store, router=None, eta_model=None, workers=4, queue_size=32, job_ttl=JOB_TTL):
+        self.keys = keys
+        self.store = store
+        self.router = router or Router()
+        self.eta_model = eta_model
+        self.latency_history = LatencyHistory()
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.job_ttl = job_ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+        flux_metrics.register("routing", self.router.snapshot)
+        flux_metrics.register("api_keys", self.keys.snapshot)
+        flux_metrics.register("latency", self.latency_history.snapshot)
+
+    def start(self):
+        for n in range(self.workers):
+            threading.Thread(target=self._work, name=f"flux-worker-{n}", daemon=True).start()
+
+    def submit(self, request):
+        # Validate, build the payloads and queue them; raises ValueError for
+        # bad requests and QueueFull when the backlog is at its limit
+        prompt = str(request.get("prompt") or "").strip()
+        if not prompt:
+            raise ValueError("prompt is required")
+        preset = find_preset(str(request.get("preset", "02")))
+        if preset is None:
+            raise ValueError(f"unknown preset, use one of: {', '.join(k.split(' | ')[0] for k in PRESETS)}")
+        width = _int_field(request, "width", 1024, 128, 1024)
+        height = _int_field(request, "height", 768, 128, 1024)
+        num_images = _int_field(request, "num_images", PRESETS[preset]["num_outputs"], 1, 4)
+        params = model_params(preset)
+        if "seed" in request:
+            params["seed"] = _int_field(request, "seed", -1, -1, 2147483647)
+        payloads = build_payloads(prompt, width, height, num_images, params)
+
+        job = Job(uuid.uuid4().hex, len(payloads))
+        try:
+            self._queue.put_nowait((job, payloads))
+        except queue.Full:
+            flux_metrics.incr("service.rejected")
+            raise QueueFull()
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        flux_metrics.incr("service.accepted")
+        flux_metrics.set_gauge("service.queue_depth", self._queue.qsize())
+        return job
+
+    def job(self, job_id):
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished is not None and now - job.finished > self.job_ttl:
+                del self._jobs[job_id]
+
+    def stored_job(self, job_id):
+        # Batches this process does not know (UI batches, earlier runs)
+        batch = self.store.get_batch(job_id)
+        if batch is None:
+            return None
+        jobs = batch.get("jobs", {})
+        return {
+            "id": job_id,
+            "status": batch.get("status"),
+            "done": sum(1 for j in jobs.values() if j.get("status") in ("Ready", "Failed")),
+            "total": len(batch.get("payloads", [])),
+            "images": len(batch.get("images", [])),
+            "error": None,
+            "version": None,
+        }
+
+    def image_key(self, job_id, n):
+        job = self.job(job_id)
+        keys = job.images if job is not None else (self.store.get_batch(job_id) or {}).get("images", [])
+        return keys[n - 1] if 1 <= n <= len(keys) else None
+
+    def _work(self):
+        while True:
+            job, payloads = self._queue.get()
+            flux_metrics.set_gauge("service.queue_depth", self._queue.qsize())
+            started = time.time()
+            try:
+                self._run(job, payloads)
+                flux_metrics.incr("service.completed")
+            except Exception as e:
+                job.update(status="failed", error=str(e))
+                self.store.put_batch(job.id, status="failed")
+                flux_metrics.incr("service.failed")
+            finally:
+                flux_metrics.set_gauge("service.last_job_s", round(time.time() - started, 2))
+                self._queue.task_done()
+
+    def _run(self, job, payloads):
+        quality = quality_for_scheduler(payloads[0].get("scheduler", ""))
+        self.store.put_batch(job.id, status="running", payloads=payloads, quality=quality,
+                             heartbeat=time.time(), source="service")
+        job.update(status="running")
+        recorder = BatchRecorder(self.store, job.id)
+        errors = []
+
+        def on_done(index, image_url, done, total, error):
+            recorder.on_done(index, image_url, done, total, error)
+            if image_url is None:
+                errors.append(f"image {index + 1}: {error}")
+            job.update(done=done)
+
+        run_batch(
+            payloads,
+            self.keys,
+            self.router,
+            quality,
+            latency_history=self.latency_history,
+            eta_model=self.eta_model,
+            on_done=on_done,
+            # The heartbeat keeps the UI from resuming a batch polled here
+            on_progress=recorder.heartbeat,
+            on_submit=recorder.on_submit,
+        )
+
+        keys, download_errors = store_results(self.store, job.id, payloads, recorder.results, self.keys.default)
+        errors.extend(download_errors)
+        job.update(status="complete" if keys else "failed", images=keys, error="; ".join(errors) or None)
+
+
+def _int_field(request, name, default, low, high):
+    try:
+        value = int(request.get(name, default))
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+    if not low <= value <= high:
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return value
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/generate":
+            return self._json(404, {"error": "not found"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("expected a JSON object")
+            job = self.service.submit(request)
+        except QueueFull:
+            return self._json(503, {"error": "queue is full, try again later"}, {"Retry-After": "5"})
+        except ValueError as e:
+            return self._json(400, {"error": str(e)})
+        self._json(202, dict(job.as_dict(), status_url=f"/jobs/{job.id}"),
+                   {"Location": f"/jobs/{job.id}"})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/metrics":
+            return self._json(200, flux_metrics.snapshot())
+        match = re.fullmatch(r"/jobs/([0-9a-f]+)/images/(\d+)", url.path)
+        if match:
+            return self._image(match.group(1), int(match.group(2)))
+        match = re.fullmatch(r"/jobs/([0-9a-f]+)", url.path)
+        if not match:
+            return self._json(404, {"error": "not found"})
+
+        job = self.service.job(match.group(1))
+        if job is None:
+            stored = self.service.stored_job(match.group(1))
+            if stored is None:
+                return self._json(404, {"error": "unknown job"})
+            return self._json(200, stored)
+        if "text/event-stream" in self.headers.get("Accept", ""):
+            return self._events(job)
+        if "wait" in query:
+            try:
+                version = int(query.get("version", [job.version])[0])
+                wait = float(query["wait"][0])
+            except ValueError:
+                return self._json(400, {"error": "wait and version must be numbers"})
+            if not wait >= 0:
+                return self._json(400, {"error": "wait must be a non-negative number"})
+            job.wait(version, min(MAX_WAIT, wait))
+        self._json(200, job.as_dict())
+
+    def _events(self, job):
+        # One SSE event per change until the job is finished
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        version = None
+        while True:
+            state = job.as_dict()
+            if state["version"] != version:
+                version = state["version"]
+                self.wfile.write(f"event: status\ndata: {json.dumps(state)}\n\n".encode())
+                self.wfile.flush()
+            if state["status"] in FINAL_STATUSES:
+                return
+            job.wait(version, MAX_WAIT)
+
+    def _image(self, job_id, n):
+        key = self.service.image_key(job_id, n)
+        data = self.service.store.get_blob(key) if key else None
+        if data is None:
+            return self._json(404, {"error": "no such image"})
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+        self.end_headers()
+        view = memoryview(data)
+        for start in range(0, len(view), IMAGE_CHUNK):
+            self.wfile.write(view[start:start + IMAGE_CHUNK])
+
+    def _json(self, code, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(settings, host="127.0.0.1", port=8600, workers=4, queue_size=32):
+    eta_model = eta_model_from(settings)
+    flux_metrics.register("eta_model", eta_model.snapshot)
+    service = Service(
+        key_pool_from(settings),
+        store_from(settings),
+        router_from(settings),
+        eta_model,
+        workers=workers,
+        queue_size=queue_size,
+    )
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.service = service
+    service.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless Flux generation service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--workers", type=int, default=4, help="batches generated at the same time")
+    parser.add_argument("--queue-size", type=int, default=32, help="batches waiting before 503")
+    parser.add_argument("--secrets", default=os.path.join(".streamlit", "secrets.toml"))
+    args = parser.parse_args()
+
+    server = make_server(load_settings(args.secrets), args.host, args.port, args.workers, args.queue_size)
+    print(f"Flux service on http://{args.host}:{args.port} ({args.workers} workers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
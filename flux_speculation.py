@@ -0,0 +1,118 @@
+import threading
+import time
+
+import flux_metrics
+
+# Speculative drafts: once the prompt has been stable for a debounce interval,
+# a single low-res draft is started in the background. If the prompt changes
+# the draft is abandoned; when the user clicks generate for the same prompt
+# and preset, the draft is shown right away. Streamlit only sends a text
+# area's value when it loses focus or on Ctrl+Enter, so "stable" counts from
+# then, not from the last keystroke.
+
+_lock = threading.Lock()
+_stats = {"started": 0, "hits": 0, "misses": 0, "wasted": 0}
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+    flux_metrics.incr(f"speculation.{name}")
+
+
+def stats_snapshot():
+    with _lock:
+        data = dict(_stats)
+    data["hit_rate"] = round(data["hits"] / data["started"], 3) if data["started"] else None
+    return data
+
+
+flux_metrics.register("speculation", stats_snapshot)
+
+
+class Draft:
+    def __init__(self, key):
+        self.key = key
+        self.cancel = threading.Event()
+        self.done = threading.Event()
+        self.result = None
+        self.claimed = False
+
+
+class Speculator:
+    # One per session. start_fn(key, cancel_event) runs in a thread and
+    # returns the draft image bytes (or None).
+    def __init__(self, start_fn, debounce=1.5, budget=5):
+        self.start_fn = start_fn
+        self.debounce = debounce
+        self.budget = budget
+        self.used = 0
+        self.key = None
+        self.changed_at = 0.0
+        self.draft = None
+        # Input the real request was already made for
+        self.claimed_key = None
+
+    def observe(self, key, now=None):
+        now = now or time.time()
+        if key == self.key:
+            return
+        self.key = key
+        self.changed_at = now
+        self._drop_draft()
+
+    def tick(self, now=None):
+        # Start a draft once the prompt has settled and budget is left
+        now = now or time.time()
+        if not self.key or not self.key[0].strip():
+            return
+        if self.draft is not None and self.draft.key == self.key:
+            return
+        if self.key == self.claimed_key:
+            # Generated already (typically prompt and click arrived in the
+            # same rerun), a draft would come too late
+            return
+        if now - self.changed_at < self.debounce or self.used >= self.budget:
+            return
+        self.used += 1
+        draft = Draft(self.key)
+        self.draft = draft
+        _count("started")
+
+        def run():
+            try:
+                draft.result = self.start_fn(draft.key, draft.cancel)
+            finally:
+                draft.done.set()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def claim(self, key, timeout=0.0):
+        # Draft for exactly this key, or None. Waits up to timeout seconds
+        # for a draft that is still running. On a miss the real request is
+        # made anyway, so any other draft (for another key, or still
+        # running) is cancelled and counted as wasted.
+        self.claimed_key = key
+        draft = self.draft
+        if draft is not None and draft.key == key:
+            draft.done.wait(timeout)
+            if draft.done.is_set() and draft.result is not None:
+                if not draft.claimed:
+                    draft.claimed = True
+                    _count("hits")
+                return draft.result
+        _count("misses")
+        self._drop_draft()
+        return None
+
+    def status(self):
+        if self.draft is None:
+            return None
+        return "ready" if self.draft.done.is_set() else "running"
+
+    def _drop_draft(self):
+        draft = self.draft
+        self.draft = None
+        if draft is not None and not draft.claimed:
+            draft.cancel.set()
+            _count("wasted")
@@ -0,0 +1,405 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from urllib.parse import urlparse
+
+# Shared store for generation state, so any app worker can pick up polling,
+# rendering and downloads of a batch. Batches and jobs are small JSON
+# records, image bytes are blobs and the cache maps request fingerprints to
+# blob keys. Named queues are small ordered sets of IDs (e.g. the off-peak
+# runs of flux_daemon). Two backends with the same methods:
+#   sqlite:///path/to/flux.db   (default, put it on a shared volume)
+#   redis://host:6379/0         (any Redis-compatible server)
+#   memory://                   (in-process Redis stand-in, single worker)
+# Merging into a record is atomic against the other processes sharing the
+# store (app workers, flux_service, flux_daemon). prune() drops batches that
+# have not been touched for a while together with their jobs and blobs.
+
+
+def open_store(url):
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        # sqlite:///relative/path or sqlite:////absolute/path
+        return SQLiteStore(url[len("sqlite:///"):])
+    if parsed.scheme in ("redis", "rediss"):
+        import redis
+        return RedisStore(redis.Redis.from_url(url))
+    if parsed.scheme == "memory":
+        return RedisStore(LocalRedis())
+    raise ValueError(f"unsupported store url: {url}")
+
+
+class SQLiteStore:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS batches (
+                    batch_id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS jobs (
+                    batch_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (batch_id, idx)
+                );
+                CREATE TABLE IF NOT EXISTS blobs (
+                    key TEXT PRIMARY KEY,
+                    data BLOB NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires REAL
+                );
+                CREATE TABLE IF NOT EXISTS queues (
+                    name TEXT NOT NULL,
+                    item TEXT NOT NULL,
+                    added REAL NOT NULL,
+                    PRIMARY KEY (name, item)
+                );
+            """)
+
+    def _conn(self):
+        # One connection per thread; WAL lets several worker processes read
+        # while one writes
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        # Takes the write lock before the first read, so a read-modify-write
+        # cannot interleave with another process doing the same
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    def put_batch(self, batch_id, **fields):
+        # Merge fields into the batch record
+        with self._write() as conn:
+            row = conn.execute("SELECT data FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+            data = json.loads(row[0]) if row else {"batch_id": batch_id}
+            data.update(fields)
+            conn.execute(
+                "INSERT OR REPLACE INTO batches (batch_id, data, updated) VALUES (?, ?, ?)",
+                (batch_id, json.dumps(data), time.time()),
+            )
+
+    def get_batch(self, batch_id):
+        conn = self._conn()
+        row = conn.execute("SELECT data, updated FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+        if row is None:
+            return None
+        batch = json.loads(row[0])
+        batch["updated"] = row[1]
+        batch["jobs"] = {
+            idx: json.loads(data)
+            for idx, data in conn.execute(
+                "SELECT idx, data FROM jobs WHERE batch_id = ? ORDER BY idx", (batch_id,))
+        }
+        return batch
+
+    def put_job(self, batch_id, idx, **fields):
+        with self._write() as conn:
+            row = conn.execute(
+                "SELECT data FROM jobs WHERE batch_id = ? AND idx = ?", (batch_id, idx)).fetchone()
+            data = json.loads(row[0]) if row else {}
+            data.update(fields)
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (batch_id, idx, data) VALUES (?, ?, ?)",
+                (batch_id, idx, json.dumps(data)),
+            )
+            conn.execute("UPDATE batches SET updated = ? WHERE batch_id = ?", (time.time(), batch_id))
+
+    def put_blob(self, key, data):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO blobs (key, data) VALUES (?, ?)", (key, sqlite3.Binary(data)))
+
+    def get_blob(self, key):
+        row = self._conn().execute("SELECT data FROM blobs WHERE key = ?", (key,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def cache_set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires),
+            )
+
+    def cache_get(self, key):
+        row = self._conn().execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def queue_push(self, name, item):
+        with self._conn() as conn:
+            conn.execute("INSERT OR IGNORE INTO queues (name, item, added) VALUES (?, ?, ?)",
+                         (name, item, time.time()))
+
+    def queue_items(self, name):
+        rows = self._conn().execute("SELECT item FROM queues WHERE name = ? ORDER BY added", (name,))
+        return [row[0] for row in rows]
+
+    def queue_remove(self, name, item):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM queues WHERE name = ? AND item = ?", (name, item))
+
+    def prune(self, max_age):
+        # Drops batches older than max_age seconds with their jobs, blobs
+        # and result cache entries, plus expired cache entries; returns the
+        # number of batches dropped
+        conn = self._conn()
+        queued = [row[0] for row in conn.execute("SELECT DISTINCT item FROM queues")]
+        kept = _kept(queued, self.get_batch)
+        cutoff = time.time() - max_age
+        old = [row[0] for row in conn.execute("SELECT batch_id FROM batches WHERE updated < ?", (cutoff,))]
+        pruned = 0
+        for batch_id in old:
+            if batch_id in kept:
+                continue
+            # One transaction per batch keeps the write lock short
+            with self._write() as conn:
+                if not conn.execute("DELETE FROM batches WHERE batch_id = ? AND updated < ?",
+                                    (batch_id, cutoff)).rowcount:
+                    continue
+                conn.execute("DELETE FROM jobs WHERE batch_id = ?", (batch_id,))
+                # Blob keys start with "<batch_id>/"; "0" sorts right after "/"
+                conn.execute("DELETE FROM blobs WHERE key >= ? AND key < ?", (batch_id + "/", batch_id + "0"))
+                conn.execute("DELETE FROM cache WHERE substr(value, 1, ?) = ?",
+                             (len(batch_id) + 2, json.dumps(batch_id + "/")[:-1]))
+            pruned += 1
+        with self._write() as conn:
+            conn.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+        return pruned
+
+
+class RedisStore:
+    # Same interface on top of a Redis-compatible client (bytes in, bytes out)
+    def __init__(self, client):
+        self.client = client
+
+    def put_batch(self, batch_id, **fields):
+        key = f"batch:{batch_id}"
+
+        def merge(pipe):
+            # WATCH makes the transaction fail (and retry) if another writer
+            # changed the record after the read
+            raw = pipe.get(key)
+            data = json.loads(raw) if raw else {"batch_id": batch_id}
+            data.update(fields)
+            data["updated"] = time.time()
+            pipe.multi()
+            pipe.set(key, json.dumps(data))
+
+        self.client.transaction(merge, key)
+
+    def get_batch(self, batch_id):
+        raw = self.client.get(f"batch:{batch_id}")
+        if raw is None:
+            return None
+        batch = json.loads(raw)
+        jobs = self.client.hgetall(f"jobs:{batch_id}")
+        batch["jobs"] = dict(sorted((int(idx), json.loads(data)) for idx, data in jobs.items()))
+        return batch
+
+    def put_job(self, batch_id, idx, **fields):
+        name = f"jobs:{batch_id}"
+
+        def merge(pipe):
+            raw = pipe.hget(name, str(idx))
+            data = json.loads(raw) if raw else {}
+            data.update(fields)
+            pipe.multi()
+            pipe.hset(name, str(idx), json.dumps(data))
+
+        self.client.transaction(merge, name)
+        self.put_batch(batch_id)
+
+    def put_blob(self, key, data):
+        self.client.set(f"blob:{key}", bytes(data))
+
+    def get_blob(self, key):
+        return self.client.get(f"blob:{key}")
+
+    def cache_set(self, key, value, ttl=None):
+        self.client.set(f"cache:{key}", json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def cache_get(self, key):
+        raw = self.client.get(f"cache:{key}")
+        return json.loads(raw) if raw else None
+
+    def queue_push(self, name, item):
+        # An item already queued keeps its place
+        if item not in self.queue_items(name):
+            self.client.rpush(f"queue:{name}", item)
+
+    def queue_items(self, name):
+        return [item.decode() for item in self.client.lrange(f"queue:{name}", 0, -1)]
+
+    def queue_remove(self, name, item):
+        self.client.lrem(f"queue:{name}", 0, item)
+
+    def prune(self, max_age):
+        # Same as SQLiteStore.prune; expired cache entries go by themselves
+        queued = set()
+        for name in self.client.scan_iter("queue:*"):
+            queued.update(item.decode() for item in self.client.lrange(name.decode(), 0, -1))
+        kept = _kept(queued, self.get_batch)
+        cutoff = time.time() - max_age
+        pruned = set()
+        for key in self.client.scan_iter("batch:*"):
+            batch_id = key.decode()[len("batch:"):]
+            if batch_id not in kept and self._drop(batch_id, cutoff):
+                pruned.add(batch_id)
+        if pruned:
+            for key in self.client.scan_iter("cache:*"):
+                key = key.decode()
+                value = json.loads(self.client.get(key) or "null")
+                if isinstance(value, str) and value.split("/")[0] in pruned:
+                    self.client.delete(key)
+        return len(pruned)
+
+    def _drop(self, batch_id, cutoff):
+        key = f"batch:{batch_id}"
+        blobs = list(self.client.scan_iter(f"blob:{batch_id}/*"))
+
+        def drop(pipe):
+            raw = pipe.get(key)
+            if raw is None or json.loads(raw).get("updated", 0) >= cutoff:
+                return False
+            pipe.multi()
+            pipe.delete(key, f"jobs:{batch_id}", *blobs)
+            return True
+
+        return self.client.transaction(drop, key, value_from_callable=True)
+
+
+class LocalRedis:
+    # In-process stand-in for the few Redis commands RedisStore uses
+    def __init__(self):
+        # Reentrant, so transaction() can hold it while the callback runs
+        self._lock = threading.RLock()
+        self._data = {}
+        self._expires = {}
+
+    @staticmethod
+    def _encode(value):
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def _alive(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires < time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._data
+
+    def get(self, key):
+        with self._lock:
+            return self._data[key] if self._alive(key) else None
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = self._encode(value)
+            if ex:
+                self._expires[key] = time.time() + ex
+            else:
+                self._expires.pop(key, None)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            deleted = 0
+            for key in keys:
+                key = key.decode() if isinstance(key, bytes) else key
+                self._expires.pop(key, None)
+                deleted += self._data.pop(key, None) is not None
+            return deleted
+
+    def scan_iter(self, match="*"):
+        with self._lock:
+            keys = [key for key in list(self._data) if self._alive(key) and fnmatchcase(key, match)]
+        return [key.encode() for key in keys]
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        # Nothing else can run while the lock is held, so WATCH never fails;
+        # the client itself stands in for the pipeline
+        with self._lock:
+            value = func(self)
+        return value if value_from_callable else []
+
+    def multi(self):
+        pass
+
+    def hget(self, name, key):
+        with self._lock:
+            if not self._alive(name):
+                return None
+            return self._data[name].get(self._encode(key))
+
+    def hset(self, name, key, value):
+        with self._lock:
+            if not self._alive(name):
+                self._data[name] = {}
+            self._data[name][self._encode(key)] = self._encode(value)
+        return 1
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._data[name]) if self._alive(name) else {}
+
+    def rpush(self, name, value):
+        with self._lock:
+            if not self._alive(name):
+                self._data[name] = []
+            self._data[name].append(self._encode(value))
+            return len(self._data[name])
+
+    def lrange(self, name, start, end):
+        with self._lock:
+            items = self._data[name] if self._alive(name) else []
+            return list(items[start:None if end == -1 else end + 1])
+
+    def lrem(self, name, count, value):
+        # Only count=0 (remove all) is used
+        with self._lock:
+            if not self._alive(name):
+                return 0
+            before = len(self._data[name])
+            self._data[name] = [item for item in self._data[name] if item != self._encode(value)]
+            return before - len(self._data[name])
+
+
+def _kept(queued, get_batch):
+    # IDs prune() must not touch: queued batches and the items of queued runs
+    kept = set(queued)
+    for batch_id in queued:
+        kept.update(item["batch_id"] for item in (get_batch(batch_id) or {}).get("items", []))
+    return kept
+
+
+def fingerprint(payload):
+    # Cache key for a request: everything that determines the image
+    keys = ("prompt", "width", "height", "seed", "guidance_scale", "num_inference_steps", "scheduler")
+    canonical = json.dumps({k: payload.get(k) for k in keys}, sort_keys=True)
+    return hashlib.sha256(canonical.encode()).hexdigest()
@@ -0,0 +1,66 @@
+import flux_eta
+from flux_upscale import render_size
+
+# Latency-target mode: instead of a scheduler the user names a wall time and
+# the first combination on this ladder that the ETA model expects to finish
+# in time is used. Resolutions below 1.0 are rendered small and upscaled
+# locally (see flux_upscale).
+
+# (scheduler, num_inference_steps, render factor), best quality first
+TARGET_LADDER = [
+    ("Premium-Qualität", 100, 1.0),
+    ("Premium-Qualität", 75, 1.0),
+    ("Premium-Qualität", 50, 1.0),
+    ("Standard-Produktion", 50, 1.0),
+    ("Standard-Produktion", 40, 1.0),
+    ("Standard-Produktion", 30, 1.0),
+    ("Standard-Produktion", 30, 0.75),
+    ("Schnellvorschau", 20, 1.0),
+    ("Schnellvorschau", 20, 0.75),
+    ("Schnellvorschau", 20, 0.5),
+]
+
+# Used until the model has enough samples: fixed overhead, seconds per
+# megapixel at 50 steps and per job already in flight
+PRIOR_OVERHEAD = 2.0
+PRIOR_SECONDS_PER_MEGAPIXEL = 8.0
+PRIOR_SECONDS_PER_QUEUED = 1.0
+
+
+def prior_seconds(width, height, steps, queue_depth=0):
+    return (PRIOR_OVERHEAD + PRIOR_SECONDS_PER_MEGAPIXEL * width * height / 1e6 * steps / 50.0
+            + PRIOR_SECONDS_PER_QUEUED * queue_depth)
+
+
+def predict(model, width, height, steps, scheduler, queue_depth):
+    # (seconds, from_model)
+    x = flux_eta.features(width, height, steps, scheduler, queue_depth)
+    seconds = model.predict(x) if model is not None else None
+    if seconds is None:
+        return prior_seconds(width, height, steps, queue_depth), False
+    return seconds, True
+
+
+def plan_for_target(model, target, width, height, num_images=1, in_flight=0):
+    # The slowest job of a batch is the one submitted last, with the other
+    # variants already queued in front of it
+    queue_depth = in_flight + num_images - 1
+    plan = None
+    for scheduler, steps, factor in TARGET_LADDER:
+        render_width, render_height = (width, height) if factor == 1.0 else render_size(width, height, factor)
+        if factor != 1.0 and render_width >= width and render_height >= height:
+            continue
+        seconds, from_model = predict(model, render_width, render_height, steps, scheduler, queue_depth)
+        plan = {
+            "scheduler": scheduler,
+            "num_inference_steps": steps,
+            "render_width": render_width,
+            "render_height": render_height,
+            "predicted": round(seconds, 1),
+            "from_model": from_model,
+            "fits": seconds <= target,
+        }
+        if plan["fits"]:
+            return plan
+    # Nothing fits: the cheapest combination, marked as such
+    return plan
@@ -0,0 +1,160 @@
+import io
+import math
+import struct
+import threading
+import tempfile
+import time
+import zlib
+
+import numpy as np
+from PIL import Image
+
+# Poster mode: a canvas larger than the API limit is split into overlapping
+# tiles that share seed and prompt. Tiles are blended into a memory-mapped
+# float canvas one at a time and the PNG is written from it in row strips,
+# so a poster never exists as several full copies in RAM.
+
+MAX_TILE = 1024
+MIN_OVERLAP = 128
+# Rows per strip when the PNG is written
+PNG_STRIP = 64
+
+
+def _positions(length, tile, overlap):
+    # Evenly spread tile offsets so that neighbours overlap by >= overlap
+    count = max(1, math.ceil((length - overlap) / (tile - overlap)))
+    if count == 1:
+        return [0]
+    return [int(round(i * (length - tile) / (count - 1))) for i in range(count)]
+
+
+def plan_tiles(width, height, max_tile=MAX_TILE, overlap=MIN_OVERLAP):
+    # All tiles have the same size (multiple of 32); the canvas itself can
+    # be any size
+    def tile_size(length):
+        if length <= max_tile:
+            return int(math.ceil(length / 32.0)) * 32
+        count = math.ceil((length - overlap) / (max_tile - overlap))
+        return min(max_tile, int(math.ceil((length + (count - 1) * overlap) / count / 32.0)) * 32)
+
+    tile_width, tile_height = tile_size(width), tile_size(height)
+    return {
+        "width": width,
+        "height": height,
+        "tile_width": tile_width,
+        "tile_height": tile_height,
+        "xs": _positions(width, tile_width, overlap) if width > tile_width else [0],
+        "ys": _positions(height, tile_height, overlap) if height > tile_height else [0],
+    }
+
+
+def tiles(plan):
+    # Row-major list of (row, col, x, y)
+    return [(row, col, x, y)
+            for row, y in enumerate(plan["ys"])
+            for col, x in enumerate(plan["xs"])]
+
+
+def tile_payloads(prompt, plan, model_params):
+    # One seed for the whole poster keeps style and lighting consistent;
+    # the prompt tells each tile which part of the composition it is
+    params = dict(model_params)
+    if params.get("seed", -1) == -1:
+        params["seed"] = int(time.time() * 1000) % 2147483647
+    rows, cols = len(plan["ys"]), len(plan["xs"])
+    payloads = []
+    for row, col, _, _ in tiles(plan):
+        payloads.append({
+            'prompt': f"{prompt}. Section {row * cols + col + 1} of a {cols}x{rows} grid "
+                      f"(row {row + 1}, column {col + 1}) of one large seamless poster, "
+                      f"consistent style, lighting and color throughout.",
+            'width': plan["tile_width"],
+            'height': plan["tile_height"],
+            'num_outputs': 1,
+            **params,
+        })
+    return payloads
+
+
+def _ramp(positions, index, tile):
+    # 1D blend weights of one tile: linear ramps over the overlap with each
+    # neighbour. Two neighbouring ramps add up to exactly 1, and so do the
+    # separable 2D products in the corners.
+    weights = np.ones(tile, dtype=np.float32)
+    if index > 0:
+        overlap = positions[index - 1] + tile - positions[index]
+        weights[:overlap] = (np.arange(overlap, dtype=np.float32) + 0.5) / overlap
+    if index < len(positions) - 1:
+        overlap = positions[index] + tile - positions[index + 1]
+        weights[tile - overlap:] = 1 - (np.arange(overlap, dtype=np.float32) + 0.5) / overlap
+    return weights
+
+
+class PosterCanvas:
+    def __init__(self, plan, path=None):
+        self.plan = plan
+        self._file = None
+        if path is None:
+            self._file = tempfile.NamedTemporaryFile(suffix=".canvas")
+            path = self._file.name
+        self.canvas = np.memmap(path, dtype=np.float32, mode="w+",
+                                shape=(plan["height"], plan["width"], 3))
+        # Indexes of the tiles blended so far
+        self.added = set()
+        self._lock = threading.Lock()
+
+    def add(self, index, image_data):
+        # Blend one tile into the canvas; only this tile is decoded. Safe to
+        # call from several download threads, overlaps are blended in turn.
+        row, col, x, y = tiles(self.plan)[index]
+        plan = self.plan
+        image = Image.open(io.BytesIO(image_data)).convert("RGB")
+        if image.size != (plan["tile_width"], plan["tile_height"]):
+            image = image.resize((plan["tile_width"], plan["tile_height"]), Image.LANCZOS)
+        weights = (_ramp(plan["ys"], row, plan["tile_height"])[:, None]
+                   * _ramp(plan["xs"], col, plan["tile_width"])[None, :])
+        # Tiles can reach past the canvas when it is not a multiple of 32
+        h = min(plan["tile_height"], plan["height"] - y)
+        w = min(plan["tile_width"], plan["width"] - x)
+        pixels = np.asarray(image, dtype=np.float32)[:h, :w] * weights[:h, :w, None]
+        with self._lock:
+            self.canvas[y:y + h, x:x + w] += pixels
+            self.added.add(index)
+
+    def write_png(self, dest):
+        # Stream the canvas into a PNG (8-bit RGB), strip by strip
+        height, width = self.plan["height"], self.plan["width"]
+        dest.write(b"\x89PNG\r\n\x1a\n")
+        _chunk(dest, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        compressor = zlib.compressobj(6)
+        filters = np.zeros((PNG_STRIP, 1), dtype=np.uint8)
+        for top in range(0, height, PNG_STRIP):
+            strip = np.clip(np.rint(self.canvas[top:top + PNG_STRIP]), 0, 255).astype(np.uint8)
+            rows = np.hstack((filters[:len(strip)], strip.reshape(len(strip), -1)))
+            data = compressor.compress(rows.tobytes())
+            if data:
+                _chunk(dest, b"IDAT", data)
+        _chunk(dest, b"IDAT", compressor.flush())
+        _chunk(dest, b"IEND", b"")
+
+    def to_png(self):
+        # The PNG as bytes. It is streamed into a temporary file and read
+        # back in one allocation of the exact size; a BytesIO over-allocates
+        # as it grows, which put the peak at about 1.4 times the PNG
+        with tempfile.TemporaryFile() as f:
+            self.write_png(f)
+            f.seek(0)
+            return f.read()
+
+    def close(self):
+        # Dropping the last reference unmaps the file
+        self.canvas = None
+        if self._file is not None:
+            self._file.close()
+
+
+def _chunk(dest, kind, data):
+    dest.write(struct.pack(">I", len(data)))
+    dest.write(kind)
+    dest.write(data)
+    dest.write(struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
@@ -0,0 +1,70 @@
+import io
+import math
+
+import numpy as np
+from PIL import Image, ImageFilter, PngImagePlugin
+
+from flux_workers import get_pool
+
+# "Render small, upscale locally": the API renders at a fraction of the
+# requested size and the CPU brings it back up with Lanczos plus an optional
+# unsharp mask. API time grows with pixel count, local upscaling is a few
+# hundred milliseconds.
+
+# Fractions of the requested size offered in the UI
+RENDER_FACTORS = [0.5, 0.75]
+
+
+def render_size(width, height, factor):
+    # Render size close to factor × the requested size with exactly the
+    # requested aspect ratio, so the upscale does not stretch the image.
+    # BFL wants multiples of 32 and at least 256 px per side; in units of
+    # 32 px only the scales k/g (g = gcd of both sides) hit multiples of 32
+    # on both, so the allowed one closest to factor is used. Without one
+    # (e.g. 1024×256) the request is rendered at full size.
+    if width % 32 or height % 32:
+        return width, height
+    units_w, units_h = width // 32, height // 32
+    steps = math.gcd(units_w, units_h)
+    best = None
+    for k in range(1, steps):
+        render_width, render_height = units_w // steps * k * 32, units_h // steps * k * 32
+        if min(render_width, render_height) < 256:
+            continue
+        if best is None or abs(k / steps - factor) < abs(best[0] - factor):
+            best = (k / steps, render_width, render_height)
+    return (best[1], best[2]) if best else (width, height)
+
+
+def sharpen(image, amount=0.6, radius=1.2, threshold=2):
+    # Unsharp mask: add back the difference to a blurred copy, but only
+    # where it is above threshold so flat areas do not get noisy
+    pixels = np.asarray(image, dtype=np.int16)
+    blurred = np.asarray(image.filter(ImageFilter.GaussianBlur(radius)), dtype=np.int16)
+    detail = pixels - blurred
+    mask = np.abs(detail) >= threshold
+    sharpened = pixels + (amount * detail * mask).astype(np.int16)
+    return Image.fromarray(np.clip(sharpened, 0, 255).astype(np.uint8), image.mode)
+
+
+def upscale_image(image_data, width, height, apply_sharpen=True):
+    # Runs in a worker process
+    image = Image.open(io.BytesIO(image_data))
+    # Text chunks (the parameters from flux_pngmeta.stamp) go into the new
+    # PNG as it is encoded, so it needs no second stamp
+    info = PngImagePlugin.PngInfo()
+    for key, value in getattr(image, "text", {}).items():
+        info.add_itxt(key, value)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+    upscaled = image.resize((width, height), Image.LANCZOS)
+    if apply_sharpen:
+        upscaled = sharpen(upscaled)
+    buffer = io.BytesIO()
+    upscaled.save(buffer, "PNG", pnginfo=info)
+    return buffer.getvalue()
+
+
+def upscale_all(images, width, height, apply_sharpen=True):
+    futures = [get_pool().submit(upscale_image, data, width, height, apply_sharpen) for data in images]
+    return [future.result() for future in futures]
@@ -0,0 +1,302 @@
+import multiprocessing
+import multiprocessing.context
+import os
+import sys
+import threading
+import time
+import types
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import flux_metrics
+
+# Process pool for the CPU-bound image stages (decode, resize, transcode,
+# hashing). Image buffers go to the workers through shared memory instead
+# of being pickled down the pool's pipe, and large byte results come back
+# the same way. submit() blocks once max_in_flight tasks are queued, so a
+# burst from one session cannot pile up unbounded work, and workers are
+# replaced after max_tasks_per_child tasks so leaks in the image libraries
+# do not accumulate. Each task reports how long it waited for a worker and
+# how long it computed. A worker that dies (e.g. out of memory on a huge
+# decode) breaks the executor; it is rebuilt and the tasks that were on it
+# are retried once, one at a time, so a task that crashes its worker again
+# fails alone.
+
+# Results of at least this size come back through shared memory
+SHARE_THRESHOLD = 64 * 1024
+MAX_TASKS_PER_CHILD = 200
+# Imported once by the fork server, so workers start with the stage code
+# loaded
+PRELOAD = ["flux_workers", "flux_analysis", "flux_export", "flux_palette", "flux_upscale"]
+# Extra tries for a task whose executor broke under it
+BROKEN_RETRIES = 1
+
+
+class _Shared:
+    # Stands in for a bytes result the worker left in a shared segment
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+
+def _share_out(value):
+    if isinstance(value, bytes) and len(value) >= SHARE_THRESHOLD:
+        segment = shared_memory.SharedMemory(create=True, size=len(value))
+        segment.buf[:len(value)] = value
+        segment.close()
+        return _Shared(segment.name, len(value))
+    if isinstance(value, (list, tuple)):
+        return type(value)(_share_out(item) for item in value)
+    if isinstance(value, dict):
+        return {key: _share_out(item) for key, item in value.items()}
+    return value
+
+
+def _take_in(value):
+    # Parent side: copy shared results into bytes and free the segments
+    if isinstance(value, _Shared):
+        segment = shared_memory.SharedMemory(name=value.name)
+        try:
+            return bytes(segment.buf[:value.size])
+        finally:
+            segment.close()
+            segment.unlink()
+    if isinstance(value, (list, tuple)):
+        return type(value)(_take_in(item) for item in value)
+    if isinstance(value, dict):
+        return {key: _take_in(item) for key, item in value.items()}
+    return value
+
+
+def _run(fn, name, size, args):
+    # Runs in a worker process
+    started = time.time()
+    segment = shared_memory.SharedMemory(name=name)
+    try:
+        data = bytes(segment.buf[:size])
+    finally:
+        segment.close()
+    result = _share_out(fn(data, *args))
+    return result, started, time.time()
+
+
+# Workers import whatever __main__ is when they start, and under
+# `streamlit run` that is the app script (secrets, widgets, pools). They
+# start with this empty module as __main__ instead; the stage functions
+# live in importable modules.
+_WORKER_MAIN = types.ModuleType("__main__")
+_main_lock = threading.Lock()
+
+
+def _start_without_main(start):
+    def wrapper(self):
+        with _main_lock:
+            main = sys.modules["__main__"]
+            sys.modules["__main__"] = _WORKER_MAIN
+            try:
+                start(self)
+            finally:
+                # A Streamlit rerun may have installed its own __main__ since
+                if sys.modules["__main__"] is _WORKER_MAIN:
+                    sys.modules["__main__"] = main
+    return wrapper
+
+
+class _ForkServerProcess(multiprocessing.context.ForkServerProcess):
+    start = _start_without_main(multiprocessing.context.ForkServerProcess.start)
+
+
+class _SpawnProcess(multiprocessing.context.SpawnProcess):
+    start = _start_without_main(multiprocessing.context.SpawnProcess.start)
+
+
+class _ForkServerContext(multiprocessing.context.ForkServerContext):
+    Process = _ForkServerProcess
+
+
+class _SpawnContext(multiprocessing.context.SpawnContext):
+    Process = _SpawnProcess
+
+
+class WorkerPool:
+    def __init__(self, workers=None, max_in_flight=None, max_tasks_per_child=MAX_TASKS_PER_CHILD):
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_in_flight = max_in_flight or self.workers * 4
+        self.max_tasks_per_child = max_tasks_per_child
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {}
+        self._retries = deque()
+        self._retrying = False
+        self._executor = self._new_executor()
+
+    def _new_executor(self):
+        # Worker recycling needs a start method other than fork; forkserver
+        # also keeps the app's threads out of the workers
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = _ForkServerContext()
+            context.set_forkserver_preload(PRELOAD)
+        else:
+            context = _SpawnContext()
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            max_tasks_per_child=self.max_tasks_per_child,
+        )
+
+    def _rebuild(self, broken):
+        # Replace the executor once, however many tasks saw it break
+        with self._lock:
+            if self._executor is broken:
+                flux_metrics.incr("workers.rebuilt")
+                self._executor = self._new_executor()
+                broken.shutdown(wait=False, cancel_futures=True)
+            return self._executor
+
+    def submit(self, fn, data, *args):
+        # fn(data, *args) in a worker; data is any bytes-like image buffer.
+        # Returns a Future of the result.
+        submitted = time.time()
+        self._slots.acquire()
+        segment = None
+        try:
+            segment = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+            segment.buf[:len(data)] = data
+        except BaseException:
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_flight += 1
+        task = {"fn": fn, "args": args, "segment": segment, "size": len(data),
+                "submitted": submitted, "retries": BROKEN_RETRIES, "outer": Future()}
+        self._dispatch(task)
+        return task["outer"]
+
+    def _dispatch(self, task):
+        executor = self._executor
+        try:
+            inner = executor.submit(_run, task["fn"], task["segment"].name, task["size"], task["args"])
+        except BrokenProcessPool:
+            # Broke before this task got in; it has not run, so no retry used
+            executor = self._rebuild(executor)
+            try:
+                inner = executor.submit(_run, task["fn"], task["segment"].name, task["size"], task["args"])
+            except BaseException as e:
+                self._done(task)
+                task["outer"].set_exception(e)
+                return
+        except BaseException as e:
+            self._done(task)
+            task["outer"].set_exception(e)
+            return
+        inner.add_done_callback(lambda f: self._finish(f, task, executor))
+
+    def _retry(self, task):
+        with self._lock:
+            self._retries.append(task)
+            if self._retrying:
+                return
+            self._retrying = True
+        self._next_retry()
+
+    def _next_retry(self):
+        with self._lock:
+            if not self._retries:
+                self._retrying = False
+                return
+            task = self._retries.popleft()
+        task["serial"] = True
+        self._dispatch(task)
+
+    def _done(self, task):
+        task["segment"].close()
+        task["segment"].unlink()
+        self._slots.release()
+        with self._lock:
+            self._in_flight -= 1
+        if task.pop("serial", False):
+            self._next_retry()
+
+    def _finish(self, inner, task, executor):
+        try:
+            result, started, finished = inner.result()
+            result = _take_in(result)
+        except BrokenProcessPool as e:
+            self._rebuild(executor)
+            if task.pop("serial", False):
+                # Its slot in the retry line is over either way
+                self._next_retry()
+            if task["retries"] > 0:
+                # The input is still in its segment, run it on the new workers
+                task["retries"] -= 1
+                flux_metrics.incr("workers.retried")
+                self._retry(task)
+                return
+            self._done(task)
+            flux_metrics.incr("workers.errors")
+            task["outer"].set_exception(e)
+            return
+        except BaseException as e:
+            self._done(task)
+            flux_metrics.incr("workers.errors")
+            task["outer"].set_exception(e)
+            return
+        self._done(task)
+        self._record(task["fn"].__name__, started - task["submitted"], finished - started)
+        task["outer"].set_result(result)
+
+    def _record(self, name, wait, compute):
+        with self._lock:
+            stats = self._stats.setdefault(name, {"tasks": 0, "wait": 0.0, "compute": 0.0})
+            stats["tasks"] += 1
+            stats["wait"] += max(0.0, wait)
+            stats["compute"] += compute
+        flux_metrics.incr("workers.tasks")
+        flux_metrics.set_gauge("workers.last_queue_wait_ms", round(max(0.0, wait) * 1000, 1))
+        flux_metrics.set_gauge("workers.last_compute_ms", round(compute * 1000, 1))
+
+    def map(self, fn, images, *args):
+        # fn over every buffer, results in order
+        return [future.result() for future in [self.submit(fn, data, *args) for data in images]]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_in_flight": self.max_in_flight,
+                "max_tasks_per_child": self.max_tasks_per_child,
+                "in_flight": self._in_flight,
+                "stages": {
+                    name: {
+                        "tasks": s["tasks"],
+                        "avg_queue_wait_ms": round(s["wait"] * 1000 / s["tasks"], 1),
+                        "avg_compute_ms": round(s["compute"] * 1000 / s["tasks"], 1),
+                    }
+                    for name, s in sorted(self._stats.items())
+                },
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor = self._executor
+        executor.shutdown()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # Process-wide pool shared by all sessions
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool()
+            flux_metrics.register("workers", _pool.snapshot)
+        return _pool
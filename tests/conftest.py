@@ -0,0 +1,7 @@
+# Unit tests for the modules without a Streamlit dependency
+#
+#   python -m pytest tests
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
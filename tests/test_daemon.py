@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+from flux_daemon import in_window, parse_windows
+
+
+def at(hour, minute):
+    return time.struct_time((2026, 1, 1, hour, minute, 0, 3, 1, -1))
+
+
+def test_parse_windows():
+    assert parse_windows("22:00-06:00,12:00-13:30") == [(1320, 360), (720, 810)]
+    assert parse_windows(" 9:05 - 17:00 , ") == [(545, 1020)]
+    assert parse_windows("") == []
+    assert parse_windows(None) == []
+
+
+@pytest.mark.parametrize("text", [
+    "22", "22:00", "22:00-", "-06:00", "22-06", "22:00-06:00-08:00", "ab:cd-ef:gh", "22:0-06:00",
+])
+def test_malformed_window_names_the_entry(text):
+    with pytest.raises(ValueError, match="HH:MM-HH:MM") as info:
+        parse_windows(f"12:00-13:00,{text}")
+    assert repr(text.strip()) in str(info.value)
+
+
+@pytest.mark.parametrize("text", ["25:00-03:00", "22:00-24:00", "12:60-13:00", "12:00-13:75"])
+def test_out_of_range_window_names_the_entry(text):
+    with pytest.raises(ValueError, match="00:00 to 23:59") as info:
+        parse_windows(text)
+    assert repr(text) in str(info.value)
+
+
+def test_empty_window_is_rejected():
+    with pytest.raises(ValueError, match="same"):
+        parse_windows("06:00-06:00")
+
+
+def test_in_window_wraps_around_midnight():
+    windows = parse_windows("22:00-06:00")
+    assert in_window(windows, at(23, 30))
+    assert in_window(windows, at(5, 59))
+    assert not in_window(windows, at(6, 0))
+    assert not in_window(windows, at(12, 0))
+    assert in_window([], at(12, 0))
@@ -0,0 +1,67 @@
+import itertools
+import time
+
+from flux_generation import run_batch
+from flux_hedging import HedgePolicy, LatencyHistory
+from flux_routing import Router
+
+ENDPOINTS = [
+    {"name": "test-hedge", "url": "https://hedge.invalid", "result_url": "https://hedge.invalid/r",
+     "quality": "standard"},
+]
+PAYLOAD = {"prompt": "x", "width": 512, "height": 512, "seed": 1, "num_inference_steps": 20}
+
+
+def fake_api(monkeypatch, statuses):
+    # statuses: request ID -> function(seconds since its submit) -> status
+    ids = itertools.count()
+    submitted = []
+
+    def submit(endpoint, key, payload, policy):
+        request_id = f"id{next(ids)}"
+        submitted.append(request_id)
+        return {"id": request_id, "polling_url": endpoint["result_url"], "endpoint": endpoint,
+                "submitted_at": time.time()}
+
+    def get_result(attempt, key):
+        status = statuses[attempt["id"]](time.time() - attempt["submitted_at"])
+        if status == "Ready":
+            return {"status": status, "result": {"sample": f"https://img.invalid/{attempt['id']}"}}
+        return {"status": status}
+
+    monkeypatch.setattr("flux_generation.submit", submit)
+    monkeypatch.setattr("flux_generation.get_result", get_result)
+    return submitted
+
+
+def hedge_policy(history, min_delay):
+    history.add(0.0)
+    return HedgePolicy(history, percentile=50, max_extra_per_batch=1, min_samples=1, min_delay=min_delay)
+
+
+def test_hedge_does_not_use_up_resubmits(monkeypatch):
+    submitted = fake_api(monkeypatch, {
+        "id0": lambda waited: "Pending" if waited < 0.1 else "Error",
+        "id1": lambda waited: "Error",
+        "id2": lambda waited: "Ready",
+    })
+    results = run_batch([PAYLOAD], "key", Router(ENDPOINTS), "standard",
+                        hedge_policy=hedge_policy(LatencyHistory(), 0.02), poll_interval=0.01, max_submits=2)
+    # The original, its hedge and the one resubmit max_submits=2 allows
+    assert submitted == ["id0", "id1", "id2"]
+    assert results == ["https://img.invalid/id2"]
+
+
+def test_latency_is_measured_from_the_first_submit(monkeypatch):
+    fake_api(monkeypatch, {
+        "id0": lambda waited: "Pending",
+        "id1": lambda waited: "Ready",
+    })
+    history = LatencyHistory()
+    results = run_batch([PAYLOAD], "key", Router(ENDPOINTS), "standard",
+                        hedge_policy=hedge_policy(history, 0.2), latency_history=history, poll_interval=0.01)
+    assert results == ["https://img.invalid/id1"]
+    # The hedge itself was ready on its first poll; the sample still covers
+    # the wait before it was sent
+    assert len(history) == 2
+    assert history.percentile(100) >= 0.2
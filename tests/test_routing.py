@@ -0,0 +1,67 @@
+import flux_metrics
+from flux_generation import run_batch
+from flux_resilience import get_breaker
+from flux_routing import Router
+
+ENDPOINTS = [
+    {"name": "test-pro", "url": "https://pro.invalid", "result_url": "https://pro.invalid/r", "quality": "premium"},
+    {"name": "test-dev", "url": "https://dev.invalid", "result_url": "https://dev.invalid/r", "quality": "draft"},
+]
+PAYLOAD = {"prompt": "x", "width": 512, "height": 512, "seed": 1, "num_inference_steps": 20}
+
+
+def open_breaker(name):
+    breaker = get_breaker(name)
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    return breaker
+
+
+def close_breaker(name):
+    get_breaker(name).record_success()
+
+
+def test_no_downgrade_when_premium_breaker_is_open():
+    open_breaker("test-pro")
+    try:
+        router = Router(ENDPOINTS)
+        available = lambda ep: not get_breaker(ep["name"]).is_open()
+        for quality in ("premium", "standard"):
+            assert router.choose(quality, available=available) is None
+        assert router.choose("draft", available=available)["name"] == "test-dev"
+        assert router.choose("premium", available=available, allow_downgrade=True)["name"] == "test-dev"
+    finally:
+        close_breaker("test-pro")
+
+
+def test_run_batch_fails_premium_jobs_instead_of_downgrading(monkeypatch):
+    submitted = []
+    monkeypatch.setattr("flux_generation.submit", lambda endpoint, *args: submitted.append(endpoint["name"]))
+    open_breaker("test-pro")
+    try:
+        chosen = flux_metrics.snapshot()["counters"].get("routing.test-dev.chosen", 0)
+        errors = []
+        results = run_batch([PAYLOAD, PAYLOAD], "key", Router(ENDPOINTS), "premium", poll_interval=0.01,
+                            on_done=lambda index, url, done, total, error: errors.append(error))
+    finally:
+        close_breaker("test-pro")
+    assert results == []
+    assert submitted == []
+    assert len(errors) == 2 and all("premium" in error for error in errors)
+    assert flux_metrics.snapshot()["counters"].get("routing.test-dev.chosen", 0) == chosen
+
+
+def test_explicit_downgrade_is_reported(monkeypatch):
+    monkeypatch.setattr("flux_generation.submit", lambda endpoint, key, payload, policy: {
+        "id": "id", "polling_url": endpoint["result_url"], "endpoint": endpoint, "submitted_at": 0.0})
+    monkeypatch.setattr("flux_generation.get_result", lambda attempt, key: {
+        "status": "Ready", "result": {"sample": "https://img.invalid/1"}})
+    submits = []
+    open_breaker("test-pro")
+    try:
+        results = run_batch([PAYLOAD], "key", Router(ENDPOINTS), "premium", poll_interval=0.01,
+                            allow_downgrade=True, on_submit=lambda index, attempt: submits.append(attempt))
+    finally:
+        close_breaker("test-pro")
+    assert results == ["https://img.invalid/1"]
+    assert [(a["endpoint"]["name"], a["downgraded"]) for a in submits] == [("test-dev", True)]
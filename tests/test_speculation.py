@@ -0,0 +1,62 @@
+import threading
+
+import flux_speculation
+from flux_speculation import Speculator
+
+
+def counts():
+    return flux_speculation.stats_snapshot()
+
+
+def slow_speculator():
+    started = threading.Event()
+    release = threading.Event()
+    cancels = []
+
+    def start(key, cancel):
+        cancels.append(cancel)
+        started.set()
+        release.wait(5)
+        return b"draft"
+
+    speculator = Speculator(start, debounce=0.0)
+    return speculator, started, release, cancels
+
+
+def test_claim_miss_cancels_running_draft_for_other_key():
+    speculator, started, release, cancels = slow_speculator()
+    speculator.observe(("a cat",), now=1.0)
+    speculator.tick(now=2.0)
+    assert started.wait(5)
+    before = counts()
+    assert speculator.claim(("a dog",)) is None
+    after = counts()
+    assert cancels[0].is_set()
+    assert speculator.draft is None
+    assert after["wasted"] == before["wasted"] + 1
+    assert after["misses"] == before["misses"] + 1
+    release.set()
+
+
+def test_claim_miss_cancels_draft_still_running_for_same_key():
+    speculator, started, release, cancels = slow_speculator()
+    speculator.observe(("a cat",), now=1.0)
+    speculator.tick(now=2.0)
+    assert started.wait(5)
+    before = counts()
+    assert speculator.claim(("a cat",)) is None
+    assert cancels[0].is_set()
+    assert counts()["wasted"] == before["wasted"] + 1
+    release.set()
+
+
+def test_claim_hit_keeps_draft():
+    speculator, started, release, cancels = slow_speculator()
+    release.set()
+    speculator.observe(("a cat",), now=1.0)
+    speculator.tick(now=2.0)
+    before = counts()
+    assert speculator.claim(("a cat",), timeout=5) == b"draft"
+    assert not cancels[0].is_set()
+    assert counts()["hits"] == before["hits"] + 1
+    assert counts()["wasted"] == before["wasted"]
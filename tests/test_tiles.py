@@ -0,0 +1,37 @@
+import io
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from flux_tiles import PosterCanvas, plan_tiles
+
+
+def random_canvas(width, height):
+    canvas = PosterCanvas(plan_tiles(width, height))
+    canvas.canvas[:] = np.random.default_rng(1).integers(0, 256, canvas.canvas.shape)
+    return canvas
+
+
+def test_to_png_matches_the_canvas():
+    canvas = random_canvas(1024, 768)
+    try:
+        pixels = np.asarray(Image.open(io.BytesIO(canvas.to_png())))
+        assert pixels.shape == (768, 1024, 3)
+        assert np.array_equal(pixels, canvas.canvas.astype(np.uint8))
+    finally:
+        canvas.close()
+
+
+def test_to_png_holds_one_copy_of_the_png():
+    canvas = random_canvas(2048, 1536)
+    try:
+        tracemalloc.start()
+        png = canvas.to_png()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        canvas.close()
+    # The PNG itself; the row strips are freed before it is read back, and
+    # a growing BytesIO would add about half the PNG again
+    assert peak < len(png) + 2 ** 20
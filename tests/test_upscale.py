@@ -0,0 +1,29 @@
+import pytest
+
+from flux_target import plan_for_target
+from flux_upscale import RENDER_FACTORS, render_size
+
+UI_SIZES = [(w, h) for w in range(128, 1025, 128) for h in range(128, 1025, 128)]
+
+
+@pytest.mark.parametrize("factor", RENDER_FACTORS)
+@pytest.mark.parametrize("width,height", UI_SIZES)
+def test_render_size_keeps_aspect_ratio(width, height, factor):
+    render_width, render_height = render_size(width, height, factor)
+    assert render_width * height == render_height * width
+    assert render_width % 32 == 0 and render_height % 32 == 0
+    if (render_width, render_height) != (width, height):
+        assert min(render_width, render_height) >= 256
+        assert render_width < width
+
+
+def test_wide_and_tall_requests_are_not_stretched():
+    # Clamping each side to 256 px on its own gave 512×256 here
+    assert render_size(1024, 256, 0.5) == (1024, 256)
+    assert render_size(256, 1024, 0.5) == (256, 1024)
+    assert render_size(1024, 384, 0.5) == (768, 288)
+
+
+def test_target_plan_keeps_aspect_ratio():
+    plan = plan_for_target(None, 0.1, 1024, 384)
+    assert plan["render_width"] * 384 == plan["render_height"] * 1024